@@ -1,35 +1,234 @@
+import hashlib
 import logging
-from collections import defaultdict
+from collections import defaultdict, deque
+import multiprocessing
+import time
 from pathlib import Path
 
 import pyfastx
 
 import itertools
 import networkx as nx
-from typing import List, Dict, Iterable, Tuple, Set, Mapping
+import numpy as np
+from typing import (
+    Any,
+    List,
+    Dict,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Tuple,
+    Set,
+    Mapping,
+    Optional,
+    Union,
+)
 from tqdm import tqdm
 
+# Engines available to store the contigs of a bin.
+# "set" stores contigs in a python set, "array" stores contig indices in a sorted int32 numpy array.
+MEMBERSHIP_ENGINES = ("set", "array")
+
+# Engines available to select the final bins.
+# "greedy" picks bins by decreasing score, "optimized" maximizes the total score of the selected bins.
+SELECTION_ENGINES = ("greedy", "optimized")
+
+# Components of overlapping bins with at most this number of bins are solved exactly by the optimized selection.
+# Larger components are improved by local search.
+EXACT_SELECTION_MAX_BIN_COUNT = 40
+
+Contigs = Union[Set, np.ndarray]
+
+
+def make_contig_array(contigs: Iterable[int]) -> np.ndarray:
+    """
+    Build a sorted array of unique contig indices.
+
+    :param contigs: Iterable of contig indices.
+
+    :return: A sorted int32 numpy array of unique contig indices.
+    """
+    if isinstance(contigs, np.ndarray):
+        return np.unique(contigs.astype(np.int32, copy=False))
+
+    return np.unique(np.fromiter(contigs, dtype=np.int32))
+
+
+def intersect_contigs(contigs: Contigs, *others: Contigs) -> Contigs:
+    """
+    Compute the intersection of contig collections stored with the same engine.
+
+    :param contigs: Contigs of the first bin.
+    :param others: Contigs of the other bins.
+
+    :return: The contigs found in all collections.
+    """
+    if isinstance(contigs, np.ndarray):
+        for other in others:
+            contigs = np.intersect1d(contigs, other, assume_unique=True)
+        return contigs
+
+    return contigs.intersection(*others)
+
+
+def subtract_contigs(contigs: Contigs, *others: Contigs) -> Contigs:
+    """
+    Compute the difference between a contig collection and other collections stored with the same engine.
+
+    :param contigs: Contigs of the first bin.
+    :param others: Contigs of the other bins.
+
+    :return: The contigs of the first collection not found in any of the others.
+    """
+    if isinstance(contigs, np.ndarray):
+        if not others:
+            return contigs
+        return contigs[~np.isin(contigs, np.concatenate(others))]
+
+    return contigs.difference(*others)
+
+
+def unite_contigs(contigs: Contigs, *others: Contigs) -> Contigs:
+    """
+    Compute the union of contig collections stored with the same engine.
+
+    :param contigs: Contigs of the first bin.
+    :param others: Contigs of the other bins.
+
+    :return: The contigs found in at least one collection.
+    """
+    if isinstance(contigs, np.ndarray):
+        return np.unique(np.concatenate((contigs,) + others))
+
+    return contigs.union(*others)
+
+
+def contigs_are_equal(contigs: Contigs, other: Contigs) -> bool:
+    """
+    Check whether two contig collections hold the same contigs, whatever their engine.
+
+    :param contigs: First contig collection.
+    :param other: Second contig collection.
+
+    :return: True if both collections contain the same contigs.
+    """
+    if isinstance(contigs, np.ndarray) and isinstance(other, np.ndarray):
+        return np.array_equal(contigs, other)
+    if isinstance(contigs, np.ndarray):
+        contigs = set(contigs.tolist())
+    if isinstance(other, np.ndarray):
+        other = set(other.tolist())
+    return contigs == other
+
+
+def iter_contigs(contigs: Contigs) -> Iterable:
+    """
+    Get the contigs of a contig collection as python objects, whatever its engine.
+
+    :param contigs: A contig collection.
+
+    :return: The contig set itself, or a list of contig indices for arrays.
+    """
+    if isinstance(contigs, np.ndarray):
+        return contigs.tolist()
+    return contigs
+
+
+def get_contig_key(contig) -> int:
+    """
+    Compute the deterministic 128-bit key of a contig from its name.
+
+    Unlike the builtin hash, the key does not depend on PYTHONHASHSEED
+    and is thus identical across processes and runs.
+
+    :param contig: Contig name.
+
+    :return: The 128-bit key of the contig.
+    """
+    digest = hashlib.blake2b(str(contig).encode(), digest_size=16).digest()
+    return int.from_bytes(digest, "little")
+
+
+def make_contig_keys(contig_to_index: Mapping[str, int]) -> np.ndarray:
+    """
+    Build the table of contig keys indexed by contig index.
+
+    Each row holds the key of the contig name split in two little-endian uint64 words,
+    so that the fingerprint of a bin is the same before and after renaming its contigs.
+
+    :param contig_to_index: A dictionary mapping contig names to their index.
+
+    :return: A (n_contigs, 2) uint64 numpy array of contig keys.
+    """
+    size = max(contig_to_index.values(), default=-1) + 1
+    contig_keys = np.zeros((size, 2), dtype=np.uint64)
+    for contig, index in contig_to_index.items():
+        digest = hashlib.blake2b(str(contig).encode(), digest_size=16).digest()
+        contig_keys[index] = np.frombuffer(digest, dtype="<u8")
+    return contig_keys
+
+
+def xor_contig_keys(contigs: Contigs, contig_keys: Optional[np.ndarray] = None) -> int:
+    """
+    Combine the keys of the given contigs with XOR.
+
+    :param contigs: Contig names, or contig indices when contig_keys is provided.
+    :param contig_keys: Table of contig keys indexed by contig index (see make_contig_keys).
+
+    :return: The XOR of the contig keys as a 128-bit integer.
+    """
+    if contig_keys is None:
+        fingerprint = 0
+        for contig in contigs:
+            fingerprint ^= get_contig_key(contig)
+        return fingerprint
+
+    if not len(contigs):
+        return 0
+
+    if not isinstance(contigs, np.ndarray):
+        contigs = np.fromiter(contigs, dtype=np.int64, count=len(contigs))
+
+    low, high = np.bitwise_xor.reduce(contig_keys[contigs], axis=0)
+    return int(low) | int(high) << 64
+
 
 class Bin:
     counter = 0
 
     def __init__(
-        self, contigs: Iterable[str], origin: str, name: str, is_original: bool = False
+        self,
+        contigs: Iterable[str],
+        origin: str,
+        name: str,
+        is_original: bool = False,
+        contig_keys: Optional[np.ndarray] = None,
+        fingerprint: Optional[int] = None,
     ) -> None:
         """
         Initialize a Bin object.
 
         :param contigs: Iterable of contig names belonging to the bin.
+            A numpy array of contig indices stores the contigs with the "array" membership engine.
         :param origin: Origin/source of the bin.
         :param name: Name of the bin.
+        :param contig_keys: Table of contig keys indexed by contig index, used when contigs are indices.
+        :param fingerprint: Content fingerprint of the bin when already known.
         """
         Bin.counter += 1
 
         self.origin = {origin}
         self.name = name
         self.id = Bin.counter
-        self.contigs = set(contigs)
-        self.hash = hash(str(sorted(self.contigs)))
+        if isinstance(contigs, np.ndarray):
+            self.contigs = make_contig_array(contigs)
+        else:
+            self.contigs = set(contigs)
+
+        self.contig_keys = contig_keys
+        if fingerprint is None:
+            fingerprint = xor_contig_keys(self.contigs, contig_keys)
+        self.fingerprint = fingerprint
 
         self.length = None
         self.N50 = None
@@ -40,6 +239,9 @@ class Bin:
 
         self.is_original = is_original
 
+        # Set operation and ids of the bins this bin is derived from, for intermediate bins.
+        self.derivation = None
+
     def __eq__(self, other: "Bin") -> bool:
         """
         Compare the Bin object with another object for equality.
@@ -47,15 +249,17 @@ class Bin:
         :param other: The object to compare with.
         :return: True if the objects are equal, False otherwise.
         """
-        return self.contigs == other.contigs
+        return contigs_are_equal(self.contigs, other.contigs)
 
     def __hash__(self) -> int:
         """
         Compute the hash value of the Bin object.
 
+        The hash is the content fingerprint of the bin, the XOR of the 128-bit keys of its contigs.
+
         :return: The hash value.
         """
-        return self.hash
+        return self.fingerprint
 
     def __str__(self) -> str:
         """
@@ -74,6 +278,8 @@ class Bin:
         :param other: The other Bin object.
         :return: A set of contig names that overlap between the bins.
         """
+        if isinstance(self.contigs, np.ndarray):
+            return set(intersect_contigs(self.contigs, other.contigs).tolist())
         return self.contigs & other.contigs
 
     # def __and__(self, other: 'Bin') -> 'Bin':
@@ -89,6 +295,30 @@ class Bin:
 
     #     return Bin(contigs, origin, name)
 
+    def derived_fingerprint(self, contigs: Contigs) -> int:
+        """
+        Compute the fingerprint of a bin derived from this bin.
+
+        The derived contigs must be a subset or a superset of the contigs of this bin.
+        When the derived bin differs from this bin by fewer contigs than it contains,
+        the fingerprint is updated from this bin fingerprint with the keys of the differing contigs.
+
+        :param contigs: Contigs of the derived bin.
+
+        :return: The fingerprint of the derived bin.
+        """
+        delta_size = abs(len(self.contigs) - len(contigs))
+
+        if delta_size >= len(contigs):
+            return xor_contig_keys(contigs, self.contig_keys)
+
+        if len(contigs) <= len(self.contigs):
+            delta = subtract_contigs(self.contigs, contigs)
+        else:
+            delta = subtract_contigs(contigs, self.contigs)
+
+        return self.fingerprint ^ xor_contig_keys(delta, self.contig_keys)
+
     def add_length(self, length: int) -> None:
         """
         Add the length attribute to the Bin object if the provided length is a positive integer.
@@ -134,12 +364,17 @@ class Bin:
         :param others: Other bins to compute the intersection with.
         :return: A new Bin representing the intersection of the bins.
         """
-        other_contigs = (o.contigs for o in others)
-        contigs = self.contigs.intersection(*other_contigs)
+        contigs = intersect_contigs(self.contigs, *(o.contigs for o in others))
         name = f"{self.id} & {' & '.join([str(other.id) for other in others])}"
         origin = "intersec"
 
-        return Bin(contigs, origin, name)
+        return Bin(
+            contigs,
+            origin,
+            name,
+            contig_keys=self.contig_keys,
+            fingerprint=self.derived_fingerprint(contigs),
+        )
 
     def difference(self, *others: "Bin") -> "Bin":
         """
@@ -148,12 +383,17 @@ class Bin:
         :param others: Other bins to compute the difference with.
         :return: A new Bin representing the difference between the bins.
         """
-        other_contigs = (o.contigs for o in others)
-        contigs = self.contigs.difference(*other_contigs)
+        contigs = subtract_contigs(self.contigs, *(o.contigs for o in others))
         name = f"{self.id} - {' - '.join([str(other.id) for other in others])}"
         origin = "diff"
 
-        return Bin(contigs, origin, name)
+        return Bin(
+            contigs,
+            origin,
+            name,
+            contig_keys=self.contig_keys,
+            fingerprint=self.derived_fingerprint(contigs),
+        )
 
     def union(self, *others: "Bin") -> "Bin":
         """
@@ -162,12 +402,17 @@ class Bin:
         :param others: Other bins to compute the union with.
         :return: A new Bin representing the union of the bins.
         """
-        other_contigs = (o.contigs for o in others)
-        contigs = self.contigs.union(*other_contigs)
+        contigs = unite_contigs(self.contigs, *(o.contigs for o in others))
         name = f"{self.id} | {' | '.join([str(other.id) for other in others])}"
         origin = "union"
 
-        return Bin(contigs, origin, name)
+        return Bin(
+            contigs,
+            origin,
+            name,
+            contig_keys=self.contig_keys,
+            fingerprint=self.derived_fingerprint(contigs),
+        )
 
     def is_complete_enough(self, min_completeness: float) -> bool:
         """
@@ -341,19 +586,50 @@ def get_bins_from_contig2bin_table(contig2bin_table: Path, set_name: str) -> Lis
     return bins
 
 
-def from_bins_to_bin_graph(bins) -> nx.Graph:
+def from_bins_to_bin_graph(
+    bins: Iterable[Bin], contig_to_length: Optional[Mapping] = None
+) -> nx.Graph:
     """
-    Creates a bin graph made of overlapping gram a set of bins.
+    Creates a bin graph made of overlapping bins from a set of bins.
+
+    Overlaps are found with an inverted index mapping each contig to the bins containing it,
+    so the cost scales with the total bin membership instead of the number of bin pairs.
+    Each edge records the number of shared contigs in its "overlap_contigs" attribute
+    and their total length in its "overlap_bp" attribute (0 when contig lengths are not provided).
 
     :param bins: a set of bins
+    :param contig_to_length: Optional mapping of contigs to their length.
 
     :return: A networkx Graph representing the bin graph of overlapping bins.
     """
-    G = nx.Graph()
+    contig_to_bins = defaultdict(list)
+    for bin_obj in sorted(bins, key=lambda b: b.id):
+        contigs = (
+            bin_obj.contigs.tolist()
+            if isinstance(bin_obj.contigs, np.ndarray)
+            else bin_obj.contigs
+        )
+        for contig in contigs:
+            contig_to_bins[contig].append(bin_obj)
+
+    pair_to_overlap_contigs = defaultdict(int)
+    pair_to_overlap_bp = defaultdict(int)
+    for contig, contig_bins in contig_to_bins.items():
+        if len(contig_bins) < 2:
+            continue
+        length = contig_to_length[contig] if contig_to_length is not None else 0
+        for pair in itertools.combinations(contig_bins, 2):
+            pair_to_overlap_contigs[pair] += 1
+            pair_to_overlap_bp[pair] += length
 
-    for bin1, bin2 in itertools.combinations(bins, 2):
-        if bin1.overlaps_with(bin2):
-            G.add_edge(bin1, bin2)
+    G = nx.Graph()
+    for bin1, bin2 in sorted(pair_to_overlap_contigs, key=lambda p: (p[0].id, p[1].id)):
+        G.add_edge(
+            bin1,
+            bin2,
+            overlap_contigs=pair_to_overlap_contigs[(bin1, bin2)],
+            overlap_bp=pair_to_overlap_bp[(bin1, bin2)],
+        )
     return G
 
 
@@ -370,94 +646,451 @@ def get_all_possible_combinations(clique: List) -> Iterable[Tuple]:
     )
 
 
-def get_intersection_bins(G: nx.Graph) -> Set[Bin]:
+# Set operations used to derive new bins from a combination of overlapping bins:
+# origin -> (contig operation, name separator)
+SET_OPERATIONS = {
+    "intersec": (intersect_contigs, "&"),
+    "diff": (subtract_contigs, "-"),
+    "union": (unite_contigs, "|"),
+}
+
+# Set operation and ids of the bins (base bin first) a bin is derived from.
+Derivation = Tuple[str, Tuple[int, ...]]
+
+# Contigs, origins, name and derivation of a derived bin.
+DerivedContent = Tuple[Contigs, Set[str], str, Derivation]
+
+
+def iter_combination_operations(
+    bins: Tuple[Bin, ...], min_completeness: float = 40, max_conta: float = 20
+) -> Iterable[Tuple[str, Bin, Tuple[Bin, ...]]]:
     """
-    Retrieves the intersection bins from a given graph.
+    Lists the set operations to apply on a combination of overlapping bins.
 
-    :param G: A networkx Graph representing the graph.
+    The intersection is made when at least one bin reaches min_completeness,
+    the difference of each bin reaching min_completeness with the other bins is made,
+    and the union is made when no bin exceeds max_conta.
 
-    :return: A set of Bin objects representing the intersection bins.
+    :param bins: A combination of overlapping bins.
+    :param min_completeness: Minimum completeness of a bin to make intersections and differences.
+    :param max_conta: Maximum contamination of the bins to make their union.
+
+    :return: An iterable of tuples (origin, base bin, other bins).
     """
-    intersect_bins = set()
+    if max(b.completeness for b in bins) >= min_completeness:
+        yield "intersec", bins[0], bins[1:]
 
-    with tqdm(unit="bin", total=len(G)) as pbar:
+    for bin_a in bins:
+        if bin_a.completeness >= min_completeness:
+            yield "diff", bin_a, tuple(b for b in bins if b != bin_a)
+
+    if max(b.contamination for b in bins) <= max_conta:
+        yield "union", bins[0], bins[1:]
+
+
+def derive_bin_contents(
+    cliques: Iterable[List[Bin]],
+    excluded_fingerprints: Set[int],
+    min_completeness: float = 40,
+    max_conta: float = 20,
+) -> Dict[int, DerivedContent]:
+    """
+    Applies the set operations on each combination of bins of the given cliques.
+
+    Derived contents are dereplicated as they are made: a content is only recorded the first time
+    its contigs are produced, later productions only add their origin to it.
+
+    :param cliques: Cliques of overlapping bins.
+    :param excluded_fingerprints: Fingerprints of bins that must not be created, such as the input bins.
+    :param min_completeness: Minimum completeness of a bin to make intersections and differences.
+    :param max_conta: Maximum contamination of the bins to make their union.
+
+    :return: A dictionary mapping the fingerprint of each derived bin to its contigs, origins, name
+        and derivation, in the order the bins were first produced.
+    """
+    fingerprint_to_content: Dict[int, DerivedContent] = {}
+
+    for clique in cliques:
+        for bins in get_all_possible_combinations(clique):
+            for origin, base_bin, others in iter_combination_operations(
+                bins, min_completeness, max_conta
+            ):
+                operation, separator = SET_OPERATIONS[origin]
+                contigs = operation(base_bin.contigs, *(o.contigs for o in others))
+                if not len(contigs):
+                    continue
 
-        for clique in nx.clique.find_cliques(G):
-            pbar.update(len(clique))
-            bins_combinations = get_all_possible_combinations(clique)
-            for bins in bins_combinations:
-                if max((b.completeness for b in bins)) < 40:
+                fingerprint = base_bin.derived_fingerprint(contigs)
+                if fingerprint in excluded_fingerprints:
                     continue
 
-                intersec_bin = bins[0].intersection(*bins[1:])
+                if fingerprint in fingerprint_to_content:
+                    fingerprint_to_content[fingerprint][1].add(origin)
+                    continue
+
+                bin_ids = tuple(b.id for b in (base_bin, *others))
+                name = f" {separator} ".join(str(bin_id) for bin_id in bin_ids)
+                fingerprint_to_content[fingerprint] = (
+                    contigs,
+                    {origin},
+                    name,
+                    (origin, bin_ids),
+                )
 
-                if intersec_bin.contigs:  # and intersec_bin not in clique:
+    return fingerprint_to_content
 
-                    intersect_bins.add(intersec_bin)
 
-    return intersect_bins
+# State of a worker process of iter_clique_batch_contents, set by _init_derivation_worker.
+_derivation_state: Dict[str, Any] = {}
 
 
-def get_difference_bins(G: nx.Graph) -> Set[Bin]:
+def _init_derivation_worker(derivation_state: Dict[str, Any]):
     """
-    Retrieves the difference bins from a given graph.
+    Initialize a worker process of iter_clique_batch_contents.
+
+    :param derivation_state: The bins of the graph by id, the excluded fingerprints
+        and the thresholds of the set operations.
+    """
+    _derivation_state.update(derivation_state)
 
-    :param G: A networkx Graph representing the graph.
 
-    :return: A set of Bin objects representing the difference bins.
+def _derive_bin_contents_of_clique_batch(
+    cliques: List[Tuple[int, ...]]
+) -> Tuple[int, Dict[int, DerivedContent]]:
     """
-    difference_bins = set()
-    with tqdm(unit="bin", total=len(G)) as pbar:
+    Derives the bins of a batch of cliques in a worker process of iter_derived_bins.
 
-        for clique in nx.clique.find_cliques(G):
-            pbar.update(len(clique))
+    :param cliques: Cliques given as tuples of bin ids.
 
-            bins_combinations = get_all_possible_combinations(clique)
-            for bins in bins_combinations:
+    :return: The number of bins in the cliques and the derived contents (see derive_bin_contents).
+    """
+    id_to_bin = _derivation_state["id_to_bin"]
+    contents = derive_bin_contents(
+        ([id_to_bin[bin_id] for bin_id in clique] for clique in cliques),
+        _derivation_state["excluded_fingerprints"],
+        _derivation_state["min_completeness"],
+        _derivation_state["max_conta"],
+    )
+    return sum(len(clique) for clique in cliques), contents
 
-                for bin_a in bins:
-                    if bin_a.completeness < 40:
-                        continue
-                    bin_diff = bin_a.difference(*(b for b in bins if b != bin_a))
 
-                    if bin_diff.contigs:  # and bin_diff not in clique:
-                        difference_bins.add(bin_diff)
+def iter_clique_batch_contents(
+    G: nx.Graph,
+    excluded_fingerprints: Set[int],
+    min_completeness: float,
+    max_conta: float,
+    threads: int,
+    batch_size: int,
+) -> Iterator[Tuple[int, Dict[int, DerivedContent]]]:
+    """
+    Derives the bins of the cliques of a bin graph batch by batch, in clique order.
 
-    return difference_bins
+    With several threads, batches are processed by a pool of worker processes.
+    The bins are sent once to each worker when it starts, and batches are sent as tuples of bin ids.
+    Workers are spawned rather than forked, as the parent process may already run
+    the threads of the checkm2 models. At most two batches per worker are in flight,
+    so that results do not pile up when they are consumed more slowly than they are produced.
 
+    :param G: A networkx Graph representing the graph of bins.
+    :param excluded_fingerprints: Fingerprints of bins that must not be created.
+    :param min_completeness: Minimum completeness of a bin to make intersections and differences.
+    :param max_conta: Maximum contamination of the bins to make their union.
+    :param threads: Number of worker processes.
+    :param batch_size: Number of cliques per batch.
 
-def get_union_bins(G: nx.Graph, max_conta: int = 50) -> Set[Bin]:
+    :return: An iterator of tuples (number of bins in the batch cliques, derived contents of the batch).
+    """
+    if threads <= 1:
+        cliques = nx.clique.find_cliques(G)
+        for batch in iter(lambda: list(itertools.islice(cliques, batch_size)), []):
+            contents = derive_bin_contents(
+                batch, excluded_fingerprints, min_completeness, max_conta
+            )
+            yield sum(len(clique) for clique in batch), contents
+        return
+
+    derivation_state = {
+        "id_to_bin": {b.id: b for b in G},
+        "excluded_fingerprints": excluded_fingerprints,
+        "min_completeness": min_completeness,
+        "max_conta": max_conta,
+    }
+    cliques = (tuple(b.id for b in clique) for clique in nx.clique.find_cliques(G))
+    with multiprocessing.get_context("spawn").Pool(
+        threads, initializer=_init_derivation_worker, initargs=(derivation_state,)
+    ) as pool:
+        pending = deque()
+        for batch in iter(lambda: list(itertools.islice(cliques, batch_size)), []):
+            pending.append(
+                pool.apply_async(_derive_bin_contents_of_clique_batch, (batch,))
+            )
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def iter_derived_bins(
+    G: nx.Graph,
+    excluded_fingerprints: Optional[Set[int]] = None,
+    min_completeness: float = 40,
+    max_conta: float = 20,
+    threads: int = 1,
+    batch_size: int = 100,
+) -> Iterator[Bin]:
     """
-    Retrieves the union bins from a given graph.
+    Creates intersection, difference and union bins in a single walk over the cliques of a bin graph.
+
+    Each combination of bins of each clique is visited once and all set operations are applied on it.
+    With several threads, batches of cliques are processed by a pool of worker processes.
+    Batch results are merged in clique order and Bin objects are only created once merged,
+    so the new bins and their ids are the same whatever the number of threads.
+
+    Bins are yielded as soon as their batch is merged. A bin produced again by a later batch
+    is not yielded twice: its origins are added to the origin set of the bin already yielded.
 
     :param G: A networkx Graph representing the graph of bins.
-    :param max_conta: Maximum allowed contamination value for a bin to be included in the union.
+    :param excluded_fingerprints: Fingerprints of bins that must not be created, such as the input bins.
+    :param min_completeness: Minimum completeness of a bin to make intersections and differences.
+    :param max_conta: Maximum contamination of the bins to make their union.
+    :param threads: Number of worker processes.
+    :param batch_size: Number of cliques processed at once.
 
-    :return: A set of Bin objects representing the union bins.
+    :return: An iterator of dereplicated Bin objects.
     """
-    union_bins = set()
-    with tqdm(unit="bin", total=len(G)) as pbar:
+    excluded_fingerprints = excluded_fingerprints or set()
+    fingerprint_to_origins: Dict[int, Set[str]] = {}
+    contig_keys = next(iter(G)).contig_keys if len(G) else None
 
-        for clique in nx.clique.find_cliques(G):
-            pbar.update(len(clique))
-            bins_combinations = get_all_possible_combinations(clique)
-            for bins in bins_combinations:
-                if max((b.contamination for b in bins)) > 20:
+    with tqdm(unit="bin", total=len(G)) as pbar:
+        for bin_count, contents in iter_clique_batch_contents(
+            G, excluded_fingerprints, min_completeness, max_conta, threads, batch_size
+        ):
+            pbar.update(bin_count)
+
+            for fingerprint, (contigs, origins, name, derivation) in contents.items():
+                if fingerprint in fingerprint_to_origins:
+                    fingerprint_to_origins[fingerprint].update(origins)
                     continue
 
-                bins = set(bins)
-                bin_a = bins.pop()
-                bin_union = bin_a.union(*bins)
-                if bin_union.contigs:  # and bin_union not in clique:
-                    union_bins.add(bin_union)
+                bin_obj = Bin(
+                    contigs,
+                    next(iter(origins)),
+                    name,
+                    contig_keys=contig_keys,
+                    fingerprint=fingerprint,
+                )
+                bin_obj.origin = origins
+                bin_obj.derivation = derivation
+                fingerprint_to_origins[fingerprint] = origins
+
+                yield bin_obj
+
+
+def get_derived_bins(
+    G: nx.Graph,
+    excluded_fingerprints: Optional[Set[int]] = None,
+    min_completeness: float = 40,
+    max_conta: float = 20,
+    threads: int = 1,
+    batch_size: int = 100,
+) -> Set[Bin]:
+    """
+    Creates intersection, difference and union bins from a bin graph (see iter_derived_bins).
+
+    :param G: A networkx Graph representing the graph of bins.
+    :param excluded_fingerprints: Fingerprints of bins that must not be created, such as the input bins.
+    :param min_completeness: Minimum completeness of a bin to make intersections and differences.
+    :param max_conta: Maximum contamination of the bins to make their union.
+    :param threads: Number of worker processes.
+    :param batch_size: Number of cliques processed at once.
+
+    :return: A set of dereplicated Bin objects.
+    """
+    return set(
+        iter_derived_bins(
+            G, excluded_fingerprints, min_completeness, max_conta, threads, batch_size
+        )
+    )
+
+
+def derive_contigs(derivation: Derivation, id_to_bin: Mapping[int, Bin]) -> Contigs:
+    """
+    Recomputes the contigs of a derived bin from the bins it was derived from.
+
+    :param derivation: Set operation and ids of the bins the bin was derived from.
+    :param id_to_bin: A dictionary mapping bin ids to the bins used in derivations.
+
+    :return: The contigs of the derived bin.
+    """
+    origin, bin_ids = derivation
+    operation, _ = SET_OPERATIONS[origin]
+    base_bin, *others = (id_to_bin[bin_id] for bin_id in bin_ids)
+    return operation(base_bin.contigs, *(o.contigs for o in others))
+
+
+def derivation_overlaps(
+    derivation: Derivation, id_to_bin: Mapping[int, Bin], contigs: Set
+) -> bool:
+    """
+    Checks whether a derived bin shares a contig with a set of contigs, without recomputing its contigs.
+
+    The contigs of an intersection or a difference are a subset of its base bin, so the set operation
+    is only applied to the base bin contigs found in the set, which are few compared to the bin.
+
+    :param derivation: Set operation and ids of the bins the bin was derived from.
+    :param id_to_bin: A dictionary mapping bin ids to the bins used in derivations.
+    :param contigs: A set of contigs, as returned by iter_contigs.
+
+    :return: True if the derived bin has at least one contig of the set.
+    """
+    origin, bin_ids = derivation
+    base_contigs, *other_contigs = (id_to_bin[bin_id].contigs for bin_id in bin_ids)
+
+    if origin == "union":
+        return any(
+            not contigs.isdisjoint(iter_contigs(bin_contigs))
+            for bin_contigs in [base_contigs, *other_contigs]
+        )
+
+    shared_contigs = [c for c in iter_contigs(base_contigs) if c in contigs]
+    if not shared_contigs:
+        return False
 
-    return union_bins
+    if isinstance(base_contigs, np.ndarray):
+        shared_contigs = np.array(shared_contigs, dtype=base_contigs.dtype)
+    else:
+        shared_contigs = set(shared_contigs)
+
+    operation, _ = SET_OPERATIONS[origin]
+    return len(operation(shared_contigs, *other_contigs)) > 0
+
+
+class BinRecord(NamedTuple):
+    """
+    Compact record of an assessed bin.
+
+    It holds what is needed to select and report a bin without its contigs,
+    which are recomputed from the derivation of the bin when needed.
+    """
+
+    id: int
+    fingerprint: int
+    score: float
+    N50: int
+    completeness: float
+    contamination: float
+    length: int
+    origin: Set[str]
+    name: str
+    derivation: Optional[Derivation]
+
+
+def make_bin_record(bin_obj: Bin) -> BinRecord:
+    """
+    Makes the compact record of an assessed bin.
+
+    :param bin_obj: A bin with its size and quality.
+
+    :return: The record of the bin.
+    """
+    return BinRecord(
+        bin_obj.id,
+        bin_obj.fingerprint,
+        bin_obj.score,
+        bin_obj.N50,
+        bin_obj.completeness,
+        bin_obj.contamination,
+        bin_obj.length,
+        bin_obj.origin,
+        bin_obj.name,
+        bin_obj.derivation,
+    )
+
+
+def restore_bin(record: BinRecord, id_to_bin: Mapping[int, Bin]) -> Bin:
+    """
+    Restores a bin with its contigs from its record.
+
+    :param record: The record of the bin.
+    :param id_to_bin: A dictionary mapping bin ids to the bins used in derivations.
+        Records without derivation are looked up in it.
+
+    :return: The bin with its contigs, size and quality.
+    """
+    if record.derivation is None:
+        return id_to_bin[record.id]
+
+    base_bin = id_to_bin[record.derivation[1][0]]
+    bin_obj = Bin(
+        derive_contigs(record.derivation, id_to_bin),
+        record.derivation[0],
+        record.name,
+        contig_keys=base_bin.contig_keys,
+        fingerprint=record.fingerprint,
+    )
+    bin_obj.id = record.id
+    bin_obj.origin = record.origin
+    bin_obj.derivation = record.derivation
+    bin_obj.length = record.length
+    bin_obj.N50 = record.N50
+    bin_obj.completeness = record.completeness
+    bin_obj.contamination = record.contamination
+    bin_obj.score = record.score
+
+    return bin_obj
+
+
+def select_best_bin_records(
+    records: Iterable[BinRecord], id_to_bin: Mapping[int, Bin]
+) -> List[Bin]:
+    """
+    Selects the best bins from bin records, as select_best_bins does from bins.
+
+    Records overlapping the bins already selected are discarded with derivation_overlaps,
+    so contigs are only recomputed for the selected bins.
+
+    :param records: Records of the candidate bins.
+    :param id_to_bin: A dictionary mapping bin ids to the bins used in derivations.
+
+    :return: A list of selected Bin objects.
+    """
+    logging.info("Sorting bins")
+    sorted_records = sorted(
+        records, key=lambda x: (x.score, x.N50, -x.id), reverse=True
+    )
+
+    logging.info("Selecting bins")
+    selected_bins = []
+    selected_contigs = set()
+    for record in sorted_records:
+        if record.derivation is None:
+            overlaps = not selected_contigs.isdisjoint(
+                iter_contigs(id_to_bin[record.id].contigs)
+            )
+        else:
+            overlaps = derivation_overlaps(
+                record.derivation, id_to_bin, selected_contigs
+            )
+        if overlaps:
+            continue
+
+        bin_obj = restore_bin(record, id_to_bin)
+        selected_contigs.update(iter_contigs(bin_obj.contigs))
+        selected_bins.append(bin_obj)
+
+    logging.info(f"Selected {len(selected_bins)} bins")
+    return selected_bins
 
 
 def select_best_bins(bins: Set[Bin]) -> List[Bin]:
     """
     Selects the best bins from a list of bins based on their scores, N50 values, and IDs.
 
+    Bins are picked greedily in score order. A contig to bins index gives the bins
+    overlapping each picked bin, which are discarded, so that each contig is visited once
+    instead of comparing each picked bin with all remaining bins.
+
     :param bins: A list of Bin objects.
 
     :return: A list of selected Bin objects.
@@ -467,19 +1100,414 @@ def select_best_bins(bins: Set[Bin]) -> List[Bin]:
     # Sort on score, N50, and ID. Smaller ID values are preferred to select original bins first.
     sorted_bins = sorted(bins, key=lambda x: (x.score, x.N50, -x.id), reverse=True)
 
+    contig_to_bins = defaultdict(list)
+    for b in sorted_bins:
+        for contig in iter_contigs(b.contigs):
+            contig_to_bins[contig].append(b)
+
     logging.info("Selecting bins")
     selected_bins = []
+    discarded_bin_ids = set()
     for b in sorted_bins:
-        if b in bins:
-            overlapping_bins = {b2 for b2 in bins if b.overlaps_with(b2)}
-            bins -= overlapping_bins
+        if b.id in discarded_bin_ids:
+            continue
+
+        selected_bins.append(b)
+        # The contigs of a selected bin can not be in another selected bin,
+        # so their entries are not needed anymore.
+        for contig in iter_contigs(b.contigs):
+            discarded_bin_ids.update(
+                overlapping_bin.id for overlapping_bin in contig_to_bins.pop(contig)
+            )
+
+    logging.info(f"Selected {len(selected_bins)} bins")
+    return selected_bins
+
+
+def get_bin_overlap_components(bins: Iterable[Bin]) -> List[List[Bin]]:
+    """
+    Groups bins in connected components of overlapping bins.
+
+    Bins of different components share no contig, so selections can be made independently in each component.
+    Components are found by merging the bins of each contig with a union-find,
+    so the cost scales with the total bin membership instead of the number of overlapping bin pairs.
+
+    :param bins: An iterable of Bin objects.
+
+    :return: A list of components, each given as a list of bins.
+    """
+    bins = list(bins)
+    parents = list(range(len(bins)))
+
+    def find_root(i: int) -> int:
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    contig_to_first_bin = {}
+    for i, b in enumerate(bins):
+        for contig in iter_contigs(b.contigs):
+            first_bin = contig_to_first_bin.setdefault(contig, i)
+            if first_bin != i:
+                parents[find_root(i)] = find_root(first_bin)
+
+    root_to_component = defaultdict(list)
+    for i, b in enumerate(bins):
+        root_to_component[find_root(i)].append(b)
+
+    return list(root_to_component.values())
+
+
+def get_bin_conflicts(
+    bin_contigs: List[Iterable], deadline: Optional[float] = None
+) -> Optional[List[List[int]]]:
+    """
+    Lists the bins overlapping each bin.
+
+    The bins sharing a contig all overlap each other, so a contig shared by many bins
+    adds many conflicts. The deadline is checked while conflicts are listed.
+
+    :param bin_contigs: The contigs of each bin, as returned by iter_contigs.
+    :param deadline: Optional time, as given by time.perf_counter, at which listing conflicts stops.
+
+    :return: For each bin, the sorted indices of the other bins sharing a contig with it,
+        or None when the deadline is reached.
+    """
+    contig_to_indices = defaultdict(list)
+    for i, contigs in enumerate(bin_contigs):
+        for contig in contigs:
+            contig_to_indices[contig].append(i)
+
+    conflicts = [set() for _ in bin_contigs]
+    for indices in contig_to_indices.values():
+        for i in indices:
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+            conflicts[i].update(indices)
+
+    for i, bin_conflicts in enumerate(conflicts):
+        bin_conflicts.discard(i)
+
+    return [sorted(bin_conflicts) for bin_conflicts in conflicts]
+
+
+def select_max_weight_by_branch_and_bound(
+    weights: List[float],
+    conflicts: List[List[int]],
+    incumbent: Set[int],
+    deadline: float,
+) -> Tuple[Set[int], bool]:
+    """
+    Selects non conflicting items of maximum total weight by branch and bound.
+
+    Items are explored in index order. A branch is pruned when the weights of the items
+    still selectable can not improve on the best selection found.
+
+    :param weights: Weight of each item. Items with a non positive weight are never selected.
+    :param conflicts: Indices of the items conflicting with each item.
+    :param incumbent: A valid selection used as the initial best selection.
+    :param deadline: Time, as given by time.perf_counter, at which the search stops.
+
+    :return: The best selection found and whether the deadline was reached before the search completed.
+    """
+    item_count = len(weights)
+    blocked_counts = [0] * item_count
+    selection = []
+    best = {"weight": sum(weights[i] for i in incumbent), "selection": set(incumbent)}
+    timed_out = False
+
+    def search(start: int, weight: float):
+        nonlocal timed_out
+        if timed_out or time.perf_counter() > deadline:
+            timed_out = True
+            return
+
+        if weight > best["weight"] + 1e-9:
+            best["weight"] = weight
+            best["selection"] = set(selection)
+
+        selectable = [
+            i
+            for i in range(start, item_count)
+            if not blocked_counts[i] and weights[i] > 0
+        ]
+        if (
+            not selectable
+            or weight + sum(weights[i] for i in selectable) <= best["weight"] + 1e-9
+        ):
+            return
+
+        item = selectable[0]
+
+        selection.append(item)
+        for other in conflicts[item]:
+            blocked_counts[other] += 1
+        search(item + 1, weight + weights[item])
+        for other in conflicts[item]:
+            blocked_counts[other] -= 1
+        selection.pop()
+
+        search(item + 1, weight)
+
+    search(0, 0.0)
+    return best["selection"], timed_out
+
+
+def select_max_weight_by_local_search(
+    weights: List[float],
+    conflicts: List[List[int]],
+    incumbent: Set[int],
+    deadline: float,
+) -> Tuple[Set[int], bool]:
+    """
+    Improves a selection of non conflicting items by local search.
 
+    Two moves are applied while they increase the total weight: adding an item in place of
+    the selected items conflicting with it, and replacing a selected item by several items
+    only conflicting with it.
+
+    :param weights: Weight of each item. Items with a non positive weight are never added.
+    :param conflicts: Indices of the items conflicting with each item.
+    :param incumbent: A valid selection to improve.
+    :param deadline: Time, as given by time.perf_counter, at which the search stops.
+
+    :return: The improved selection and whether the deadline was reached before no move could improve it.
+    """
+    selection = set(incumbent)
+    improved = True
+    while improved:
+        improved = False
+        for item in range(len(weights)):
+            if time.perf_counter() > deadline:
+                return selection, True
+
+            if item in selection:
+                # Replace the selected item by items whose only selected conflict is this item.
+                replacement_items = []
+                replacement_conflicts = set()
+                for other in conflicts[item]:
+                    if (
+                        weights[other] > 0
+                        and other not in replacement_conflicts
+                        and all(
+                            c == item or c not in selection for c in conflicts[other]
+                        )
+                    ):
+                        replacement_items.append(other)
+                        replacement_conflicts.update(conflicts[other])
+                replacement_weight = sum(weights[other] for other in replacement_items)
+                if replacement_weight > weights[item] + 1e-9:
+                    selection.remove(item)
+                    selection.update(replacement_items)
+                    improved = True
+
+            elif weights[item] > 0:
+                # Add the item in place of the selected items conflicting with it.
+                blocking_items = [c for c in conflicts[item] if c in selection]
+                if weights[item] > sum(weights[c] for c in blocking_items) + 1e-9:
+                    selection.difference_update(blocking_items)
+                    selection.add(item)
+                    improved = True
+
+    return selection, False
+
+
+def select_max_weight(
+    weights: List[float], conflicts: List[List[int]], time_limit: float
+) -> Tuple[Set[int], bool]:
+    """
+    Selects non conflicting items of maximum total weight.
+
+    Items must be given in greedy selection order. The greedy selection is used as a starting point,
+    so the selection returned never has a lower total weight. Small instances are solved exactly
+    by branch and bound, larger ones are improved by local search.
+
+    :param weights: Weight of each item.
+    :param conflicts: Indices of the items conflicting with each item.
+    :param time_limit: Maximum time spent on the instance, in seconds.
+
+    :return: The selected item indices and whether the time limit was reached.
+    """
+    deadline = time.perf_counter() + time_limit
+
+    greedy_selection = set()
+    blocked_items = set()
+    for item, weight in enumerate(weights):
+        if weight > 0 and item not in blocked_items:
+            greedy_selection.add(item)
+            blocked_items.update(conflicts[item])
+
+    if len(weights) <= EXACT_SELECTION_MAX_BIN_COUNT:
+        return select_max_weight_by_branch_and_bound(
+            weights, conflicts, greedy_selection, deadline
+        )
+    return select_max_weight_by_local_search(
+        weights, conflicts, greedy_selection, deadline
+    )
+
+
+def select_component_bins(
+    weights: List[float], bin_contigs: List[Iterable], time_limit: float
+) -> Tuple[Set[int], bool]:
+    """
+    Selects non overlapping bins of maximum total weight in a component of overlapping bins.
+
+    The time limit covers both the listing of the conflicts between bins (see get_bin_conflicts)
+    and the search (see select_max_weight). When conflicts can not be listed in time,
+    bins are selected greedily from their contigs.
+
+    :param weights: Weight of each bin, in greedy selection order.
+    :param bin_contigs: The contigs of each bin, as returned by iter_contigs.
+    :param time_limit: Maximum time spent on the component, in seconds.
+
+    :return: The selected bin indices and whether the time limit was reached.
+    """
+    deadline = time.perf_counter() + time_limit
+
+    conflicts = get_bin_conflicts(bin_contigs, deadline)
+    if conflicts is None:
+        greedy_selection = set()
+        selected_contigs = set()
+        for i, (weight, contigs) in enumerate(zip(weights, bin_contigs)):
+            if weight > 0 and selected_contigs.isdisjoint(contigs):
+                selected_contigs.update(contigs)
+                greedy_selection.add(i)
+        return greedy_selection, True
+
+    return select_max_weight(weights, conflicts, max(deadline - time.perf_counter(), 0))
+
+
+def select_best_bins_optimized(
+    bins: Set[Bin], time_limit: float = 10, threads: int = 1
+) -> List[Bin]:
+    """
+    Selects non overlapping bins maximizing the sum of their scores.
+
+    The selection is solved independently in each component of overlapping bins (see get_bin_overlap_components),
+    with select_component_bins. Components are solved in parallel with several threads.
+    Remaining bins that do not overlap the selected bins, such as bins with a non positive score,
+    are then added as select_best_bins would.
+    The gain in total score over select_best_bins is logged.
+
+    :param bins: A set of Bin objects.
+    :param time_limit: Maximum time spent on each component, in seconds.
+    :param threads: Number of worker processes solving components.
+
+    :return: A list of selected Bin objects, in the order select_best_bins would give them.
+    """
+
+    def sort_key(b: Bin):
+        return (b.score, b.N50, -b.id)
+
+    components = [
+        sorted(component, key=sort_key, reverse=True)
+        for component in get_bin_overlap_components(bins)
+    ]
+    shared_components = [component for component in components if len(component) > 1]
+    logging.info(
+        f"Optimizing bin selection in {len(shared_components)} components of overlapping bins"
+    )
+
+    # Largest components are solved first for a better balance between workers.
+    shared_components.sort(key=len, reverse=True)
+    tasks = [
+        (
+            [b.score for b in component],
+            [iter_contigs(b.contigs) for b in component],
+            time_limit,
+        )
+        for component in shared_components
+    ]
+    if threads > 1 and len(tasks) > 1:
+        # Spawned rather than forked, as the parent process may run the threads of the checkm2 models.
+        with multiprocessing.get_context("spawn").Pool(threads) as pool:
+            results = pool.starmap(select_component_bins, tasks, chunksize=1)
+    else:
+        results = [select_component_bins(*task) for task in tasks]
+
+    selected_bins = [component[0] for component in components if len(component) == 1]
+    for component, (selection, timed_out) in zip(shared_components, results):
+        selected_bins += [component[i] for i in selection]
+
+    selected_bin_ids = {b.id for b in selected_bins}
+    selected_contigs = set()
+    for b in selected_bins:
+        selected_contigs.update(iter_contigs(b.contigs))
+
+    sorted_bins = sorted(bins, key=sort_key, reverse=True)
+
+    # Bins with a non positive score, or left out when a time limit is reached, are added greedily.
+    for b in sorted_bins:
+        if b.id not in selected_bin_ids and selected_contigs.isdisjoint(
+            iter_contigs(b.contigs)
+        ):
+            selected_contigs.update(iter_contigs(b.contigs))
             selected_bins.append(b)
 
+    selected_bins.sort(key=sort_key, reverse=True)
+
+    greedy_score = 0
+    greedy_contigs = set()
+    for b in sorted_bins:
+        if greedy_contigs.isdisjoint(iter_contigs(b.contigs)):
+            greedy_contigs.update(iter_contigs(b.contigs))
+            greedy_score += b.score
+
+    optimized_score = sum(b.score for b in selected_bins)
+    timed_out_count = sum(timed_out for _, timed_out in results)
+    logging.info(
+        f"Optimized selection: total score of {optimized_score:.2f} "
+        f"against {greedy_score:.2f} with greedy selection ({optimized_score - greedy_score:+.2f})"
+    )
+    if timed_out_count:
+        logging.info(
+            f"The time limit of {time_limit}s was reached in {timed_out_count} components."
+        )
+
     logging.info(f"Selected {len(selected_bins)} bins")
     return selected_bins
 
 
+def select_round_input_bins(bins: Set[Bin], alternative_count: int) -> Set[Bin]:
+    """
+    Selects the bins recombined in a new refinement round.
+
+    These are the best bins selected by select_best_bins and, for each of them,
+    the alternative_count best scoring bins overlapping with it.
+
+    :param bins: A set of assessed Bin objects.
+    :param alternative_count: Number of overlapping bins kept for each selected bin.
+
+    :return: A set of Bin objects to recombine.
+    """
+    selected_bins = select_best_bins(set(bins))
+
+    contig_to_selected_bin = {
+        contig: selected_bin
+        for selected_bin in selected_bins
+        for contig in iter_contigs(selected_bin.contigs)
+    }
+
+    selected_bin_to_alternatives = defaultdict(list)
+    selected_bin_set = set(selected_bins)
+    for bin_obj in sorted(bins, key=lambda x: (x.score, x.N50, -x.id), reverse=True):
+        if bin_obj in selected_bin_set:
+            continue
+
+        overlapping_selected_bins = {
+            contig_to_selected_bin[contig]
+            for contig in iter_contigs(bin_obj.contigs)
+            if contig in contig_to_selected_bin
+        }
+        for selected_bin in overlapping_selected_bins:
+            alternatives = selected_bin_to_alternatives[selected_bin]
+            if len(alternatives) < alternative_count:
+                alternatives.append(bin_obj)
+
+    return selected_bin_set.union(*selected_bin_to_alternatives.values())
+
+
 def group_identical_bins(bins: Iterable[Bin]) -> List[List[Bin]]:
     """
     Group identical bins together
@@ -488,24 +1516,24 @@ def group_identical_bins(bins: Iterable[Bin]) -> List[List[Bin]]:
 
     return List of list of identical bins
     """
-    binhash_to_bins = defaultdict(list)
+    fingerprint_to_bins = defaultdict(list)
 
-    # Collect bins by their hash values
+    # Collect bins by their content fingerprint
     for bin_obj in bins:
-        binhash_to_bins[bin_obj.hash].append(bin_obj)
+        fingerprint_to_bins[bin_obj.fingerprint].append(bin_obj)
 
-    return list(binhash_to_bins.values())
+    return list(fingerprint_to_bins.values())
 
 
 def dereplicate_bin_sets(bin_sets: Iterable[Set["Bin"]]) -> Set["Bin"]:
     """
     Consolidate bins from multiple bin sets into a single set of non-redundant bins.
 
-    Bins with the same hash are considered duplicates. For each group of duplicates,
+    Bins with the same fingerprint are considered duplicates. For each group of duplicates,
     the origins are merged, and only one representative bin is kept.
 
     :param bin_sets: An iterable of sets, where each set contains `Bin` objects. These sets are merged
-                     into a single set of unique bins by consolidating bins with the same hash.
+                     into a single set of unique bins by consolidating bins with the same fingerprint.
 
     :return: A set of `Bin` objects with duplicates removed. Each `Bin` in the resulting set has
              merged origins from the bins it was consolidated with.
@@ -515,12 +1543,12 @@ def dereplicate_bin_sets(bin_sets: Iterable[Set["Bin"]]) -> Set["Bin"]:
 
     dereplicated_bins = set()
 
-    # Merge bins with the same hash
+    # Merge bins with the same fingerprint
     for identical_bins in list_of_identical_bins:
         # Select the first bin as the representative
         selected_bin = identical_bins[0]
         for bin_obj in identical_bins[1:]:
-            # Merge origins of all bins with the same hash
+            # Merge origins of all bins with the same fingerprint
             selected_bin.origin |= bin_obj.origin
 
         # Add the representative bin to the result set
@@ -587,59 +1615,99 @@ def get_contigs_in_bins(bins: Iterable[Bin]) -> List[str]:
     return [contig for b in bins for contig in b.contigs]
 
 
-def rename_bin_contigs(bins: Iterable[Bin], contig_to_index: dict):
+def rename_bin_contigs(
+    bins: Iterable[Bin], contig_to_index: dict, membership_engine: str = "set"
+):
     """
     Renames the contigs in the bins based on the provided mapping.
 
     :param bins: A list of Bin objects.
     :param contig_to_index: A dictionary mapping old contig names to new index names.
+    :param membership_engine: Engine used to store the renamed contigs: "set" for python sets
+        or "array" for sorted int32 numpy arrays. Bins derived from renamed bins keep the same engine.
+
+    Contig keys are derived from contig names, so the fingerprint of the bins is unchanged by the renaming.
     """
+    if membership_engine not in MEMBERSHIP_ENGINES:
+        raise ValueError(
+            f"Unknown membership engine '{membership_engine}'. Choose from {', '.join(MEMBERSHIP_ENGINES)}."
+        )
+
+    contig_keys = make_contig_keys(contig_to_index)
+
     for b in bins:
-        b.contigs = {contig_to_index[contig] for contig in b.contigs}
-        b.hash = hash(str(sorted(b.contigs)))
+        b.contig_keys = contig_keys
+        if membership_engine == "array":
+            b.contigs = make_contig_array(
+                contig_to_index[contig] for contig in b.contigs
+            )
+        else:
+            b.contigs = {contig_to_index[contig] for contig in b.contigs}
 
 
-def create_intermediate_bins(original_bins: Set[Bin]) -> Set[Bin]:
+def iter_intermediate_bins(
+    original_bins: Set[Bin],
+    contig_to_length: Optional[Mapping] = None,
+    threads: int = 1,
+    excluded_fingerprints: Optional[Set[int]] = None,
+) -> Iterator[Bin]:
     """
-    Creates intermediate bins from a dictionary of bin sets.
+    Creates intermediate bins from a set of input bins, yielding them as they are made.
 
     :param original_bins: Set of input bins.
+    :param contig_to_length: Optional mapping of contigs to their length, used to annotate bin graph edges.
+    :param threads: Number of worker processes used to create the bins.
+    :param excluded_fingerprints: Fingerprints of bins already known, which are not created again.
+        Input bins are always excluded.
 
-    :return: A set of intermediate bins created from intersections, differences, and unions.
+    :return: An iterator of intermediate bins created from intersections, differences, and unions.
     """
 
     logging.info("Making bin graph...")
-    connected_bins_graph = from_bins_to_bin_graph(original_bins)
-
-    logging.info("Creating intersection bins...")
-    intersection_bins = get_intersection_bins(connected_bins_graph)
-
-    logging.info(f"{len(intersection_bins)} bins created on intersections.")
-
-    logging.info("Creating difference bins...")
-    difference_bins = get_difference_bins(connected_bins_graph)
-
-    logging.info(f"{len(difference_bins)} bins created based on symmetric difference.")
+    connected_bins_graph = from_bins_to_bin_graph(original_bins, contig_to_length)
+    logging.debug(
+        f"Bin graph: {connected_bins_graph.number_of_nodes()} bins connected by {connected_bins_graph.number_of_edges()} overlaps."
+    )
 
-    logging.info("Creating union bins...")
-    union_bins = get_union_bins(connected_bins_graph)
+    logging.info("Creating intersection, difference and union bins...")
+    original_fingerprints = {b.fingerprint for b in original_bins}
+    if excluded_fingerprints:
+        original_fingerprints |= excluded_fingerprints
+    yield from iter_derived_bins(
+        connected_bins_graph, original_fingerprints, threads=threads
+    )
 
-    logging.info(f"{len(union_bins)} bins created on unions.")
 
-    new_bins = difference_bins | intersection_bins | union_bins
+def create_intermediate_bins(
+    original_bins: Set[Bin],
+    contig_to_length: Optional[Mapping] = None,
+    threads: int = 1,
+    excluded_fingerprints: Optional[Set[int]] = None,
+) -> Set[Bin]:
+    """
+    Creates intermediate bins from a dictionary of bin sets.
 
-    new_bins = dereplicate_bin_sets((difference_bins, intersection_bins, union_bins))
+    :param original_bins: Set of input bins.
+    :param contig_to_length: Optional mapping of contigs to their length, used to annotate bin graph edges.
+    :param threads: Number of worker processes used to create the bins.
+    :param excluded_fingerprints: Fingerprints of bins already known, which are not created again.
+        Input bins are always excluded.
 
-    # dereplicate from the original bins
-    original_hashes = [b.hash for b in original_bins]
-    new_bins_not_in_original = set()
+    :return: A set of intermediate bins created from intersections, differences, and unions.
+    """
+    new_bins = set(
+        iter_intermediate_bins(
+            original_bins, contig_to_length, threads, excluded_fingerprints
+        )
+    )
 
-    for b in new_bins:
-        if b.hash not in original_hashes:
-            new_bins_not_in_original.add(b)
+    for origin in SET_OPERATIONS:
+        logging.debug(
+            f"{sum(origin in b.origin for b in new_bins)} new bins made by {origin}."
+        )
 
     logging.info(
         f"{len(new_bins)} new bins created from {len(original_bins)} input bins."
     )
 
-    return new_bins_not_in_original
+    return new_bins
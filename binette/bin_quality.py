@@ -1,13 +1,31 @@
 #!/usr/bin/env python3
 import logging
+import multiprocessing
+import multiprocessing.pool
 import os
-from collections import Counter
+import time
+from collections import deque
+from functools import partial
 from itertools import islice
-from typing import Dict, Iterable, Optional, Tuple, Iterator, Set
+from multiprocessing import shared_memory
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Iterator,
+    Set,
+)
 
 import numpy as np
 import pandas as pd
-from binette.bin_manager import Bin
+from scipy import sparse
+from binette import cds, cache_manager
+from binette.bin_manager import Bin, Contigs
 from tqdm import tqdm
 
 # Suppress unnecessary TensorFlow warnings
@@ -18,95 +36,138 @@ logging.getLogger("tensorflow").setLevel(logging.FATAL)
 from checkm2 import keggData, modelPostprocessing, modelProcessing  # noqa: E402
 
 
+def get_contig_metadata_matrix(
+    contig_cds_count: np.ndarray,
+    contig_aa_composition: np.ndarray,
+    contig_aa_length: np.ndarray,
+) -> np.ndarray:
+    """
+    Build the contig x metadata feature matrix.
+
+    Columns follow the checkm2 metadata order (amino acid counts, AALength and CDS)
+    and rows are indexed by contig index.
+
+    :param contig_cds_count: Array of CDS counts indexed by contig index.
+    :param contig_aa_composition: Array of amino acid counts indexed by contig index,
+        with one column per amino acid of cds.AMINO_ACIDS.
+    :param contig_aa_length: Array of total amino acid length indexed by contig index.
+    :return: A (n_contigs, n_metadata) integer array.
+    """
+    metadata_order = keggData.KeggCalculator().return_proper_order("Metadata")
+
+    feature_to_column = {"CDS": contig_cds_count, "AALength": contig_aa_length}
+    for i, aa in enumerate(cds.AMINO_ACIDS):
+        feature_to_column[aa] = contig_aa_composition[:, i]
+
+    return np.column_stack(
+        [feature_to_column[feature] for feature in metadata_order]
+    ).astype(np.int64, copy=False)
+
+
+def get_contig_feature_matrices(
+    contig_cds_metadata: Dict[str, np.ndarray], contig_ko_matrix: sparse.csr_matrix
+) -> Dict[str, Any]:
+    """
+    Build once per run the contig feature matrices used to compute bin features.
+
+    :param contig_cds_metadata: Dictionary with contig CDS count, amino acid composition and amino acid length arrays
+        (see cds.make_contig_cds_metadata).
+    :param contig_ko_matrix: The sparse contig x KO count matrix (see diamond.get_contig_to_kegg_id).
+    :return: A dictionary with the contig metadata matrix, the contig KO matrix and the contig CDS counts.
+    """
+    return {
+        "contig_metadata_matrix": get_contig_metadata_matrix(
+            contig_cds_metadata["contig_cds_count"],
+            contig_cds_metadata["contig_aa_composition"],
+            contig_cds_metadata["contig_aa_length"],
+        ),
+        "contig_ko_matrix": contig_ko_matrix,
+        "contig_cds_count": contig_cds_metadata["contig_cds_count"],
+    }
+
+
+def get_bin_contig_matrix(bins: List[Bin], contig_count: int) -> sparse.csr_matrix:
+    """
+    Build the sparse bin x contig incidence matrix.
+
+    :param bins: A list of bin objects whose contigs are contig indices.
+    :param contig_count: Number of contigs in the contig index.
+    :return: A sparse (len(bins), contig_count) matrix with ones where a contig belongs to a bin.
+    """
+    contig_arrays = [
+        (
+            bin_obj.contigs
+            if isinstance(bin_obj.contigs, np.ndarray)
+            else np.fromiter(
+                bin_obj.contigs, dtype=np.int64, count=len(bin_obj.contigs)
+            )
+        )
+        for bin_obj in bins
+    ]
+    indptr = np.zeros(len(bins) + 1, dtype=np.int64)
+    np.cumsum([len(contigs) for contigs in contig_arrays], out=indptr[1:])
+    indices = (
+        np.concatenate(contig_arrays) if contig_arrays else np.array([], dtype=np.int64)
+    )
+    data = np.ones(len(indices), dtype=np.int64)
+
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(bins), contig_count))
+
+
 def get_bins_metadata_df(
-    bins: Iterable[Bin],
-    contig_to_cds_count: Dict[str, int],
-    contig_to_aa_counter: Dict[str, Counter],
-    contig_to_aa_length: Dict[str, int],
+    bins: List[Bin],
+    contig_metadata_matrix: np.ndarray,
+    bin_contig_matrix: Optional[sparse.csr_matrix] = None,
 ) -> pd.DataFrame:
     """
     Generate a DataFrame containing metadata for a list of bins.
 
     :param bins: A list of bin objects.
-    :param contig_to_cds_count: A dictionary mapping contig names to CDS counts.
-    :param contig_to_aa_counter: A dictionary mapping contig names to amino acid composition (Counter object).
-    :param contig_to_aa_length: A dictionary mapping contig names to total amino acid length.
+    :param contig_metadata_matrix: The contig x metadata feature matrix (see get_contig_metadata_matrix).
+    :param bin_contig_matrix: The bin x contig incidence matrix of the bins. Built from the bins when not provided.
     :return: A DataFrame containing bin metadata.
     """
 
     metadata_order = keggData.KeggCalculator().return_proper_order("Metadata")
 
-    # Get bin metadata
-    bin_metadata_list = []
-    for bin_obj in bins:
-        bin_metadata = {
-            "Name": bin_obj.id,
-            "CDS": sum(
-                (
-                    contig_to_cds_count[c]
-                    for c in bin_obj.contigs
-                    if c in contig_to_cds_count
-                )
-            ),
-            "AALength": sum(
-                (
-                    contig_to_aa_length[c]
-                    for c in bin_obj.contigs
-                    if c in contig_to_aa_length
-                )
-            ),
-        }
-
-        bin_aa_counter = Counter()
-        for contig in bin_obj.contigs:
-            if contig in contig_to_aa_counter:
-                bin_aa_counter += contig_to_aa_counter[contig]
+    if bin_contig_matrix is None:
+        bin_contig_matrix = get_bin_contig_matrix(bins, contig_metadata_matrix.shape[0])
 
-        bin_metadata.update(dict(bin_aa_counter))
-        bin_metadata_list.append(bin_metadata)
+    bin_metadata = bin_contig_matrix @ contig_metadata_matrix
 
-    metadata_df = pd.DataFrame(bin_metadata_list, columns=["Name"] + metadata_order)
-
-    metadata_df = metadata_df.fillna(0)
-
-    metadata_df = metadata_df.astype({col: int for col in metadata_order})
+    metadata_df = pd.DataFrame(bin_metadata, columns=metadata_order)
+    metadata_df.insert(0, "Name", [bin_obj.id for bin_obj in bins])
 
     metadata_df = metadata_df.set_index("Name", drop=False)
     return metadata_df
 
 
 def get_diamond_feature_per_bin_df(
-    bins: Iterable[Bin], contig_to_kegg_counter: Dict[str, Counter]
+    bins: List[Bin],
+    contig_ko_matrix: sparse.csr_matrix,
+    bin_contig_matrix: Optional[sparse.csr_matrix] = None,
 ) -> Tuple[pd.DataFrame, int]:
     """
     Generate a DataFrame containing Diamond feature counts per bin and completeness information for pathways, categories, and modules.
 
     :param bins: A list of bin objects.
-    :param contig_to_kegg_counter: A dictionary mapping contig names to KEGG annotation counters.
-    :type bins: List
-    :type contig_to_kegg_counter: Dict[str, Counter]
+    :param contig_ko_matrix: The sparse contig x KO count matrix (see diamond.get_contig_to_kegg_id).
+    :param bin_contig_matrix: The bin x contig incidence matrix of the bins. Built from the bins when not provided.
     :return: A tuple containing the DataFrame and the number of default KEGG orthologs (KOs).
-    :rtype: Tuple[pd.DataFrame, int]
     """
     KeggCalc = keggData.KeggCalculator()
     defaultKOs = KeggCalc.return_default_values_from_category("KO_Genes")
 
-    bin_to_ko_counter = {}
-    for bin_obj in bins:
-        bin_ko_counter = Counter()
-        for contig in bin_obj.contigs:
-            try:
-                bin_ko_counter += contig_to_kegg_counter[contig]
-            except KeyError:
-                # No KO annotation found in this contig
-                continue
-
-        bin_to_ko_counter[bin_obj.id] = bin_ko_counter
-
-    ko_count_per_bin_df = (
-        pd.DataFrame(bin_to_ko_counter, index=defaultKOs).transpose().fillna(0)
+    if bin_contig_matrix is None:
+        bin_contig_matrix = get_bin_contig_matrix(bins, contig_ko_matrix.shape[0])
+
+    bin_ko_counts = (bin_contig_matrix @ contig_ko_matrix).toarray()
+
+    ko_count_per_bin_df = pd.DataFrame(
+        bin_ko_counts,
+        index=[bin_obj.id for bin_obj in bins],
+        columns=list(defaultKOs),
     )
-    ko_count_per_bin_df = ko_count_per_bin_df.astype(int)
     ko_count_per_bin_df["Name"] = ko_count_per_bin_df.index
 
     logging.debug("Calculating completeness of pathways and modules.")
@@ -163,45 +224,339 @@ def add_bin_size_and_N50(bins: Iterable[Bin], contig_to_size: Dict[str, int]):
         bin_obj.add_N50(n50)
 
 
+def iter_prescreened_bins(
+    bins: Iterable[Bin],
+    contig_info: Dict,
+    min_cds_count: int = 0,
+    min_ko_count: int = 0,
+    chunk_size: int = 1000,
+) -> Iterator[Bin]:
+    """
+    Skip bins too small to be worth a quality assessment.
+
+    Many intermediate bins are small fragments that cannot reach a useful completeness.
+    Their CDS count and their number of distinct KOs are computed chunk by chunk
+    from the contig feature matrices, which is much cheaper than assessing them.
+    Skipped bins get no quality and are not yielded.
+    The number of skipped bins is logged once the bins are consumed.
+
+    :param bins: Iterable of bin objects.
+    :param contig_info: Dictionary containing the contig KO matrix and the contig CDS counts
+        (see get_contig_feature_matrices).
+    :param min_cds_count: Bins with fewer CDS are skipped.
+    :param min_ko_count: Bins with fewer distinct KOs are skipped.
+    :param chunk_size: Number of bins screened at once.
+
+    :return: An iterator of the bins to assess.
+    """
+    if min_cds_count <= 0 and min_ko_count <= 0:
+        yield from bins
+        return
+
+    contig_cds_count = contig_info["contig_cds_count"]
+    contig_ko_matrix = contig_info["contig_ko_matrix"]
+
+    skipped_count = 0
+    bin_count = 0
+    for chunk_bins in chunks(bins, chunk_size):
+        bin_contig_matrix = get_bin_contig_matrix(
+            list(chunk_bins), contig_ko_matrix.shape[0]
+        )
+        cds_counts = bin_contig_matrix @ contig_cds_count
+        ko_counts = (bin_contig_matrix @ contig_ko_matrix).getnnz(axis=1)
+
+        is_kept = (cds_counts >= min_cds_count) & (ko_counts >= min_ko_count)
+        skipped_count += len(chunk_bins) - int(is_kept.sum())
+        bin_count += len(chunk_bins)
+
+        yield from (bin_obj for bin_obj, kept in zip(chunk_bins, is_kept) if kept)
+
+    logging.info(
+        f"Pre-screen: {skipped_count}/{bin_count} bins with fewer than {min_cds_count} CDS "
+        f"or {min_ko_count} distinct KOs are skipped."
+    )
+
+
+def load_quality_models(threads: int = 1) -> Dict[str, Any]:
+    """
+    Load the checkm2 models used to assess bin quality.
+
+    Loading the models is costly, so they are loaded once and reused to assess every chunk of bins.
+
+    :param threads: Number of threads used by the models.
+
+    :return: A dictionary holding the checkm2 model processor ("model_processor")
+        and post-processor ("post_processor").
+    """
+    start = time.perf_counter()
+
+    quality_models = {
+        "model_processor": modelProcessing.modelProcessor(threads),
+        "post_processor": modelPostprocessing.modelProcessor(threads),
+    }
+
+    logging.info(f"CheckM2 models loaded in {time.perf_counter() - start:.2f}s.")
+    return quality_models
+
+
 def add_bin_metrics(
-    bins: Set[Bin], contig_info: Dict, contamination_weight: float, threads: int = 1
+    bins: Set[Bin],
+    contig_info: Dict,
+    contamination_weight: float,
+    threads: int = 1,
+    quality_cache: Optional[Dict[str, Any]] = None,
+    quality_models: Optional[Dict[str, Any]] = None,
+    quality_checkpoint: Optional[Dict[str, Any]] = None,
+    quality_workers: Optional[Dict[str, Any]] = None,
 ):
     """
     Add metrics to a Set of bins.
 
     :param bins: Set of bin objects.
-    :param contig_info: Dictionary containing contig information.
+    :param contig_info: Dictionary containing the contig feature matrices (see get_contig_feature_matrices)
+        and the contig lengths.
     :param contamination_weight: Weight for contamination assessment.
     :param threads: Number of threads for parallel processing (default is 1).
+    :param quality_cache: Optional bin quality cache (see cache_manager.init_quality_cache).
+        Bins found in the cache are not assessed again.
+    :param quality_models: Checkm2 models loaded with load_quality_models.
+        They are loaded when not provided.
+    :param quality_checkpoint: Optional quality checkpoint (see cache_manager.init_quality_checkpoint).
+        Bins found in the checkpoint are not assessed again and
+        the quality of each assessed chunk of bins is appended to it.
+    :param quality_workers: Optional quality workers (see start_quality_workers).
+        When given, bins are assessed by the worker processes and the models are not loaded.
 
     :return: List of processed bin objects.
     """
-    postProcessor = modelPostprocessing.modelProcessor(threads)
+    if quality_models is None and quality_workers is None:
+        quality_models = load_quality_models(threads)
+    quality_models = quality_models or {}
 
-    contig_to_kegg_counter = contig_info["contig_to_kegg_counter"]
-    contig_to_cds_count = contig_info["contig_to_cds_count"]
-    contig_to_aa_counter = contig_info["contig_to_aa_counter"]
-    contig_to_aa_length = contig_info["contig_to_aa_length"]
+    contig_metadata_matrix = contig_info["contig_metadata_matrix"]
+    contig_ko_matrix = contig_info["contig_ko_matrix"]
     contig_to_length = contig_info["contig_to_length"]
 
     logging.info("Getting bin length and N50")
 
     add_bin_size_and_N50(bins, contig_to_length)
 
-    logging.info(f"Assessing bin quality for {len(bins)}")
+    bins_to_assess = bins
+    if quality_cache is not None:
+        bins_to_assess = add_cached_qualities(bins, contamination_weight, quality_cache)
+
+        logging.info(
+            f"Quality of {len(bins) - len(bins_to_assess)}/{len(bins)} bins retrieved from cache."
+        )
+
+    bins_to_cache = bins_to_assess
+    on_chunk_assessed = None
+    if quality_checkpoint is not None:
+        bins_to_assess = add_checkpointed_qualities(
+            bins_to_cache, contamination_weight, quality_checkpoint
+        )
+        if len(bins_to_assess) < len(bins_to_cache):
+            logging.info(
+                f"Quality of {len(bins_to_cache) - len(bins_to_assess)}/{len(bins)} bins retrieved from checkpoint."
+            )
+        on_chunk_assessed = partial(
+            cache_manager.append_to_quality_checkpoint, quality_checkpoint
+        )
+
+    logging.info(f"Assessing bin quality for {len(bins_to_assess)}")
     assess_bins_quality_by_chunk(
-        bins,
-        contig_to_kegg_counter,
-        contig_to_cds_count,
-        contig_to_aa_counter,
-        contig_to_aa_length,
+        bins_to_assess,
+        contig_metadata_matrix,
+        contig_ko_matrix,
         contamination_weight,
-        postProcessor,
+        quality_models.get("post_processor"),
+        threads=threads,
         chunk_size=1000,
+        modelProc=quality_models.get("model_processor"),
+        on_chunk_assessed=on_chunk_assessed,
+        quality_workers=quality_workers,
     )
+
+    if quality_cache is not None and bins_to_cache:
+        cache_manager.store_bin_qualities(quality_cache, bins_to_cache)
+
     return bins
 
 
+def add_cached_qualities(
+    bins: Iterable[Bin], contamination_weight: float, quality_cache: Dict[str, Any]
+) -> List[Bin]:
+    """
+    Add the quality of the bins found in the quality cache.
+
+    :param bins: Bin objects.
+    :param contamination_weight: Weight for contamination assessment.
+    :param quality_cache: The bin quality cache (see cache_manager.init_quality_cache).
+
+    :return: The list of bins missing from the cache.
+    """
+    bin_id_to_cached_quality = cache_manager.get_cached_bin_qualities(
+        quality_cache, bins
+    )
+    return add_known_qualities(bins, contamination_weight, bin_id_to_cached_quality)
+
+
+def add_checkpointed_qualities(
+    bins: Iterable[Bin], contamination_weight: float, quality_checkpoint: Dict[str, Any]
+) -> List[Bin]:
+    """
+    Add the quality of the bins found in the quality checkpoint.
+
+    :param bins: Bin objects.
+    :param contamination_weight: Weight for contamination assessment.
+    :param quality_checkpoint: The quality checkpoint (see cache_manager.init_quality_checkpoint).
+
+    :return: The list of bins missing from the checkpoint.
+    """
+    bin_id_to_checkpointed_quality = cache_manager.get_checkpointed_bin_qualities(
+        quality_checkpoint, bins
+    )
+    return add_known_qualities(
+        bins, contamination_weight, bin_id_to_checkpointed_quality
+    )
+
+
+def add_known_qualities(
+    bins: Iterable[Bin],
+    contamination_weight: float,
+    bin_id_to_quality: Dict[int, Tuple[float, float]],
+) -> List[Bin]:
+    """
+    Add the quality of the bins whose completeness and contamination are already known.
+
+    :param bins: Bin objects.
+    :param contamination_weight: Weight for contamination assessment.
+    :param bin_id_to_quality: A dictionary mapping bin ids to their (completeness, contamination).
+
+    :return: The list of bins with an unknown quality.
+    """
+    bins_to_assess = []
+    for bin_obj in bins:
+        if bin_obj.id in bin_id_to_quality:
+            completeness, contamination = bin_id_to_quality[bin_obj.id]
+            bin_obj.add_quality(completeness, contamination, contamination_weight)
+        else:
+            bins_to_assess.append(bin_obj)
+
+    return bins_to_assess
+
+
+def iter_bin_metrics_by_chunk(
+    bins: Iterable[Bin],
+    contig_info: Dict,
+    contamination_weight: float,
+    threads: int = 1,
+    quality_cache: Optional[Dict[str, Any]] = None,
+    chunk_size: int = 1000,
+    quality_models: Optional[Dict[str, Any]] = None,
+    quality_checkpoint: Optional[Dict[str, Any]] = None,
+    quality_workers: Optional[Dict[str, Any]] = None,
+) -> Iterator[Tuple[Bin, ...]]:
+    """
+    Add metrics to bins streamed in chunks.
+
+    Bins are consumed chunk by chunk from the iterable, so that bins still to be created
+    are not materialized while earlier chunks are assessed.
+
+    :param bins: Iterable of bin objects, such as a generator of intermediate bins.
+    :param contig_info: Dictionary containing the contig feature matrices (see get_contig_feature_matrices)
+        and the contig lengths.
+    :param contamination_weight: Weight for contamination assessment.
+    :param threads: Number of threads for parallel processing (default is 1).
+    :param quality_cache: Optional bin quality cache (see cache_manager.init_quality_cache).
+        Bins found in the cache are not assessed again.
+    :param chunk_size: The size of each chunk.
+    :param quality_models: Checkm2 models loaded with load_quality_models.
+        They are loaded when not provided.
+    :param quality_checkpoint: Optional quality checkpoint (see cache_manager.init_quality_checkpoint).
+        Bins found in the checkpoint are not assessed again and
+        the quality of each assessed chunk of bins is appended to it.
+    :param quality_workers: Optional quality workers (see start_quality_workers).
+        When given, chunks are assessed by the worker processes and the models are not loaded.
+
+    :return: An iterator of chunks of bins with their metrics.
+    """
+    if quality_models is None and quality_workers is None:
+        quality_models = load_quality_models(threads)
+
+    def iter_chunks_to_assess() -> (
+        Iterator[Tuple[Tuple[Tuple[Bin, ...], Sequence[Bin]], Sequence[Bin]]]
+    ):
+        for i, chunk_bins in enumerate(chunks(bins, chunk_size)):
+            add_bin_size_and_N50(chunk_bins, contig_info["contig_to_length"])
+
+            bins_to_cache = chunk_bins
+            if quality_cache is not None:
+                bins_to_cache = add_cached_qualities(
+                    chunk_bins, contamination_weight, quality_cache
+                )
+
+            bins_to_assess = bins_to_cache
+            if quality_checkpoint is not None:
+                bins_to_assess = add_checkpointed_qualities(
+                    bins_to_cache, contamination_weight, quality_checkpoint
+                )
+
+            logging.debug(
+                f"chunk {i}: assessing quality of {len(bins_to_assess)}/{len(chunk_bins)} bins"
+            )
+            yield (chunk_bins, bins_to_cache), bins_to_assess
+
+    def iter_chunks_assessed_in_process() -> (
+        Iterator[Tuple[Tuple[Tuple[Bin, ...], Sequence[Bin]], Sequence[Bin]]]
+    ):
+        for chunk_tag, bins_to_assess in iter_chunks_to_assess():
+            if bins_to_assess:
+                assess_bins_quality(
+                    bins=bins_to_assess,
+                    contig_metadata_matrix=contig_info["contig_metadata_matrix"],
+                    contig_ko_matrix=contig_info["contig_ko_matrix"],
+                    contamination_weight=contamination_weight,
+                    postProcessor=quality_models["post_processor"],
+                    threads=threads,
+                    modelProc=quality_models["model_processor"],
+                )
+            yield chunk_tag, bins_to_assess
+
+    if quality_workers is not None:
+        assessed_chunks = iter_chunks_assessed_in_workers(
+            iter_chunks_to_assess(), quality_workers, contamination_weight
+        )
+    else:
+        assessed_chunks = iter_chunks_assessed_in_process()
+
+    cached_count = 0
+    checkpointed_count = 0
+    bin_count = 0
+    for (chunk_bins, bins_to_cache), bins_to_assess in assessed_chunks:
+        if quality_checkpoint is not None and bins_to_assess:
+            cache_manager.append_to_quality_checkpoint(
+                quality_checkpoint, bins_to_assess
+            )
+        if quality_cache is not None and bins_to_cache:
+            cache_manager.store_bin_qualities(quality_cache, bins_to_cache)
+
+        cached_count += len(chunk_bins) - len(bins_to_cache)
+        checkpointed_count += len(bins_to_cache) - len(bins_to_assess)
+        bin_count += len(chunk_bins)
+
+        yield chunk_bins
+
+    if quality_cache is not None:
+        logging.info(
+            f"Quality of {cached_count}/{bin_count} bins retrieved from cache."
+        )
+    if checkpointed_count:
+        logging.info(
+            f"Quality of {checkpointed_count}/{bin_count} bins retrieved from checkpoint."
+        )
+
+
 def chunks(iterable: Iterable, size: int) -> Iterator[Tuple]:
     """
     Generate adjacent chunks of data from an iterable.
@@ -214,16 +569,245 @@ def chunks(iterable: Iterable, size: int) -> Iterator[Tuple]:
     return iter(lambda: tuple(islice(it, size)), ())
 
 
+def share_array(
+    array: np.ndarray,
+) -> Tuple[shared_memory.SharedMemory, Tuple[str, Tuple[int, ...], str]]:
+    """
+    Copy an array into a new shared memory block.
+
+    :param array: The array to share.
+
+    :return: The shared memory block, to close and unlink once workers are done,
+        and the (block name, shape, dtype) spec used to attach to it with attach_array.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared_array[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def attach_array(
+    spec: Tuple[str, Tuple[int, ...], str]
+) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """
+    Attach to an array shared with share_array, without copying it.
+
+    :param spec: The (block name, shape, dtype) spec returned by share_array.
+
+    :return: The shared memory block, which must stay referenced while the array is used, and the array.
+    """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+# State of a quality worker process, set by _init_quality_worker.
+_quality_worker_state: Dict[str, Any] = {}
+
+
+def _init_quality_worker(
+    feature_specs: Dict[str, Any], model_loader: Callable[[int], Dict[str, Any]]
+):
+    """
+    Initialize a worker process started by start_quality_workers.
+
+    The worker attaches to the shared contig feature arrays and loads the checkm2 models once.
+    A failure to load the models is recorded rather than raised: a worker exiting in its initializer
+    is respawned by the pool forever, whereas the recorded error is raised by every task of the worker.
+
+    :param feature_specs: Specs of the shared contig feature arrays and shape of the KO matrix.
+    :param model_loader: Function loading the checkm2 models with a given number of threads.
+    """
+    shared_blocks = []
+    arrays = {}
+    for key in ["contig_metadata_matrix", "ko_data", "ko_indices", "ko_indptr"]:
+        shm, arrays[key] = attach_array(feature_specs[key])
+        shared_blocks.append(shm)
+
+    _quality_worker_state.update(
+        shared_blocks=shared_blocks,
+        contig_metadata_matrix=arrays["contig_metadata_matrix"],
+        contig_ko_matrix=sparse.csr_matrix(
+            (arrays["ko_data"], arrays["ko_indices"], arrays["ko_indptr"]),
+            shape=feature_specs["ko_shape"],
+            copy=False,
+        ),
+    )
+    try:
+        _quality_worker_state["quality_models"] = model_loader(1)
+    except (Exception, SystemExit) as error:
+        # checkm2 exits when its models cannot be loaded.
+        _quality_worker_state["error"] = repr(error)
+
+
+def _assess_bins_quality_in_worker(
+    bin_contents: List[Tuple[int, Contigs]]
+) -> List[Tuple[float, float]]:
+    """
+    Assess the quality of a chunk of bins in a worker process started by start_quality_workers.
+
+    :param bin_contents: Id and contigs of each bin of the chunk.
+
+    :return: The completeness and contamination of each bin, in chunk order.
+    """
+    if "error" in _quality_worker_state:
+        raise RuntimeError(
+            f"Quality worker failed to load the CheckM2 models: {_quality_worker_state['error']}"
+        )
+
+    bins = []
+    for bin_id, contigs in bin_contents:
+        # The fingerprint is not needed to assess a bin, so it is not computed.
+        bin_obj = Bin(contigs, "", "", fingerprint=0)
+        bin_obj.id = bin_id
+        bins.append(bin_obj)
+
+    quality_models = _quality_worker_state["quality_models"]
+    assess_bins_quality(
+        bins=bins,
+        contig_metadata_matrix=_quality_worker_state["contig_metadata_matrix"],
+        contig_ko_matrix=_quality_worker_state["contig_ko_matrix"],
+        contamination_weight=0,
+        postProcessor=quality_models["post_processor"],
+        modelProc=quality_models["model_processor"],
+    )
+    return [(bin_obj.completeness, bin_obj.contamination) for bin_obj in bins]
+
+
+def start_quality_workers(
+    contig_metadata_matrix: np.ndarray,
+    contig_ko_matrix: sparse.csr_matrix,
+    workers: int,
+    model_loader: Callable[[int], Dict[str, Any]] = load_quality_models,
+) -> Dict[str, Any]:
+    """
+    Start a pool of worker processes assessing bin quality, once per run.
+
+    The contig feature matrices are placed in shared memory once and every worker attaches to them,
+    so they are neither pickled with the tasks nor copied in each worker.
+    Each worker loads the checkm2 models once. The models are first loaded once in the parent process
+    to fail before any worker is started when they cannot be loaded.
+    Workers are spawned rather than forked as the models are not safe to use in a forked process.
+
+    :param contig_metadata_matrix: The contig x metadata feature matrix.
+    :param contig_ko_matrix: The sparse contig x KO count matrix.
+    :param workers: Number of worker processes.
+    :param model_loader: Function loading the checkm2 models with a given number of threads.
+        It must be importable by the spawned workers.
+
+    :return: A dictionary holding the pool, its number of workers and the shared memory blocks,
+        to stop with stop_quality_workers once every bin is assessed.
+    """
+    logging.info("Check that CheckM2 models can be loaded.")
+    model_loader(1)
+
+    contig_ko_matrix = sparse.csr_matrix(contig_ko_matrix)
+    arrays = {
+        "contig_metadata_matrix": contig_metadata_matrix,
+        "ko_data": contig_ko_matrix.data,
+        "ko_indices": contig_ko_matrix.indices,
+        "ko_indptr": contig_ko_matrix.indptr,
+    }
+
+    shared_blocks = []
+    feature_specs: Dict[str, Any] = {"ko_shape": contig_ko_matrix.shape}
+    try:
+        for key, array in arrays.items():
+            shm, feature_specs[key] = share_array(np.ascontiguousarray(array))
+            shared_blocks.append(shm)
+
+        logging.info(f"Starting {workers} quality workers.")
+        pool = multiprocessing.get_context("spawn").Pool(
+            workers,
+            initializer=_init_quality_worker,
+            initargs=(feature_specs, model_loader),
+        )
+    except BaseException:
+        unlink_shared_blocks(shared_blocks)
+        raise
+
+    return {"pool": pool, "workers": workers, "shared_blocks": shared_blocks}
+
+
+def stop_quality_workers(quality_workers: Dict[str, Any]):
+    """
+    Stop the worker processes started with start_quality_workers and free their shared memory.
+
+    Workers are terminated rather than closed, so that stopping them after an error
+    does not wait for chunks whose results are no longer needed.
+
+    :param quality_workers: The quality workers (see start_quality_workers).
+    """
+    pool = quality_workers["pool"]
+    pool.terminate()
+    pool.join()
+    unlink_shared_blocks(quality_workers["shared_blocks"])
+
+
+def unlink_shared_blocks(shared_blocks: Iterable[shared_memory.SharedMemory]):
+    """
+    Close and free shared memory blocks created with share_array.
+
+    :param shared_blocks: The shared memory blocks.
+    """
+    for shm in shared_blocks:
+        shm.close()
+        shm.unlink()
+
+
+def iter_chunks_assessed_in_workers(
+    tagged_chunks: Iterable[Tuple[Any, Sequence[Bin]]],
+    quality_workers: Dict[str, Any],
+    contamination_weight: float,
+) -> Iterator[Tuple[Any, Sequence[Bin]]]:
+    """
+    Assess the quality of chunks of bins in the quality worker processes (see start_quality_workers).
+
+    Only the id and contigs of the bins are sent to the workers. Qualities are added to the bins
+    in the parent process and chunks are yielded in input order, so that results do not depend
+    on the number of workers. At most two chunks per worker are in flight, so that chunks
+    are not consumed far ahead of the results.
+
+    :param tagged_chunks: Iterable of (tag, bins) tuples. Tags are yielded back with their chunk.
+    :param quality_workers: The quality workers (see start_quality_workers).
+    :param contamination_weight: Weight for contamination assessment.
+
+    :return: An iterator of the (tag, bins) tuples, once the quality of their bins is added.
+    """
+
+    def add_chunk_qualities(tag, chunk_bins, result):
+        qualities = result.get() if result is not None else []
+        for bin_obj, (completeness, contamination) in zip(chunk_bins, qualities):
+            bin_obj.add_quality(completeness, contamination, contamination_weight)
+        return tag, chunk_bins
+
+    pool = quality_workers["pool"]
+    pending = deque()
+    for tag, chunk_bins in tagged_chunks:
+        result = None
+        if chunk_bins:
+            result = pool.apply_async(
+                _assess_bins_quality_in_worker,
+                ([(bin_obj.id, bin_obj.contigs) for bin_obj in chunk_bins],),
+            )
+        pending.append((tag, chunk_bins, result))
+        if len(pending) >= 2 * quality_workers["workers"]:
+            yield add_chunk_qualities(*pending.popleft())
+    while pending:
+        yield add_chunk_qualities(*pending.popleft())
+
+
 def assess_bins_quality_by_chunk(
     bins: Iterable[Bin],
-    contig_to_kegg_counter: Dict,
-    contig_to_cds_count: Dict,
-    contig_to_aa_counter: Dict,
-    contig_to_aa_length: Dict,
+    contig_metadata_matrix: np.ndarray,
+    contig_ko_matrix: sparse.csr_matrix,
     contamination_weight: float,
     postProcessor: Optional[modelPostprocessing.modelProcessor] = None,
     threads: int = 1,
     chunk_size: int = 2500,
+    modelProc: Optional[modelProcessing.modelProcessor] = None,
+    on_chunk_assessed: Optional[Callable[[Iterable[Bin]], None]] = None,
+    quality_workers: Optional[Dict[str, Any]] = None,
 ):
     """
     Assess the quality of bins in chunks.
@@ -231,41 +815,57 @@ def assess_bins_quality_by_chunk(
     This function assesses the quality of bins in chunks to improve processing efficiency.
 
     :param bins: List of bin objects.
-    :param contig_to_kegg_counter: Dictionary mapping contig names to KEGG counters.
-    :param contig_to_cds_count: Dictionary mapping contig names to CDS counts.
-    :param contig_to_aa_counter: Dictionary mapping contig names to amino acid counters.
-    :param contig_to_aa_length: Dictionary mapping contig names to amino acid lengths.
+    :param contig_metadata_matrix: The contig x metadata feature matrix.
+    :param contig_ko_matrix: The sparse contig x KO count matrix.
     :param contamination_weight: Weight for contamination assessment.
     :param postProcessor: post-processor from checkm2
     :param threads: Number of threads for parallel processing (default is 1).
     :param chunk_size: The size of each chunk.
+    :param modelProc: model processor from checkm2
+    :param on_chunk_assessed: Optional function called with the bins of each chunk once they are assessed,
+        for instance to checkpoint their quality.
+    :param quality_workers: Optional quality workers (see start_quality_workers).
+        When given, chunks are assessed by the worker processes and the given models are not used.
     """
+    if quality_workers is not None:
+        with tqdm(total=len(bins), unit="bin") as pbar:
+            for i, chunk_bins in iter_chunks_assessed_in_workers(
+                enumerate(chunks(bins, chunk_size)),
+                quality_workers,
+                contamination_weight,
+            ):
+                logging.debug(f"chunk {i}: quality of {len(chunk_bins)} bins assessed")
+                if on_chunk_assessed is not None:
+                    on_chunk_assessed(chunk_bins)
+                pbar.update(len(chunk_bins))
+        return
+
     with tqdm(total=len(bins), unit="bin") as pbar:
         for i, chunk_bins_iter in enumerate(chunks(bins, chunk_size)):
             chunk_bins = set(chunk_bins_iter)
             logging.debug(f"chunk {i}: assessing quality of {len(chunk_bins)} bins")
             bins_scored = assess_bins_quality(
                 bins=chunk_bins,
-                contig_to_kegg_counter=contig_to_kegg_counter,
-                contig_to_cds_count=contig_to_cds_count,
-                contig_to_aa_counter=contig_to_aa_counter,
-                contig_to_aa_length=contig_to_aa_length,
+                contig_metadata_matrix=contig_metadata_matrix,
+                contig_ko_matrix=contig_ko_matrix,
                 contamination_weight=contamination_weight,
                 postProcessor=postProcessor,
                 threads=threads,
+                modelProc=modelProc,
             )
+            if on_chunk_assessed is not None:
+                on_chunk_assessed(chunk_bins)
             pbar.update(len(bins_scored))
 
 
 def assess_bins_quality(
     bins: Iterable[Bin],
-    contig_to_kegg_counter: Dict,
-    contig_to_cds_count: Dict,
-    contig_to_aa_counter: Dict,
-    contig_to_aa_length: Dict,
+    contig_metadata_matrix: np.ndarray,
+    contig_ko_matrix: sparse.csr_matrix,
     contamination_weight: float,
     postProcessor: Optional[modelPostprocessing.modelProcessor] = None,
     threads: int = 1,
+    modelProc: Optional[modelProcessing.modelProcessor] = None,
 ):
     """
     Assess the quality of bins.
@@ -274,23 +874,28 @@ def assess_bins_quality(
     This code is taken from checkm2 and adjusted
 
     :param bins: List of bin objects.
-    :param contig_to_kegg_counter: Dictionary mapping contig names to KEGG counters.
-    :param contig_to_cds_count: Dictionary mapping contig names to CDS counts.
-    :param contig_to_aa_counter: Dictionary mapping contig names to amino acid counters.
-    :param contig_to_aa_length: Dictionary mapping contig names to amino acid lengths.
+    :param contig_metadata_matrix: The contig x metadata feature matrix.
+    :param contig_ko_matrix: The sparse contig x KO count matrix.
     :param contamination_weight: Weight for contamination assessment.
     :param postProcessor: A post-processor from checkm2
     :param threads: Number of threads for parallel processing (default is 1).
+    :param modelProc: A model processor from checkm2. Loading its models is costly,
+        so it should be reused across calls.
     """
     if postProcessor is None:
         postProcessor = modelPostprocessing.modelProcessor(threads)
 
-    metadata_df = get_bins_metadata_df(
-        bins, contig_to_cds_count, contig_to_aa_counter, contig_to_aa_length
-    )
+    if modelProc is None:
+        modelProc = modelProcessing.modelProcessor(threads)
+
+    bins = list(bins)
+
+    bin_contig_matrix = get_bin_contig_matrix(bins, contig_metadata_matrix.shape[0])
+
+    metadata_df = get_bins_metadata_df(bins, contig_metadata_matrix, bin_contig_matrix)
 
     diamond_complete_results, ko_list_length = get_diamond_feature_per_bin_df(
-        bins, contig_to_kegg_counter
+        bins, contig_ko_matrix, bin_contig_matrix
     )
     diamond_complete_results = diamond_complete_results.drop(columns=["Name"])
 
@@ -298,7 +903,7 @@ def assess_bins_quality(
     feature_vectors = feature_vectors.sort_values(by="Name")
 
     # 4: Call general model & specific models and derive predictions"""
-    modelProc = modelProcessing.modelProcessor(threads)
+    start = time.perf_counter()
 
     vector_array = feature_vectors.iloc[:, 1:].values.astype(float)
 
@@ -329,6 +934,10 @@ def assess_bins_quality(
         )
     )
 
+    logging.debug(
+        f"Quality of {len(bins)} bins predicted in {time.perf_counter() - start:.2f}s."
+    )
+
     final_results = feature_vectors[["Name"]].copy()
     final_results["Completeness"] = np.round(final_comp, 2)
     final_results["Contamination"] = np.round(final_cont, 2)
@@ -0,0 +1,552 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from importlib.metadata import version, PackageNotFoundError
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Any
+
+from binette.bin_manager import Bin
+
+
+def get_package_version(package: str) -> str:
+    """
+    Get the installed version of a package.
+
+    :param package: Name of the package.
+
+    :return: The version of the package or 'unknown' if it is not installed.
+    """
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def get_assembly_fingerprint(
+    contigs_fasta: Path,
+    proteins: Optional[Path] = None,
+    checkm2_db: Optional[Path] = None,
+    chunk_size: int = 1 << 20,
+) -> str:
+    """
+    Compute a fingerprint of everything the bin quality depends on besides the bin contigs.
+
+    The fingerprint combines the content of the contigs file, the content of the protein
+    file when proteins are provided, the name of the CheckM2 database and the versions of
+    the tools used to predict genes and assess bin quality.
+
+    :param contigs_fasta: Path to the contigs fasta file.
+    :param proteins: Path to the protein fasta file provided by the user, if any.
+    :param checkm2_db: Path to the CheckM2 diamond database provided by the user, if any.
+    :param chunk_size: Number of bytes read at once when hashing files.
+
+    :return: The hexadecimal fingerprint of the assembly.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+
+    for file in [contigs_fasta, proteins]:
+        if file is None:
+            hasher.update(b"\0")
+            continue
+        with open(file, "rb") as fl:
+            while chunk := fl.read(chunk_size):
+                hasher.update(chunk)
+        hasher.update(b"\0")
+
+    context = [
+        Path(checkm2_db).name if checkm2_db else "",
+        get_package_version("checkm2"),
+        get_package_version("pyrodigal"),
+    ]
+    hasher.update("\0".join(context).encode())
+
+    return hasher.hexdigest()
+
+
+def get_assembly_stamp(
+    contigs_fasta: Path,
+    proteins: Optional[Path] = None,
+    checkm2_db: Optional[Path] = None,
+) -> str:
+    """
+    Compute a stamp of the assembly files without reading them.
+
+    Unlike get_assembly_fingerprint, the stamp combines the path, size and modification time
+    of the contigs and protein files, so it is cheap to compute on large assemblies but changes
+    when a file is copied or touched.
+
+    :param contigs_fasta: Path to the contigs fasta file.
+    :param proteins: Path to the protein fasta file provided by the user, if any.
+    :param checkm2_db: Path to the CheckM2 diamond database provided by the user, if any.
+
+    :return: The hexadecimal stamp of the assembly.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+
+    for file in [contigs_fasta, proteins]:
+        if file is not None:
+            stat = os.stat(file)
+            hasher.update(
+                f"{Path(file).resolve()}\0{stat.st_size}\0{stat.st_mtime_ns}".encode()
+            )
+        hasher.update(b"\0")
+
+    context = [
+        Path(checkm2_db).name if checkm2_db else "",
+        get_package_version("checkm2"),
+        get_package_version("pyrodigal"),
+    ]
+    hasher.update("\0".join(context).encode())
+
+    return hasher.hexdigest()
+
+
+def init_quality_cache(
+    cache_file: Path, assembly_fingerprint: str, max_entries: int
+) -> Dict[str, Any]:
+    """
+    Open the SQLite bin quality cache, creating it if needed.
+
+    :param cache_file: Path to the SQLite cache file.
+    :param assembly_fingerprint: Fingerprint of the assembly (see get_assembly_fingerprint).
+    :param max_entries: Maximum number of bin qualities kept in the cache.
+        Least recently used entries are evicted beyond this number.
+
+    :return: A dictionary holding the cache connection, the assembly fingerprint, the max number of entries
+        and an upper bound of the number of entries (see evict_if_full).
+    """
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+
+    connection = sqlite3.connect(cache_file, timeout=60)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS bin_quality ("
+        "assembly TEXT NOT NULL, "
+        "bin_fingerprint TEXT NOT NULL, "
+        "completeness REAL NOT NULL, "
+        "contamination REAL NOT NULL, "
+        "last_used REAL NOT NULL, "
+        "PRIMARY KEY (assembly, bin_fingerprint))"
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS bin_quality_last_used ON bin_quality (last_used)"
+    )
+    connection.commit()
+
+    return {
+        "connection": connection,
+        "assembly_fingerprint": assembly_fingerprint,
+        "max_entries": max_entries,
+        "entry_count_bound": count_entries(connection, "bin_quality"),
+    }
+
+
+def get_bin_key(bin_obj: Bin) -> str:
+    """
+    Get the cache key of a bin from its content fingerprint.
+
+    :param bin_obj: A bin object.
+
+    :return: The hexadecimal fingerprint of the bin.
+    """
+    return f"{bin_obj.fingerprint:032x}"
+
+
+def get_cached_bin_qualities(
+    quality_cache: Dict[str, Any], bins: Iterable[Bin], batch_size: int = 500
+) -> Dict[int, Tuple[float, float]]:
+    """
+    Retrieve the completeness and contamination of the bins found in the cache.
+
+    The last usage time of the retrieved entries is refreshed.
+
+    :param quality_cache: The quality cache (see init_quality_cache).
+    :param bins: Bins to look up.
+    :param batch_size: Number of bins looked up per query.
+
+    :return: A dictionary mapping the id of cached bins to their (completeness, contamination).
+    """
+    connection = quality_cache["connection"]
+    assembly_fingerprint = quality_cache["assembly_fingerprint"]
+
+    key_to_bins: Dict[str, List[Bin]] = {}
+    for bin_obj in bins:
+        key_to_bins.setdefault(get_bin_key(bin_obj), []).append(bin_obj)
+
+    keys = list(key_to_bins)
+    bin_id_to_quality = {}
+    now = time.time()
+
+    for i in range(0, len(keys), batch_size):
+        batch_keys = keys[i : i + batch_size]
+        placeholders = ", ".join("?" * len(batch_keys))
+        rows = connection.execute(
+            "SELECT bin_fingerprint, completeness, contamination FROM bin_quality "
+            f"WHERE assembly = ? AND bin_fingerprint IN ({placeholders})",
+            [assembly_fingerprint, *batch_keys],
+        ).fetchall()
+
+        for key, completeness, contamination in rows:
+            for bin_obj in key_to_bins[key]:
+                bin_id_to_quality[bin_obj.id] = (completeness, contamination)
+
+        connection.executemany(
+            "UPDATE bin_quality SET last_used = ? WHERE assembly = ? AND bin_fingerprint = ?",
+            [(now, assembly_fingerprint, key) for key, _, _ in rows],
+        )
+
+    connection.commit()
+    return bin_id_to_quality
+
+
+def store_bin_qualities(quality_cache: Dict[str, Any], bins: Iterable[Bin]):
+    """
+    Store the completeness and contamination of bins in the cache
+    and evict the least recently used entries beyond the cache size.
+
+    :param quality_cache: The quality cache (see init_quality_cache).
+    :param bins: Bins with an assessed quality.
+    """
+    connection = quality_cache["connection"]
+    assembly_fingerprint = quality_cache["assembly_fingerprint"]
+    now = time.time()
+
+    rows = [
+        (
+            assembly_fingerprint,
+            get_bin_key(bin_obj),
+            float(bin_obj.completeness),
+            float(bin_obj.contamination),
+            now,
+        )
+        for bin_obj in bins
+    ]
+    connection.executemany(
+        "INSERT OR REPLACE INTO bin_quality "
+        "(assembly, bin_fingerprint, completeness, contamination, last_used) "
+        "VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    connection.commit()
+
+    evicted_count = evict_if_full(quality_cache, len(rows), "bin_quality")
+    if evicted_count:
+        logging.debug(f"{evicted_count} entries evicted from the bin quality cache.")
+
+
+def count_entries(connection: sqlite3.Connection, table: str) -> int:
+    """
+    Count the entries of a cache table.
+
+    :param connection: Connection to the SQLite cache.
+    :param table: Name of the cache table.
+
+    :return: The number of entries of the table.
+    """
+    (entry_count,) = connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+    return entry_count
+
+
+def evict_if_full(cache: Dict[str, Any], stored_count: int, table: str) -> int:
+    """
+    Evict the least recently used entries of a cache beyond its size after entries are stored.
+
+    The cache keeps an upper bound of its number of entries, as stored entries may replace existing ones.
+    Entries are only counted when this bound exceeds the cache size.
+
+    :param cache: The quality or KO hit cache (see init_quality_cache and init_ko_hit_cache).
+    :param stored_count: Number of entries just stored in the cache.
+    :param table: Name of the cache table.
+
+    :return: The number of evicted entries.
+    """
+    cache["entry_count_bound"] += stored_count
+    if cache["entry_count_bound"] <= cache["max_entries"]:
+        return 0
+
+    entry_count = count_entries(cache["connection"], table)
+    excess = max(entry_count - cache["max_entries"], 0)
+    if excess:
+        evict_least_recently_used(cache["connection"], excess, table)
+
+    cache["entry_count_bound"] = entry_count - excess
+    return excess
+
+
+def evict_least_recently_used(
+    connection: sqlite3.Connection, evicted_count: int, table: str
+):
+    """
+    Remove the least recently used entries of a cache table.
+
+    :param connection: Connection to the SQLite cache.
+    :param evicted_count: Number of entries to remove.
+    :param table: Name of the cache table.
+    """
+    connection.execute(
+        f"DELETE FROM {table} WHERE rowid IN "
+        f"(SELECT rowid FROM {table} ORDER BY last_used LIMIT ?)",
+        (evicted_count,),
+    )
+    connection.commit()
+
+
+def get_ko_hit_context(checkm2_db: str) -> str:
+    """
+    Compute a fingerprint of everything the KO hit of a protein depends on besides its sequence.
+
+    :param checkm2_db: Path to the CheckM2 diamond database used.
+
+    :return: The hexadecimal fingerprint of the alignment context.
+    """
+    context = [
+        Path(checkm2_db).name,
+        str(Path(checkm2_db).stat().st_size),
+        get_package_version("checkm2"),
+    ]
+    return hashlib.blake2b("\0".join(context).encode(), digest_size=16).hexdigest()
+
+
+def get_protein_key(sequence: str) -> str:
+    """
+    Get the cache key of a protein from its sequence.
+
+    :param sequence: The protein sequence.
+
+    :return: The hexadecimal hash of the sequence.
+    """
+    return hashlib.blake2b(sequence.encode(), digest_size=16).hexdigest()
+
+
+def init_ko_hit_cache(
+    cache_file: Path, ko_hit_context: str, max_entries: int
+) -> Dict[str, Any]:
+    """
+    Open the SQLite cache of the Diamond KO hits of proteins, creating it if needed.
+
+    :param cache_file: Path to the SQLite cache file.
+    :param ko_hit_context: Fingerprint of the alignment context (see get_ko_hit_context).
+    :param max_entries: Maximum number of proteins kept in the cache.
+        Least recently used entries are evicted beyond this number.
+
+    :return: A dictionary holding the cache connection, the alignment context, the max number of entries
+        and an upper bound of the number of entries (see evict_if_full).
+    """
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+
+    connection = sqlite3.connect(cache_file, timeout=60)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS ko_hit ("
+        "context TEXT NOT NULL, "
+        "protein_key TEXT NOT NULL, "
+        "subject TEXT, "
+        "last_used REAL NOT NULL, "
+        "PRIMARY KEY (context, protein_key))"
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ko_hit_last_used ON ko_hit (last_used)"
+    )
+    connection.commit()
+
+    return {
+        "connection": connection,
+        "ko_hit_context": ko_hit_context,
+        "max_entries": max_entries,
+        "entry_count_bound": count_entries(connection, "ko_hit"),
+    }
+
+
+def get_cached_ko_hits(
+    ko_hit_cache: Dict[str, Any], protein_keys: Iterable[str], batch_size: int = 500
+) -> Dict[str, Optional[str]]:
+    """
+    Retrieve the Diamond hits of the proteins found in the cache.
+
+    The last usage time of the retrieved entries is refreshed.
+
+    :param ko_hit_cache: The KO hit cache (see init_ko_hit_cache).
+    :param protein_keys: Keys of the proteins to look up (see get_protein_key).
+    :param batch_size: Number of proteins looked up per query.
+
+    :return: A dictionary mapping the key of cached proteins to the subject id of their best hit,
+        or None when they have no hit.
+    """
+    connection = ko_hit_cache["connection"]
+    ko_hit_context = ko_hit_cache["ko_hit_context"]
+
+    keys = list(protein_keys)
+    key_to_subject = {}
+    now = time.time()
+
+    for i in range(0, len(keys), batch_size):
+        batch_keys = keys[i : i + batch_size]
+        placeholders = ", ".join("?" * len(batch_keys))
+        rows = connection.execute(
+            "SELECT protein_key, subject FROM ko_hit "
+            f"WHERE context = ? AND protein_key IN ({placeholders})",
+            [ko_hit_context, *batch_keys],
+        ).fetchall()
+
+        key_to_subject.update(rows)
+
+        connection.executemany(
+            "UPDATE ko_hit SET last_used = ? WHERE context = ? AND protein_key = ?",
+            [(now, ko_hit_context, key) for key, _ in rows],
+        )
+
+    connection.commit()
+    return key_to_subject
+
+
+def store_ko_hits(
+    ko_hit_cache: Dict[str, Any], key_to_subject: Dict[str, Optional[str]]
+):
+    """
+    Store the Diamond hits of proteins in the cache
+    and evict the least recently used entries beyond the cache size.
+
+    :param ko_hit_cache: The KO hit cache (see init_ko_hit_cache).
+    :param key_to_subject: A dictionary mapping protein keys to the subject id of their best hit,
+        or None when they have no hit.
+    """
+    connection = ko_hit_cache["connection"]
+    ko_hit_context = ko_hit_cache["ko_hit_context"]
+    now = time.time()
+
+    connection.executemany(
+        "INSERT OR REPLACE INTO ko_hit (context, protein_key, subject, last_used) "
+        "VALUES (?, ?, ?, ?)",
+        (
+            (ko_hit_context, key, subject, now)
+            for key, subject in key_to_subject.items()
+        ),
+    )
+    connection.commit()
+
+    evicted_count = evict_if_full(ko_hit_cache, len(key_to_subject), "ko_hit")
+    if evicted_count:
+        logging.debug(f"{evicted_count} entries evicted from the KO hit cache.")
+
+
+def get_quality_checkpoint_signature(
+    assembly_stamp: str, input_bins: Iterable[Bin], parameters: Dict[str, Any]
+) -> str:
+    """
+    Compute the signature of a quality checkpoint from the inputs and parameters of a run.
+
+    :param assembly_stamp: Stamp of the assembly files (see get_assembly_stamp).
+    :param input_bins: The input bins of the run.
+    :param parameters: Parameters of the run changing the bins that are assessed.
+
+    :return: The hexadecimal signature of the checkpoint.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(assembly_stamp.encode())
+    for bin_key in sorted(get_bin_key(bin_obj) for bin_obj in input_bins):
+        hasher.update(bin_key.encode())
+    for name, value in sorted(parameters.items()):
+        hasher.update(f"\0{name}={value}".encode())
+
+    return hasher.hexdigest()
+
+
+def init_quality_checkpoint(
+    checkpoint_file: Path, signature: str, resume: bool
+) -> Dict[str, Any]:
+    """
+    Open the quality checkpoint file, to which the quality of bins is appended as soon as they are assessed.
+
+    When resuming, the qualities of a checkpoint file written with the same signature are loaded.
+    Otherwise, or when the signature changed, the checkpoint file starts empty.
+    Lines of an interrupted write are ignored.
+
+    :param checkpoint_file: Path to the checkpoint file.
+    :param signature: Signature of the run (see get_quality_checkpoint_signature).
+    :param resume: Whether to load the qualities of an existing checkpoint file.
+
+    :return: A dictionary holding the open checkpoint file and the qualities it contains, by bin key.
+    """
+    header = f"# binette quality checkpoint {signature}\n"
+    bin_key_to_quality: Dict[str, Tuple[float, float]] = {}
+
+    if resume and checkpoint_file.exists():
+        with open(checkpoint_file) as fl:
+            if fl.readline() == header:
+                for line in fl:
+                    fields = line.rstrip("\n").split("\t")
+                    if line.endswith("\n") and len(fields) == 3:
+                        bin_key_to_quality[fields[0]] = (
+                            float(fields[1]),
+                            float(fields[2]),
+                        )
+                logging.info(
+                    f"Quality of {len(bin_key_to_quality)} bins found in checkpoint {checkpoint_file}."
+                )
+            else:
+                logging.info(
+                    f"Inputs or parameters changed since checkpoint {checkpoint_file} was written, "
+                    "it is not used."
+                )
+
+    # The checkpoint is rewritten without the lines of an interrupted write.
+    checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_checkpoint_file = checkpoint_file.parent / f"{checkpoint_file.name}.tmp"
+    with open(tmp_checkpoint_file, "w") as fl:
+        fl.write(header)
+        fl.writelines(
+            f"{key}\t{completeness}\t{contamination}\n"
+            for key, (completeness, contamination) in bin_key_to_quality.items()
+        )
+    tmp_checkpoint_file.replace(checkpoint_file)
+
+    return {
+        "file": open(checkpoint_file, "a"),
+        "bin_key_to_quality": bin_key_to_quality,
+    }
+
+
+def get_checkpointed_bin_qualities(
+    quality_checkpoint: Dict[str, Any], bins: Iterable[Bin]
+) -> Dict[int, Tuple[float, float]]:
+    """
+    Retrieve the completeness and contamination of the bins found in the quality checkpoint.
+
+    :param quality_checkpoint: The quality checkpoint (see init_quality_checkpoint).
+    :param bins: Bins to look up.
+
+    :return: A dictionary mapping the id of checkpointed bins to their (completeness, contamination).
+    """
+    bin_key_to_quality = quality_checkpoint["bin_key_to_quality"]
+    bin_id_to_quality = {}
+    for bin_obj in bins:
+        quality = bin_key_to_quality.get(get_bin_key(bin_obj))
+        if quality is not None:
+            bin_id_to_quality[bin_obj.id] = quality
+
+    return bin_id_to_quality
+
+
+def append_to_quality_checkpoint(
+    quality_checkpoint: Dict[str, Any], bins: Iterable[Bin]
+):
+    """
+    Append the completeness and contamination of assessed bins to the quality checkpoint file.
+
+    The file is flushed to disk so that the qualities survive a crash of the run.
+
+    :param quality_checkpoint: The quality checkpoint (see init_quality_checkpoint).
+    :param bins: Bins with an assessed quality.
+    """
+    fl = quality_checkpoint["file"]
+    bin_key_to_quality = quality_checkpoint["bin_key_to_quality"]
+
+    for bin_obj in bins:
+        key = get_bin_key(bin_obj)
+        completeness = float(bin_obj.completeness)
+        contamination = float(bin_obj.contamination)
+        bin_key_to_quality[key] = (completeness, contamination)
+        fl.write(f"{key}\t{completeness}\t{contamination}\n")
+
+    fl.flush()
+    os.fsync(fl.fileno())
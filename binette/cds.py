@@ -1,15 +1,28 @@
-import concurrent.futures as cf
 import multiprocessing.pool
 import logging
-from collections import Counter, defaultdict
-from typing import Dict, List, Iterator, Tuple, Any, Union, Set
+import time
+from collections import deque
+from functools import partial
+from typing import Any, Callable, Dict, List, Iterator, Optional, Tuple, Set
 
+import numpy as np
 import pyfastx
 import pyrodigal
-from tqdm import tqdm
 from pathlib import Path
 import gzip
 
+# Amino acids whose counts are used as contig features.
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+AMINO_ACID_BYTES = np.frombuffer(AMINO_ACIDS.encode(), dtype=np.uint8)
+
+# Column of each byte value in the amino acid composition, other characters go in an extra last column.
+AMINO_ACID_COLUMN_OF_BYTE = np.full(256, len(AMINO_ACIDS), dtype=np.int64)
+AMINO_ACID_COLUMN_OF_BYTE[AMINO_ACID_BYTES] = np.arange(len(AMINO_ACIDS))
+
+# Contig indices of a batch of proteins, with their CDS count, amino acid composition
+# and amino acid length (see count_cds_of_batch).
+CdsCounts = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
 
 def get_contig_from_cds_name(cds_name: str) -> str:
     """
@@ -24,16 +37,36 @@ def get_contig_from_cds_name(cds_name: str) -> str:
 
 
 def predict(
-    contigs_iterator: Iterator, outfaa: str, threads: int = 1
-) -> Dict[str, List[str]]:
+    contigs_iterator: Iterator,
+    outfaa: str,
+    contig_to_index: Dict[str, int],
+    threads: int = 1,
+    window_size: Optional[int] = None,
+    min_task_length: int = 1_000_000,
+    on_proteins: Optional[Callable[[List[Tuple[str, str]]], None]] = None,
+) -> Dict[str, np.ndarray]:
     """
     Predict open reading frames with Pyrodigal.
 
+    Predictions are streamed: the genes of each contig are written to the output file
+    and folded in the contig CDS metadata as soon as they are predicted, in contig order, and then released.
+    Contigs are predicted in tasks of consecutive contigs (see iter_prediction_tasks), whose genes are
+    translated and counted by the thread predicting them (see predict_proteins_of_task).
+    Giving contigs longest first (see iter_contigs_longest_first) keeps all threads busy until the end.
+
     :param contigs_iterator: An iterator of contig sequences.
     :param outfaa: The output file path for predicted protein sequences (in FASTA format).
+        Proteins are named after their contig and their rank in the contig, as Prodigal does (>contigID_geneID).
+    :param contig_to_index: A dictionary mapping contig names to their index.
     :param threads: Number of CPU threads to use (default is 1).
-
-    :return: A dictionary mapping contig names to predicted genes.
+    :param window_size: Maximum number of tasks read and not yet written (see iter_predicted_genes).
+        Defaults to four tasks per thread.
+    :param min_task_length: Minimum total length of the contigs of a task, except for the last one.
+    :param on_proteins: Optional function called with the proteins of each task as (protein id, sequence) tuples,
+        as soon as they are written, for instance to align them while the next contigs are predicted
+        (see diamond.pipelined_run). Protein ids are the ids of the output file.
+
+    :return: The contig CDS metadata arrays indexed by contig index (see make_contig_cds_metadata).
     """
     try:
         # for version >=3 of pyrodigal
@@ -41,41 +74,159 @@ def predict(
     except AttributeError:
         orf_finder = pyrodigal.OrfFinder(meta="meta")  # type: ignore
 
+    if window_size is None:
+        window_size = 4 * threads
+
     logging.info(f"Predicting cds sequences with Pyrodigal using {threads} threads.")
 
-    with multiprocessing.pool.ThreadPool(processes=threads) as pool:
-        contig_and_genes = pool.starmap(
-            predict_genes,
-            ((orf_finder.find_genes, name, seq) for name, seq in contigs_iterator),
-        )
+    start = time.perf_counter()
+    busy_time = 0.0
+    contig_count = 0
+    contig_cds_metadata = make_contig_cds_metadata(len(contig_to_index))
+    with (
+        multiprocessing.pool.ThreadPool(processes=threads) as pool,
+        gzip.open(outfaa, "wt") as fl,
+    ):
+        for (
+            task_contig_count,
+            protein_ids,
+            proteins,
+            cds_counts,
+        ), task_time in iter_predicted_genes(
+            pool,
+            partial(predict_proteins_of_task, orf_finder.find_genes, contig_to_index),
+            iter_prediction_tasks(contigs_iterator, min_task_length),
+            window_size,
+        ):
+            busy_time += task_time
+            fl.write(
+                "".join(
+                    f">{protein_id}\n{protein}\n"
+                    for protein_id, protein in zip(protein_ids, proteins)
+                )
+            )
+            add_cds_counts_to_contig_metadata(contig_cds_metadata, cds_counts)
+            if on_proteins is not None:
+                on_proteins(list(zip(protein_ids, proteins)))
+            contig_count += task_contig_count
+
+    elapsed_time = time.perf_counter() - start
+    logging.info(
+        f"Genes of {contig_count} contigs predicted in {elapsed_time:.1f}s "
+        f"with a thread utilization of {busy_time / max(elapsed_time * threads, 1e-9):.0%}."
+    )
 
-    write_faa(outfaa, contig_and_genes)
+    return contig_cds_metadata
 
-    contig_to_genes = {
-        contig_id: [gene.translate() for gene in pyrodigal_genes]
-        for contig_id, pyrodigal_genes in contig_and_genes
-    }
 
-    return contig_to_genes
+def iter_contigs_longest_first(
+    fasta: pyfastx.Fasta, contig_to_length: Dict[str, int]
+) -> Iterator[Tuple[str, str]]:
+    """
+    Read contig sequences from an indexed FASTA file, from the longest to the shortest contig.
 
+    :param fasta: The indexed FASTA file of the contigs (see contig_manager.parse_fasta_file).
+    :param contig_to_length: A dictionary mapping the names of the contigs to read to their length.
 
-def predict_genes(find_genes, name, seq) -> Tuple[str, pyrodigal.Genes]:
+    :return: An iterator of contig names and sequences.
+    """
+    for name in sorted(contig_to_length, key=lambda c: (-contig_to_length[c], c)):
+        yield name, fasta[name].seq
 
-    return (name, find_genes(seq))
 
+def iter_prediction_tasks(
+    contigs_iterator: Iterator, min_task_length: int
+) -> Iterator[List[Tuple[str, str]]]:
+    """
+    Group consecutive contigs in prediction tasks.
 
-def write_faa(outfaa: str, contig_to_genes: List[Tuple[str, pyrodigal.Genes]]) -> None:
+    Short contigs are grouped so that they do not each pay the cost of a task,
+    while long contigs make a task on their own.
+
+    :param contigs_iterator: An iterator of contig names and sequences.
+    :param min_task_length: Minimum total length of the contigs of a task, except for the last one.
+
+    :return: An iterator of tasks, each given as a list of contig names and sequences.
     """
-    Write predicted protein sequences to a FASTA file.
+    task = []
+    task_length = 0
+    for name, seq in contigs_iterator:
+        task.append((name, seq))
+        task_length += len(seq)
+        if task_length >= min_task_length:
+            yield task
+            task = []
+            task_length = 0
+
+    if task:
+        yield task
+
+
+def iter_predicted_genes(
+    pool: multiprocessing.pool.ThreadPool,
+    predict_task: Callable[[List[Tuple[str, str]]], Tuple[Any, float]],
+    tasks: Iterator[List[Tuple[str, str]]],
+    window_size: int,
+) -> Iterator[Tuple[Any, float]]:
+    """
+    Predict the genes of tasks of contigs in a thread pool and yield them in task order.
 
-    :param outfaa: The output file path for predicted protein sequences (in FASTA format).
-    :param contig_to_genes: A dictionary mapping contig names to predicted genes.
+    Tasks are read from the iterator only when fewer than window_size tasks are in flight,
+    so that neither sequences nor predictions pile up when predictions are consumed
+    more slowly than they are produced.
+
+    :param pool: The thread pool running the predictions.
+    :param predict_task: Function predicting the genes of a task, returning its predictions
+        and the time spent making them (see predict_proteins_of_task).
+    :param tasks: An iterator of tasks, each given as a list of contig names and sequences.
+    :param window_size: Maximum number of tasks in flight.
+
+    :return: An iterator of the predictions of each task, with the time spent making them.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(predict_task, (task,)))
+        if len(pending) >= window_size:
+            yield pending.popleft().get()
 
+    while pending:
+        yield pending.popleft().get()
+
+
+def predict_proteins_of_task(
+    find_genes, contig_to_index: Dict[str, int], task: List[Tuple[str, str]]
+) -> Tuple[Tuple[int, List[str], List[str], Optional[CdsCounts]], float]:
     """
-    logging.info("Writing predicted protein sequences.")
-    with gzip.open(outfaa, "wt") as fl:
-        for contig_id, genes in contig_to_genes:
-            genes.write_translations(fl, contig_id)
+    Predict and translate the genes of the contigs of a task, and count their CDS metadata.
+
+    A task is a range of consecutive contigs, so its genes are counted at once (see count_cds_of_batch)
+    by the thread predicting them rather than by the thread writing the proteins.
+
+    :param find_genes: The find_genes method of a Pyrodigal gene finder.
+    :param contig_to_index: A dictionary mapping contig names to their index.
+    :param task: A list of contig names and sequences.
+
+    :return: The number of contigs of the task, the ids and sequences of its proteins, named as Prodigal does
+        (>contigID_geneID), and their CDS counts (None without protein), with the time spent on the task.
+    """
+    start = time.perf_counter()
+    contig_indices = []
+    protein_ids = []
+    proteins = []
+    for name, seq in task:
+        contig_id, genes = predict_genes(find_genes, name, seq)
+        for i, gene in enumerate(genes, start=1):
+            contig_indices.append(contig_to_index[contig_id])
+            protein_ids.append(f"{contig_id}_{i}")
+            proteins.append(gene.translate())
+
+    cds_counts = count_cds_of_batch(contig_indices, proteins) if proteins else None
+    return (len(task), protein_ids, proteins, cds_counts), time.perf_counter() - start
+
+
+def predict_genes(find_genes, name, seq) -> Tuple[str, pyrodigal.Genes]:
+
+    return (name, find_genes(seq))
 
 
 def is_nucleic_acid(sequence: str) -> bool:
@@ -96,26 +247,52 @@ def is_nucleic_acid(sequence: str) -> bool:
     return False
 
 
-def parse_faa_file(faa_file: str) -> Dict[str, List[str]]:
+def parse_faa_file(
+    faa_file: str, contig_to_index: Dict[str, int], batch_size: int = 10000
+) -> Dict[str, np.ndarray]:
     """
-    Parse a FASTA file containing protein sequences and organize them by contig.
+    Parse a FASTA file containing protein sequences and compute the CDS metadata of their contigs.
+
+    Sequences are counted by batches (see count_cds_of_batch) and are not retained.
 
     :param faa_file: Path to the input FASTA file.
-    :return: A dictionary mapping contig names to lists of protein sequences.
-    :raises ValueError: If the file contains nucleotidic sequences instead of protein sequences.
+    :param contig_to_index: A dictionary mapping contig names to their index.
+    :param batch_size: Number of sequences counted at once.
+    :return: The contig CDS metadata arrays indexed by contig index (see make_contig_cds_metadata).
+    :raises ValueError: If the file contains nucleotidic sequences instead of protein sequences,
+        or sequences of contigs not found in the contig index.
     """
-    contig_to_genes = defaultdict(list)
+    contig_cds_metadata = make_contig_cds_metadata(len(contig_to_index))
     checked_sequences = []
+    unknown_contigs = set()
 
+    contig_indices = []
+    proteins = []
     # Iterate through the FASTA file and parse sequences
     for name, seq in pyfastx.Fastx(faa_file):
         contig = get_contig_from_cds_name(name)
-        contig_to_genes[contig].append(seq)
+        if contig not in contig_to_index:
+            unknown_contigs.add(contig)
+            continue
+
+        contig_indices.append(contig_to_index[contig])
+        proteins.append(seq)
+        if len(proteins) >= batch_size:
+            add_cds_counts_to_contig_metadata(
+                contig_cds_metadata, count_cds_of_batch(contig_indices, proteins)
+            )
+            contig_indices = []
+            proteins = []
 
         # Concatenate up to the first 20 sequences for validation
         if len(checked_sequences) < 20:
             checked_sequences.append(seq)
 
+    if proteins:
+        add_cds_counts_to_contig_metadata(
+            contig_cds_metadata, count_cds_of_batch(contig_indices, proteins)
+        )
+
     # Concatenate all checked sequences for a more reliable nucleic acid check
     concatenated_seq = "".join(checked_sequences)
 
@@ -126,90 +303,83 @@ def parse_faa_file(faa_file: str) -> Dict[str, List[str]]:
             "Ensure that the file contains valid protein sequences in FASTA format."
         )
 
-    return dict(contig_to_genes)
-
-
-def get_aa_composition(genes: List[str]) -> Counter:
-    """
-    Calculate the amino acid composition of a list of protein sequences.
-
-    :param genes: A list of protein sequences.
-    :return: A Counter object representing the amino acid composition.
-    """
-    aa_counter = Counter()
-    for gene in genes:
-        aa_counter += Counter(gene)
+    if unknown_contigs:
+        raise ValueError(
+            f"{len(unknown_contigs)} contigs found in file '{faa_file}' "
+            "were not found in the contigs of the input bins."
+        )
 
-    return aa_counter
+    return contig_cds_metadata
 
 
-def get_contig_cds_metadata_flat(
-    contig_to_genes: Dict[str, List[str]]
-) -> Tuple[Dict[str, int], Dict[str, Counter], Dict[str, int]]:
+def make_contig_cds_metadata(contig_count: int) -> Dict[str, np.ndarray]:
     """
-    Calculate metadata for contigs, including CDS count, amino acid composition, and total amino acid length.
+    Create empty contig CDS metadata arrays.
 
-    :param contig_to_genes: A dictionary mapping contig names to lists of protein sequences.
-    :return: A tuple containing dictionaries for CDS count, amino acid composition, and total amino acid length.
+    :param contig_count: Number of contigs in the contig index.
+    :return: A dictionary of arrays indexed by contig index: CDS count ("contig_cds_count"),
+        amino acid composition with one column per amino acid of AMINO_ACIDS ("contig_aa_composition")
+        and total amino acid length ("contig_aa_length").
     """
-    contig_to_cds_count = {
-        contig: len(genes) for contig, genes in contig_to_genes.items()
+    return {
+        "contig_cds_count": np.zeros(contig_count, dtype=np.int64),
+        "contig_aa_composition": np.zeros(
+            (contig_count, len(AMINO_ACIDS)), dtype=np.int64
+        ),
+        "contig_aa_length": np.zeros(contig_count, dtype=np.int64),
     }
 
-    contig_to_aa_counter = {
-        contig: get_aa_composition(genes)
-        for contig, genes in tqdm(contig_to_genes.items(), unit="contig")
-    }
-    logging.info("Calculating amino acid composition.")
-
-    contig_to_aa_length = {
-        contig: sum(counter.values())
-        for contig, counter in tqdm(contig_to_aa_counter.items(), unit="contig")
-    }
-    logging.info("Calculating total amino acid length.")
 
-    return contig_to_cds_count, contig_to_aa_counter, contig_to_aa_length
+def count_cds_of_batch(contig_indices: List[int], proteins: List[str]) -> CdsCounts:
+    """
+    Count the CDS, amino acids and amino acid length of the contigs of a batch of protein sequences.
 
+    Characters of the whole batch are counted at once with numpy byte counting,
+    per contig of the batch and per amino acid.
 
-def get_contig_cds_metadata(
-    contig_to_genes: Dict[int, Union[Any, List[Any]]], threads: int
-) -> Dict[str, Dict]:
+    :param contig_indices: The contig index of each protein.
+    :param proteins: The protein sequences.
+    :return: A tuple of arrays: the contig indices of the batch, and their CDS count,
+        amino acid composition (one column per amino acid of AMINO_ACIDS) and total amino acid length.
     """
-    Calculate metadata for contigs in parallel, including CDS count, amino acid composition, and total amino acid length.
+    batch_contigs, protein_contigs = np.unique(
+        np.asarray(contig_indices, dtype=np.int64), return_inverse=True
+    )
+    protein_lengths = np.fromiter(
+        (len(protein) for protein in proteins), dtype=np.int64, count=len(proteins)
+    )
+    # Non ASCII characters are replaced by a single byte so that lengths are kept.
+    sequence_bytes = np.frombuffer(
+        "".join(proteins).encode("ascii", errors="replace"), dtype=np.uint8
+    )
 
-    :param contig_to_genes: A dictionary mapping contig names to lists of protein sequences.
-    :param threads: Number of CPU threads to use.
-    :return: A tuple containing dictionaries for CDS count, amino acid composition, and total amino acid length.
-    """
-    contig_to_cds_count = {
-        contig: len(genes) for contig, genes in contig_to_genes.items()
-    }
+    column_count = len(AMINO_ACIDS) + 1
+    char_counts = np.bincount(
+        np.repeat(protein_contigs, protein_lengths) * column_count
+        + AMINO_ACID_COLUMN_OF_BYTE[sequence_bytes],
+        minlength=len(batch_contigs) * column_count,
+    ).reshape(len(batch_contigs), column_count)
 
-    contig_to_future = {}
-    logging.info(f"Collecting contig amino acid composition using {threads} threads.")
-    with cf.ProcessPoolExecutor(max_workers=threads) as tpe:
-        for contig, genes in tqdm(contig_to_genes.items()):
-            contig_to_future[contig] = tpe.submit(get_aa_composition, genes)
+    cds_count = np.bincount(protein_contigs, minlength=len(batch_contigs))
+    return batch_contigs, cds_count, char_counts[:, :-1], char_counts.sum(axis=1)
 
-    contig_to_aa_counter = {
-        contig: future.result()
-        for contig, future in tqdm(contig_to_future.items(), unit="contig")
-    }
-    logging.info("Calculating amino acid composition in parallel.")
 
-    contig_to_aa_length = {
-        contig: sum(counter.values())
-        for contig, counter in tqdm(contig_to_aa_counter.items(), unit="contig")
-    }
-    logging.info("Calculating total amino acid length in parallel.")
+def add_cds_counts_to_contig_metadata(
+    contig_cds_metadata: Dict[str, np.ndarray], cds_counts: Optional[CdsCounts]
+) -> None:
+    """
+    Fold the CDS counts of a batch of protein sequences in the CDS metadata of their contigs.
 
-    contig_info = {
-        "contig_to_cds_count": contig_to_cds_count,
-        "contig_to_aa_counter": contig_to_aa_counter,
-        "contig_to_aa_length": contig_to_aa_length,
-    }
+    :param contig_cds_metadata: Contig CDS metadata arrays (see make_contig_cds_metadata), updated in place.
+    :param cds_counts: The CDS counts of the batch (see count_cds_of_batch), or None for an empty batch.
+    """
+    if cds_counts is None:
+        return
 
-    return contig_info
+    batch_contigs, cds_count, aa_composition, aa_length = cds_counts
+    contig_cds_metadata["contig_cds_count"][batch_contigs] += cds_count
+    contig_cds_metadata["contig_aa_composition"][batch_contigs] += aa_composition
+    contig_cds_metadata["contig_aa_length"][batch_contigs] += aa_length
 
 
 def filter_faa_file(
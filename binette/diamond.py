@@ -3,11 +3,30 @@ import logging
 import sys
 import shutil
 import re
+import heapq
+import json
+import time
+import filecmp
+import gzip
+import concurrent.futures as cf
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import pyfastx
+
+import numpy as np
 import pandas as pd
-from collections import Counter
+from scipy import sparse
 
 from checkm2 import keggData
 
+from binette import cache_manager
+
+# Minimum total length of the proteins aligned by each Diamond run in pipelined mode.
+PIPELINE_BATCH_LENGTH = 20_000_000
+
 
 def get_checkm2_db() -> str:
     """
@@ -111,38 +130,400 @@ def run(
     logging.info("Finished Running DIAMOND")
 
 
-def get_contig_to_kegg_id(diamond_result_file: str) -> dict:
+def get_faa_file_signature(faa_file: Path, shard_count: int) -> Dict[str, Any]:
     """
-    Get a dictionary mapping contig IDs to KEGG annotations from a Diamond result file.
+    Get a signature of a protein file split in shards, used to check that existing shards can be reused.
 
-    :param diamond_result_file: Path to the Diamond result file.
-    :return: A dictionary mapping contig IDs to KEGG annotations.
+    :param faa_file: Path to the protein file.
+    :param shard_count: Number of shards.
+    :return: A dictionary with the path, size and modification time of the protein file and the shard count.
+    """
+    faa_stat = faa_file.stat()
+    return {
+        "faa_file": faa_file.resolve().as_posix(),
+        "faa_file_size": faa_stat.st_size,
+        "faa_file_mtime_ns": faa_stat.st_mtime_ns,
+        "shard_count": shard_count,
+    }
+
+
+def split_faa_file(faa_file: Path, shard_faa_files: List[Path]) -> List[int]:
+    """
+    Split a protein file in shards of balanced total sequence length.
+
+    Each protein is written to the shard with the shortest total sequence length so far.
+
+    :param faa_file: Path to the protein file.
+    :param shard_faa_files: Paths of the shard protein files.
+    :return: The number of proteins written in each shard.
     """
-    diamon_results_df = pd.read_csv(
-        diamond_result_file, sep="\t", usecols=[0, 1], names=["ProteinID", "annotation"]
+    protein_counts = [0] * len(shard_faa_files)
+    shard_lengths = [(0, shard) for shard in range(len(shard_faa_files))]
+
+    shard_fls = [open(shard_faa_file, "w") for shard_faa_file in shard_faa_files]
+    try:
+        for name, seq in pyfastx.Fastx(faa_file.as_posix()):
+            length, shard = heapq.heappop(shard_lengths)
+            shard_fls[shard].write(f">{name}\n{seq}\n")
+            protein_counts[shard] += 1
+            heapq.heappush(shard_lengths, (length + len(seq), shard))
+    finally:
+        for fl in shard_fls:
+            fl.close()
+
+    return protein_counts
+
+
+def run_sharded(
+    faa_file: Path,
+    output: Path,
+    db: str,
+    shard_dir: Path,
+    shard_count: int,
+    jobs: int = 1,
+    threads: int = 1,
+    low_mem: bool = False,
+):
+    """
+    Run Diamond on shards of the protein file and merge their results.
+
+    The protein file is split in shards of balanced total sequence length that are aligned
+    by up to `jobs` Diamond processes at once, sharing the threads.
+    The completion of each shard is recorded in the shard directory: when the protein file and
+    the shard count did not change, the split is reused and only the unfinished shards are run.
+    Shard results are gzipped tables that are concatenated in the output file,
+    in the format expected by get_contig_to_kegg_id.
+
+    :param faa_file: Path to the input protein sequence file (FASTA format).
+    :param output: Path to the merged Diamond output file.
+    :param db: Path to the Diamond database.
+    :param shard_dir: Directory storing the shard files.
+    :param shard_count: Number of shards.
+    :param jobs: Maximum number of shards run at the same time.
+    :param threads: Total number of CPU threads, divided between the running shards.
+    :param low_mem: Use low memory mode if True (default is False).
+    """
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    split_file = shard_dir / "shards.json"
+    shard_faa_files = [shard_dir / f"shard_{i}.faa" for i in range(shard_count)]
+
+    signature = get_faa_file_signature(faa_file, shard_count)
+    split = json.loads(split_file.read_text()) if split_file.exists() else {}
+
+    if split.get("signature") == signature:
+        logging.info(f"Reusing the {shard_count} Diamond shards found in {shard_dir}.")
+        protein_counts = split["protein_counts"]
+    else:
+        logging.info(f"Splitting {faa_file} in {shard_count} Diamond shards.")
+        for done_file in shard_dir.glob("shard_*.done"):
+            done_file.unlink()
+        protein_counts = split_faa_file(faa_file, shard_faa_files)
+        split_file.write_text(
+            json.dumps({"signature": signature, "protein_counts": protein_counts})
+        )
+
+    shard_outputs = [shard_dir / f"shard_{i}.tsv.gz" for i in range(shard_count)]
+    shards_to_run = [
+        shard
+        for shard in range(shard_count)
+        if protein_counts[shard] and not (shard_dir / f"shard_{shard}.done").exists()
+    ]
+    logging.info(
+        f"Running Diamond on {len(shards_to_run)}/{shard_count} shards, {jobs} at a time."
     )
-    diamon_results_df[["Ref100_hit", "Kegg_annotation"]] = diamon_results_df[
-        "annotation"
-    ].str.split("~", n=1, expand=True)
 
+    def run_shard(shard: int):
+        run(
+            shard_faa_files[shard].as_posix(),
+            shard_outputs[shard].as_posix(),
+            db,
+            (shard_dir / f"shard_{shard}.log").as_posix(),
+            max(1, threads // jobs),
+            low_mem=low_mem,
+        )
+        (shard_dir / f"shard_{shard}.done").touch()
+
+    with cf.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for future in [executor.submit(run_shard, shard) for shard in shards_to_run]:
+            future.result()
+
+    # Gzip members can be concatenated into a single valid gzip file.
+    tmp_output = output.parent / f"{output.name}.tmp"
+    with open(tmp_output, "wb") as merged_fl:
+        for shard in range(shard_count):
+            if protein_counts[shard]:
+                with open(shard_outputs[shard], "rb") as shard_fl:
+                    shutil.copyfileobj(shard_fl, merged_fl)
+    tmp_output.replace(output)
+
+    logging.info(f"Merged the results of {shard_count} Diamond shards in {output}.")
+
+
+@contextmanager
+def pipelined_run(
+    output: Path,
+    db: str,
+    batch_dir: Path,
+    jobs: int = 1,
+    threads: int = 1,
+    low_mem: bool = False,
+    min_batch_length: int = PIPELINE_BATCH_LENGTH,
+) -> Iterator[Callable[[List[Tuple[str, str]]], None]]:
+    """
+    Run Diamond on batches of proteins while they are being predicted.
+
+    The context manager yields a function receiving proteins as (protein id, sequence) tuples.
+    Proteins are written in batch files of at least `min_batch_length` residues
+    that are aligned by up to `jobs` Diamond processes at once, sharing the threads.
+    The gzipped hit table of each finished batch is appended to the output file in batch order,
+    and the batch files are removed. On exit, the last batch is aligned and
+    the output file is complete, in the format expected by get_contig_to_kegg_id.
+
+    :param output: Path to the merged Diamond output file.
+    :param db: Path to the Diamond database.
+    :param batch_dir: Directory storing the batch files.
+    :param jobs: Maximum number of batches aligned at the same time.
+    :param threads: Total number of CPU threads, divided between the running batches.
+    :param low_mem: Use low memory mode if True (default is False).
+    :param min_batch_length: Minimum total length of the proteins of a batch, except for the last one.
+
+    :return: A context manager yielding the function adding proteins to align.
+    """
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    tmp_output = output.parent / f"{output.name}.tmp"
+
+    batch: Dict[str, Any] = {"proteins": [], "length": 0, "count": 0}
+    running_batches: deque = deque()
+
+    def run_batch(batch_faa: Path, batch_output: Path):
+        run(
+            batch_faa.as_posix(),
+            batch_output.as_posix(),
+            db,
+            (batch_dir / f"{batch_faa.stem}.log").as_posix(),
+            max(1, threads // jobs),
+            low_mem=low_mem,
+        )
+        batch_faa.unlink()
+
+    def submit_batch():
+        batch_faa = batch_dir / f"batch_{batch['count']}.faa"
+        batch_output = batch_dir / f"batch_{batch['count']}.tsv.gz"
+        with open(batch_faa, "w") as fl:
+            fl.writelines(f">{name}\n{seq}\n" for name, seq in batch["proteins"])
+
+        future = executor.submit(run_batch, batch_faa, batch_output)
+        running_batches.append((future, batch_output))
+        batch.update(proteins=[], length=0, count=batch["count"] + 1)
+
+    def merge_finished_batches(wait: bool):
+        # Gzip members can be concatenated into a single valid gzip file.
+        while running_batches and (wait or running_batches[0][0].done()):
+            future, batch_output = running_batches.popleft()
+            future.result()
+            with open(batch_output, "rb") as batch_fl:
+                shutil.copyfileobj(batch_fl, merged_fl)
+            batch_output.unlink()
+
+    def add_proteins(proteins: List[Tuple[str, str]]):
+        batch["proteins"] += proteins
+        batch["length"] += sum(len(seq) for _, seq in proteins)
+        if batch["length"] >= min_batch_length:
+            submit_batch()
+        merge_finished_batches(wait=False)
+
+    with (
+        cf.ThreadPoolExecutor(max_workers=jobs) as executor,
+        open(tmp_output, "wb") as merged_fl,
+    ):
+        try:
+            yield add_proteins
+
+            if batch["proteins"]:
+                submit_batch()
+            start = time.perf_counter()
+            merge_finished_batches(wait=True)
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            tmp_output.unlink()
+            raise
+
+    tmp_output.replace(output)
+    logging.info(
+        f"Diamond aligned {batch['count']} batches of proteins and finished "
+        f"{time.perf_counter() - start:.1f}s after the last proteins were given."
+    )
+
+
+def run_with_ko_hit_cache(
+    faa_file: Path,
+    output: Path,
+    ko_hit_cache: Dict[str, Any],
+    align: Callable[[Path, Path], None],
+):
+    """
+    Run Diamond only on the proteins whose hit is not in the KO hit cache.
+
+    Proteins are identified by a hash of their sequence (see cache_manager.get_protein_key).
+    Each distinct sequence missing from the cache is aligned once, and its best hit,
+    or the absence of hit, is stored in the cache. The output file lists the hit of every protein
+    of the protein file, in the format expected by get_contig_to_kegg_id.
+
+    :param faa_file: Path to the input protein sequence file (FASTA format).
+    :param output: Path to the Diamond output file.
+    :param ko_hit_cache: The KO hit cache (see cache_manager.init_ko_hit_cache).
+    :param align: Function running Diamond on a protein file and writing its result to an output file.
+    """
+    protein_ids = []
+    protein_keys = []
+    for name, seq in pyfastx.Fastx(faa_file.as_posix()):
+        protein_ids.append(name)
+        protein_keys.append(cache_manager.get_protein_key(seq))
+
+    key_to_subject = cache_manager.get_cached_ko_hits(ko_hit_cache, set(protein_keys))
+    cached_protein_count = sum(key in key_to_subject for key in protein_keys)
+    logging.info(
+        f"KO hit cache: {cached_protein_count}/{len(protein_keys)} proteins "
+        f"({cached_protein_count / max(len(protein_keys), 1):.1%}) found in the cache."
+    )
+
+    missing_faa = output.parent / "ko_hit_cache_misses.faa"
+    missing_output = output.parent / "ko_hit_cache_misses.tsv.gz"
+    tmp_missing_faa = output.parent / "ko_hit_cache_misses.faa.tmp"
+    missing_keys = set()
+    with open(tmp_missing_faa, "w") as fl:
+        for key, (_, seq) in zip(protein_keys, pyfastx.Fastx(faa_file.as_posix())):
+            if key not in key_to_subject and key not in missing_keys:
+                missing_keys.add(key)
+                fl.write(f">{key}\n{seq}\n")
+
+    # An identical file of missing proteins left by an interrupted run is kept as is,
+    # so that the shards of a sharded alignment of this file can be resumed.
+    if missing_faa.exists() and filecmp.cmp(
+        tmp_missing_faa, missing_faa, shallow=False
+    ):
+        tmp_missing_faa.unlink()
+    else:
+        tmp_missing_faa.replace(missing_faa)
+
+    if missing_keys:
+        logging.info(f"Running Diamond on {len(missing_keys)} distinct proteins.")
+        align(missing_faa, missing_output)
+
+        missing_key_to_subject: Dict[str, Optional[str]] = dict.fromkeys(missing_keys)
+        for hits in iter_diamond_hit_chunks(missing_output.as_posix(), 1_000_000):
+            # Keep the first hit of each protein as Diamond gives the best one first.
+            for key, subject in zip(hits["ProteinID"], hits["annotation"]):
+                if missing_key_to_subject[key] is None:
+                    missing_key_to_subject[key] = subject
+
+        cache_manager.store_ko_hits(ko_hit_cache, missing_key_to_subject)
+        key_to_subject.update(missing_key_to_subject)
+        missing_output.unlink()
+    missing_faa.unlink()
+
+    with gzip.open(output, "wt", compresslevel=1) as fl:
+        for protein_id, key in zip(protein_ids, protein_keys):
+            subject = key_to_subject[key]
+            if subject is not None:
+                fl.write(f"{protein_id}\t{subject}\n")
+
+
+def get_ko_to_column() -> Dict[str, int]:
+    """
+    Get the column of each KO in the contig x KO matrix.
+
+    Columns follow the order of the checkm2 default KO list.
+
+    :return: A dictionary mapping KO identifiers to their column index.
+    """
     KeggCalc = keggData.KeggCalculator()
     defaultKOs = KeggCalc.return_default_values_from_category("KO_Genes")
+    return {ko: i for i, ko in enumerate(defaultKOs)}
 
-    diamon_results_df = diamon_results_df.loc[
-        diamon_results_df["Kegg_annotation"].isin(defaultKOs.keys())
-    ]
-    diamon_results_df["contig"] = (
-        diamon_results_df["ProteinID"].str.split("_", n=-1).str[:-1].str.join("_")
-    )
 
-    contig_to_kegg_counter = (
-        diamon_results_df.groupby("contig")
-        .agg({"Kegg_annotation": Counter})
-        .reset_index()
+def iter_diamond_hit_chunks(
+    diamond_result_file: str, chunk_size: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Iterate over the hits of a Diamond result file in chunks, reading only the query and subject IDs.
+
+    :param diamond_result_file: Path to the Diamond result file.
+    :param chunk_size: Number of hits per chunk.
+    :return: An iterator of dataframes with the "ProteinID" and "annotation" columns.
+    """
+    yield from pd.read_csv(
+        diamond_result_file,
+        sep="\t",
+        usecols=[0, 1],
+        names=["ProteinID", "annotation"],
+        dtype=str,
+        chunksize=chunk_size,
     )
 
-    contig_to_kegg_counter = dict(
-        zip(contig_to_kegg_counter["contig"], contig_to_kegg_counter["Kegg_annotation"])
+
+def get_contig_to_kegg_id(
+    diamond_result_file: str,
+    contig_to_index: Dict[str, int],
+    chunk_size: int = 1_000_000,
+) -> sparse.csr_matrix:
+    """
+    Get the contig x KO count matrix from a Diamond result file.
+
+    Rows are indexed by contig index and columns follow the order of the checkm2 default KO list.
+    Hits on KOs that are not used by checkm2 are ignored.
+    The file is read in chunks of hits whose counts are added to the matrix,
+    so that memory use does not depend on the number of hits.
+
+    :param diamond_result_file: Path to the Diamond result file.
+    :param contig_to_index: A dictionary mapping contig names to their index.
+    :param chunk_size: Number of hits read at once.
+    :raises ValueError: If contigs of the Diamond result file are not in the contig index.
+    :return: A sparse (n_contigs, n_KO) matrix counting the KO annotations of each contig.
+    """
+    ko_to_column = get_ko_to_column()
+    shape = (len(contig_to_index), len(ko_to_column))
+
+    contig_ko_matrix = sparse.csr_matrix(shape, dtype=np.int64)
+    unknown_contigs = set()
+    hit_count = 0
+
+    for hits in iter_diamond_hit_chunks(diamond_result_file, chunk_size):
+        hit_count += len(hits)
+
+        ko_codes = hits["annotation"].str.partition("~")[2].map(ko_to_column)
+        is_kept_ko = ko_codes.notna()
+        ko_codes = ko_codes.loc[is_kept_ko]
+        if ko_codes.empty:
+            continue
+
+        contigs = hits.loc[is_kept_ko, "ProteinID"].str.rpartition("_")[0]
+        contig_codes = contigs.map(contig_to_index)
+
+        is_unknown_contig = contig_codes.isna()
+        if is_unknown_contig.any():
+            unknown_contigs |= set(contigs.loc[is_unknown_contig])
+            continue
+
+        contig_ko_matrix += sparse.csr_matrix(
+            (
+                np.ones(len(ko_codes), dtype=np.int64),
+                (
+                    contig_codes.to_numpy(dtype=np.int64),
+                    ko_codes.to_numpy(dtype=np.int64),
+                ),
+            ),
+            shape=shape,
+        )
+
+    if unknown_contigs:
+        raise ValueError(
+            f"{len(unknown_contigs)} contigs found in file '{diamond_result_file}' "
+            "were not found in the input bins."
+        )
+
+    logging.debug(
+        f"{hit_count} Diamond hits parsed into {contig_ko_matrix.nnz} contig KO counts."
     )
 
-    return contig_to_kegg_counter
+    return contig_ko_matrix
@@ -1,6 +1,6 @@
 from collections import defaultdict
 import logging
-from typing import Iterable, List, Dict, Tuple, Set
+from typing import Iterable, List, Dict, Optional, Tuple, Set
 import csv
 
 from binette import contig_manager
@@ -188,47 +188,32 @@ def write_bins_fasta(
             outfl.write("\n".join(sequences) + "\n")
 
 
-def check_contig_consistency(
-    contigs_from_assembly: Iterable[str],
-    contigs_from_elsewhere: Iterable[str],
-    assembly_file: str,
-    elsewhere_file: str,
-):
-    """
-    Check the consistency of contig names between different sources.
-
-    :param contigs_from_assembly: List of contig names from the assembly file.
-    :param contigs_from_elsewhere: List of contig names from an external source.
-    :param assembly_file: Path to the assembly file.
-    :param elsewhere_file: Path to the file from an external source.
-    :raises AssertionError: If inconsistencies in contig names are found.
-    """
-    logging.debug("check_contig_consistency.")
-    are_contigs_consistent = len(
-        set(contigs_from_elsewhere) | set(contigs_from_assembly)
-    ) <= len(set(contigs_from_assembly))
-
-    issue_countigs = len(set(contigs_from_elsewhere) - set(contigs_from_assembly))
-
-    message = (
-        f"{issue_countigs} contigs found in file '{elsewhere_file}' "
-        f"were not found in assembly_file '{assembly_file}'"
-    )
-    assert are_contigs_consistent, message
-
-
-def check_resume_file(faa_file: Path, diamond_result_file: Path) -> None:
+def check_resume_file(
+    faa_file: Path,
+    diamond_result_file: Path,
+    diamond_shard_dir: Optional[Path] = None,
+) -> None:
     """
     Check the existence of files required for resuming the process.
 
     :param faa_file: Path to the protein file.
     :param diamond_result_file: Path to the Diamond result file.
+    :param diamond_shard_dir: Directory of the Diamond shards when Diamond is run in shards.
+        Diamond can then be resumed from its finished shards when the result file does not exist.
     :raises FileNotFoundError: If the required files don't exist for resuming.
     """
 
     if faa_file.exists() and diamond_result_file.exists():
         return
 
+    if (
+        faa_file.exists()
+        and diamond_shard_dir is not None
+        and diamond_shard_dir.exists()
+    ):
+        logging.info(f"Resuming Diamond from the shards found in {diamond_shard_dir}.")
+        return
+
     if not faa_file.exists():
         error_msg = (
             f"Protein file '{faa_file}' does not exist. Resuming is not possible."
@@ -21,11 +21,14 @@ from binette import (
     diamond,
     bin_quality,
     bin_manager,
+    cache_manager,
     io_manager as io,
 )
 from typing import List, Dict, Optional, Set, Tuple, Union, Sequence, Any
 from pathlib import Path
 import pyfastx
+import numpy as np
+from scipy import sparse
 
 
 def init_logging(verbose, debug):
@@ -191,6 +194,146 @@ def parse_arguments(args):
         "--low_mem", help="Use low mem mode when running diamond", action="store_true"
     )
 
+    other_group.add_argument(
+        "--diamond_shards",
+        default=1,
+        type=int,
+        help="Split the proteins in this number of shards of balanced size that are aligned "
+        "by separate DIAMOND runs. Finished shards are not run again when resuming.",
+    )
+
+    other_group.add_argument(
+        "--diamond_jobs",
+        default=1,
+        type=int,
+        help="Maximum number of DIAMOND shards, or batches with --diamond_pipeline, run at the same time. "
+        "Threads are divided between them.",
+    )
+
+    other_group.add_argument(
+        "--diamond_pipeline",
+        action="store_true",
+        help="Run DIAMOND on batches of predicted proteins while the genes of the next contigs are predicted, "
+        "up to --diamond_jobs batches at a time. Not used when proteins are given with --proteins.",
+    )
+
+    other_group.add_argument(
+        "--prediction_window",
+        type=int,
+        help="Maximum number of gene prediction tasks, of at least 1 Mbp of contigs each, "
+        "predicted ahead of the writing of their proteins. Bounds the memory held by predicted genes. "
+        "By default, four tasks per thread.",
+    )
+
+    other_group.add_argument(
+        "--membership_engine",
+        choices=bin_manager.MEMBERSHIP_ENGINES,
+        default="set",
+        help="Data structure used to store bin contigs during intermediate bin creation. "
+        "'array' stores contig indices in sorted int32 arrays, which uses less memory on large assemblies.",
+    )
+
+    other_group.add_argument(
+        "--selection_engine",
+        choices=bin_manager.SELECTION_ENGINES,
+        default="greedy",
+        help="Method used to select the final bins. 'greedy' picks bins by decreasing score. "
+        "'optimized' maximizes the total score of the selected bins in each group of overlapping bins, "
+        "starting from the greedy selection.",
+    )
+
+    other_group.add_argument(
+        "--selection_time_limit",
+        default=10,
+        type=float,
+        help="Maximum time in seconds spent on each group of overlapping bins with '--selection_engine optimized'.",
+    )
+
+    other_group.add_argument(
+        "--prescreen_min_cds",
+        default=0,
+        type=int,
+        help="Intermediate bins with fewer CDS are skipped without assessing their quality. "
+        "The pre-screen is disabled with 0.",
+    )
+
+    other_group.add_argument(
+        "--prescreen_min_kos",
+        default=0,
+        type=int,
+        help="Intermediate bins with fewer distinct KEGG orthologs are skipped without assessing their quality. "
+        "The pre-screen is disabled with 0.",
+    )
+
+    other_group.add_argument(
+        "--rounds",
+        default=1,
+        type=int,
+        help="Number of refinement rounds. In each additional round, the best bins of the previous rounds "
+        "are combined again and only the bins never seen before are assessed.",
+    )
+
+    other_group.add_argument(
+        "--round_alternatives",
+        default=2,
+        type=int,
+        help="Number of best scoring bins overlapping each selected bin that are combined "
+        "with the selected bins in additional refinement rounds.",
+    )
+
+    other_group.add_argument(
+        "--stream_bins",
+        action="store_true",
+        help="Assess intermediate bins in chunks as they are created and only keep a compact record "
+        "of the bins that pass --min_completeness until the final selection. "
+        "Lowers peak memory when many intermediate bins are created. "
+        "The report of all bins written in debug mode is not available in this mode.",
+    )
+
+    other_group.add_argument(
+        "--quality_workers",
+        default=0,
+        type=int,
+        help="Number of worker processes assessing bin quality. "
+        "Each worker loads its own CheckM2 models, so memory use grows with the number of workers. "
+        "With 0, bins are assessed in the main process using --threads.",
+    )
+
+    other_group.add_argument(
+        "--quality_cache",
+        type=Path,
+        help="SQLite file caching the completeness and contamination of bins. "
+        "Bins already assessed on the same assembly are not assessed again. "
+        "Share it between runs on the same assembly, for example with different input bin sets. "
+        "Bin qualities are not cached when not provided.",
+    )
+
+    other_group.add_argument(
+        "--quality_cache_size",
+        default=1000000,
+        type=int,
+        help="Maximum number of bins kept in the quality cache. "
+        "The least recently used bins are evicted beyond this number.",
+    )
+
+    other_group.add_argument(
+        "--ko_hit_cache",
+        type=Path,
+        help="SQLite file caching the DIAMOND hit of proteins by sequence. "
+        "Only proteins missing from the cache are aligned. "
+        "Share it between runs on similar assemblies to avoid aligning the same proteins again. "
+        "Diamond hits are not cached when not provided. "
+        "The cache is not used with --diamond_pipeline.",
+    )
+
+    other_group.add_argument(
+        "--ko_hit_cache_size",
+        default=100000000,
+        type=int,
+        help="Maximum number of proteins kept in the KO hit cache. "
+        "The least recently used proteins are evicted beyond this number.",
+    )
+
     other_group.add_argument(
         "-v", "--verbose", help="increase output verbosity", action="store_true"
     )
@@ -207,6 +350,35 @@ def parse_arguments(args):
     other_group.add_argument("--version", action="version", version=binette.__version__)
 
     args = parser.parse_args(args)
+
+    if args.rounds < 1:
+        parser.error("Error: The number of rounds must be at least 1.")
+
+    if args.prescreen_min_cds < 0 or args.prescreen_min_kos < 0:
+        parser.error("Error: The pre-screen bounds cannot be negative.")
+
+    if args.prediction_window is not None and args.prediction_window < 1:
+        parser.error("Error: The gene prediction window must be at least 1.")
+
+    if args.quality_workers < 0:
+        parser.error("Error: The number of quality workers cannot be negative.")
+
+    if args.diamond_shards < 1 or args.diamond_jobs < 1:
+        parser.error("Error: The number of DIAMOND shards and jobs must be at least 1.")
+
+    if args.diamond_pipeline and args.diamond_shards > 1:
+        parser.error(
+            "Error: --diamond_pipeline and --diamond_shards cannot be used together."
+        )
+
+    if args.stream_bins and args.rounds > 1:
+        parser.error("Error: Refinement rounds are not available with --stream_bins.")
+
+    if args.stream_bins and args.selection_engine != "greedy":
+        parser.error(
+            "Error: Only the greedy selection engine is available with --stream_bins."
+        )
+
     return args
 
 
@@ -282,13 +454,20 @@ def manage_protein_alignement(
     contigs_fasta: Path,
     contig_to_length: Dict[str, int],
     contigs_in_bins: Set[str],
+    contig_to_index: Dict[str, int],
     diamond_result_file: Path,
     checkm2_db: Optional[Path],
     threads: int,
     use_existing_protein_file: bool,
     resume_diamond: bool,
     low_mem: bool,
-) -> Tuple[Dict[str, int], Dict[str, List[str]]]:
+    diamond_shards: int = 1,
+    diamond_jobs: int = 1,
+    diamond_pipeline: bool = False,
+    ko_hit_cache_file: Optional[Path] = None,
+    ko_hit_cache_size: int = 100_000_000,
+    prediction_window: Optional[int] = None,
+) -> Tuple[sparse.csr_matrix, Dict[str, np.ndarray]]:
     """
     Predicts or reuses proteins prediction and runs diamond on them.
 
@@ -296,35 +475,26 @@ def manage_protein_alignement(
     :param contigs_fasta: The path to the contigs FASTA file.
     :param contig_to_length: Dictionary mapping contig names to their lengths.
     :param contigs_in_bins: Dictionary mapping bin names to lists of contigs.
+    :param contig_to_index: Dictionary mapping contig names to their index.
     :param diamond_result_file: The path to the diamond result file.
     :param checkm2_db: The path to the CheckM2 database.
     :param threads: Number of threads for parallel processing.
     :param use_existing_protein_file: Boolean indicating whether to use an existing protein file.
     :param resume_diamond: Boolean indicating whether to resume diamond alignement.
     :param low_mem: Boolean indicating whether to use low memory mode.
-
-    :return: A tuple containing dictionaries - contig_to_kegg_counter and contig_to_genes.
+    :param diamond_shards: Number of shards the proteins are split in to run diamond (see diamond.run_sharded).
+    :param diamond_jobs: Maximum number of diamond shards or batches run at the same time.
+    :param diamond_pipeline: Boolean indicating whether to run diamond on batches of proteins
+        while genes are predicted (see diamond.pipelined_run).
+    :param ko_hit_cache_file: Optional path to the SQLite cache of the diamond hits of proteins.
+        Only the proteins missing from the cache are aligned (see diamond.run_with_ko_hit_cache).
+    :param ko_hit_cache_size: Maximum number of proteins kept in the KO hit cache.
+    :param prediction_window: Maximum number of gene prediction tasks in flight (see cds.predict).
+
+    :return: A tuple containing the sparse contig x KO count matrix and the contig CDS metadata arrays
+        (see cds.make_contig_cds_metadata).
     """
 
-    # Predict or reuse proteins prediction and run diamond on them
-    if use_existing_protein_file:
-        logging.info(f"Parsing faa file: {faa_file}.")
-        contig_to_genes = cds.parse_faa_file(faa_file.as_posix())
-        io.check_contig_consistency(
-            contig_to_length,
-            contig_to_genes,
-            contigs_fasta.as_posix(),
-            faa_file.as_posix(),
-        )
-
-    else:
-        contigs_iterator = (
-            (name, seq)
-            for name, seq in pyfastx.Fastx(contigs_fasta.as_posix())
-            if name in contigs_in_bins
-        )
-        contig_to_genes = cds.predict(contigs_iterator, faa_file.as_posix(), threads)
-
     if not resume_diamond:
         if checkm2_db is None:
             # get checkm2 db stored in checkm2 install
@@ -334,34 +504,102 @@ def manage_protein_alignement(
         else:
             raise FileNotFoundError(checkm2_db)
 
-        diamond_log = (
-            diamond_result_file.parents[0]
-            / f"{diamond_result_file.stem.split('.')[0]}.log"
-        )
+    # Predict or reuse proteins prediction and run diamond on them
+    pipelined_diamond = (
+        diamond_pipeline and not use_existing_protein_file and not resume_diamond
+    )
+    if use_existing_protein_file:
+        logging.info(f"Parsing faa file: {faa_file}.")
+        contig_cds_metadata = cds.parse_faa_file(faa_file.as_posix(), contig_to_index)
 
-        diamond.run(
-            faa_file.as_posix(),
-            diamond_result_file.as_posix(),
-            diamond_db_path,
-            diamond_log.as_posix(),
-            threads,
-            low_mem=low_mem,
+    else:
+        # Contigs are predicted longest first, which needs random access to the contig sequences.
+        # The index is stored next to the predicted protein file, in the temporary directory.
+        index_file = faa_file.parent / f"{contigs_fasta.name}.fxi"
+        fasta = contig_manager.parse_fasta_file(
+            contigs_fasta.as_posix(), index_file=index_file.as_posix()
+        )
+        contigs_iterator = cds.iter_contigs_longest_first(
+            fasta, {contig: contig_to_length[contig] for contig in contigs_in_bins}
         )
 
-    logging.info("Parsing diamond results.")
-    contig_to_kegg_counter = diamond.get_contig_to_kegg_id(
-        diamond_result_file.as_posix()
-    )
+        if pipelined_diamond:
+            # Batches of predicted proteins are aligned while the next contigs are predicted.
+            with diamond.pipelined_run(
+                diamond_result_file,
+                diamond_db_path,
+                diamond_result_file.parent / "diamond_batches",
+                jobs=diamond_jobs,
+                threads=threads,
+                low_mem=low_mem,
+            ) as align_proteins:
+                contig_cds_metadata = cds.predict(
+                    contigs_iterator,
+                    faa_file.as_posix(),
+                    contig_to_index,
+                    threads,
+                    window_size=prediction_window,
+                    on_proteins=align_proteins,
+                )
+        else:
+            contig_cds_metadata = cds.predict(
+                contigs_iterator,
+                faa_file.as_posix(),
+                contig_to_index,
+                threads,
+                window_size=prediction_window,
+            )
+
+    if not resume_diamond and not pipelined_diamond:
+
+        def align(query_faa_file: Path, query_result_file: Path):
+            if diamond_shards > 1:
+                diamond.run_sharded(
+                    query_faa_file,
+                    query_result_file,
+                    diamond_db_path,
+                    query_result_file.parent / "diamond_shards",
+                    diamond_shards,
+                    jobs=diamond_jobs,
+                    threads=threads,
+                    low_mem=low_mem,
+                )
+            else:
+                diamond_log = (
+                    query_result_file.parents[0]
+                    / f"{query_result_file.stem.split('.')[0]}.log"
+                )
+                diamond.run(
+                    query_faa_file.as_posix(),
+                    query_result_file.as_posix(),
+                    diamond_db_path,
+                    diamond_log.as_posix(),
+                    threads,
+                    low_mem=low_mem,
+                )
+
+        if ko_hit_cache_file is None:
+            align(faa_file, diamond_result_file)
+        else:
+            logging.info(f"Using KO hit cache: {ko_hit_cache_file}")
+            ko_hit_cache = cache_manager.init_ko_hit_cache(
+                ko_hit_cache_file,
+                cache_manager.get_ko_hit_context(diamond_db_path),
+                ko_hit_cache_size,
+            )
+            try:
+                diamond.run_with_ko_hit_cache(
+                    faa_file, diamond_result_file, ko_hit_cache, align
+                )
+            finally:
+                ko_hit_cache["connection"].close()
 
-    # Check contigs from diamond vs input assembly consistency
-    io.check_contig_consistency(
-        contig_to_length,
-        contig_to_kegg_counter,
-        contigs_fasta.as_posix(),
-        diamond_result_file.as_posix(),
+    logging.info("Parsing diamond results.")
+    contig_ko_matrix = diamond.get_contig_to_kegg_id(
+        diamond_result_file.as_posix(), contig_to_index
     )
 
-    return contig_to_kegg_counter, contig_to_genes
+    return contig_ko_matrix, contig_cds_metadata
 
 
 def select_bins_and_write_them(
@@ -373,6 +611,9 @@ def select_bins_and_write_them(
     outdir: Path,
     temporary_dir: Path,
     debug: bool,
+    selection_engine: str = "greedy",
+    selection_time_limit: float = 10,
+    threads: int = 1,
 ) -> List[bin_manager.Bin]:
     """
     Selects and writes bins based on specific criteria.
@@ -385,11 +626,13 @@ def select_bins_and_write_them(
     :param outdir: Output directory to save final bins and reports.
     :param temporary_dir: Path to the temporary directory to store intermediate files.
     :param debug: Debug mode flag.
+    :param selection_engine: Selection engine, one of bin_manager.SELECTION_ENGINES.
+    :param selection_time_limit: Time limit per component of overlapping bins of the optimized selection.
+    :param threads: Number of threads used by the optimized selection.
     :return: Selected bins that meet the completeness threshold.
     """
 
     outdir_final_bin_set = outdir / "final_bins"
-    os.makedirs(outdir_final_bin_set, exist_ok=True)
 
     logging.info(
         f"Filtering bins: only bins with completeness >= {min_completeness} are kept"
@@ -399,10 +642,139 @@ def select_bins_and_write_them(
     }
 
     logging.info("Selecting best bins")
-    selected_bins = bin_manager.select_best_bins(all_bins_complete_enough)
+    if selection_engine == "optimized":
+        selected_bins = bin_manager.select_best_bins_optimized(
+            all_bins_complete_enough, selection_time_limit, threads
+        )
+    else:
+        selected_bins = bin_manager.select_best_bins(all_bins_complete_enough)
 
     logging.info(f"Bin Selection: {len(selected_bins)} selected bins")
 
+    write_selected_bins(
+        selected_bins,
+        contigs_fasta,
+        final_bin_report,
+        index_to_contig,
+        outdir_final_bin_set,
+        temporary_dir,
+    )
+
+    if debug:
+        all_bin_compo_file = outdir / "all_bins_quality_reports.tsv"
+
+        logging.info(f"Writing all bins in {all_bin_compo_file}")
+
+        io.write_bin_info(all_bins, all_bin_compo_file, add_contigs=True)
+
+        with open(os.path.join(outdir, "index_to_contig.tsv"), "w") as flout:
+            flout.write("\n".join((f"{i}\t{c}" for i, c in index_to_contig.items())))
+
+    return selected_bins
+
+
+def run_refinement_rounds(
+    all_bins: Set[bin_manager.Bin],
+    contig_info: Dict,
+    contamination_weight: float,
+    min_completeness: float,
+    rounds: int,
+    round_alternatives: int,
+    threads: int,
+    quality_cache: Optional[Dict[str, Any]],
+    quality_models: Optional[Dict[str, Any]] = None,
+    prescreen_bounds: Optional[Dict[str, int]] = None,
+    quality_checkpoint: Optional[Dict[str, Any]] = None,
+    quality_workers: Optional[Dict[str, Any]] = None,
+) -> Set[bin_manager.Bin]:
+    """
+    Runs additional refinement rounds on assessed bins.
+
+    In each round, the best bins complete enough to be selected are combined again
+    (see bin_manager.select_round_input_bins). Only bins never seen in previous rounds are created and assessed.
+
+    :param all_bins: Set of input and intermediate bins assessed in the first round.
+    :param contig_info: Dictionary containing the contig feature matrices and the contig lengths.
+    :param contamination_weight: Weight for contamination assessment.
+    :param min_completeness: Minimum completeness threshold for bin selection.
+    :param rounds: Total number of rounds, including the first one.
+    :param round_alternatives: Number of best scoring bins overlapping each selected bin combined in a round.
+    :param threads: Number of threads to use.
+    :param quality_cache: Optional bin quality cache.
+    :param quality_models: Checkm2 models loaded with bin_quality.load_quality_models.
+    :param prescreen_bounds: Keyword arguments of bin_quality.iter_prescreened_bins
+        used to skip new bins too small to be assessed.
+    :param quality_checkpoint: Optional quality checkpoint.
+    :param quality_workers: Optional quality workers started with bin_quality.start_quality_workers.
+    :return: The set of all bins assessed over all rounds.
+    """
+    all_bins = set(all_bins)
+    seen_fingerprints = {b.fingerprint for b in all_bins}
+
+    for round_number in range(2, rounds + 1):
+        round_input_bins = bin_manager.select_round_input_bins(
+            {b for b in all_bins if b.is_complete_enough(min_completeness)},
+            round_alternatives,
+        )
+        logging.info(
+            f"Refinement round {round_number}/{rounds}: combining {len(round_input_bins)} bins."
+        )
+
+        new_bins = bin_manager.create_intermediate_bins(
+            round_input_bins,
+            contig_info["contig_to_length"],
+            threads,
+            excluded_fingerprints=seen_fingerprints,
+        )
+        if not new_bins:
+            logging.info(f"No new bins created in round {round_number}, stopping.")
+            break
+
+        # Skipped bins are not created again in the next rounds.
+        seen_fingerprints |= {b.fingerprint for b in new_bins}
+        new_bins = set(
+            bin_quality.iter_prescreened_bins(
+                new_bins, contig_info, **(prescreen_bounds or {})
+            )
+        )
+
+        logging.info(f"Assess quality for {len(new_bins)} new bins.")
+        bin_quality.add_bin_metrics(
+            new_bins,
+            contig_info,
+            contamination_weight,
+            threads,
+            quality_cache,
+            quality_models=quality_models,
+            quality_checkpoint=quality_checkpoint,
+            quality_workers=quality_workers,
+        )
+
+        all_bins |= new_bins
+
+    return all_bins
+
+
+def write_selected_bins(
+    selected_bins: List[bin_manager.Bin],
+    contigs_fasta: Path,
+    final_bin_report: Path,
+    index_to_contig: dict,
+    outdir_final_bin_set: Path,
+    temporary_dir: Path,
+):
+    """
+    Writes the report and the fasta files of the selected bins.
+
+    :param selected_bins: Selected Bin objects.
+    :param contigs_fasta: Path to the contigs FASTA file.
+    :param final_bin_report: Path to write the final bin report.
+    :param index_to_contig: Dictionary mapping indices to contig names.
+    :param outdir_final_bin_set: Output directory of the selected bin fasta files.
+    :param temporary_dir: Path to the temporary directory to store intermediate files.
+    """
+    os.makedirs(outdir_final_bin_set, exist_ok=True)
+
     logging.info(f"Writing selected bins in {final_bin_report}")
 
     for b in selected_bins:
@@ -414,15 +786,83 @@ def select_bins_and_write_them(
         selected_bins, contigs_fasta, outdir_final_bin_set, temporary_dir
     )
 
-    if debug:
-        all_bin_compo_file = outdir / "all_bins_quality_reports.tsv"
 
-        logging.info(f"Writing all bins in {all_bin_compo_file}")
+def stream_bins_and_select_them(
+    original_bins: Set[bin_manager.Bin],
+    contig_info: Dict,
+    contamination_weight: float,
+    min_completeness: float,
+    threads: int,
+    quality_cache: Optional[Dict[str, Any]],
+    quality_models: Optional[Dict[str, Any]] = None,
+    prescreen_bounds: Optional[Dict[str, int]] = None,
+    quality_checkpoint: Optional[Dict[str, Any]] = None,
+    quality_workers: Optional[Dict[str, Any]] = None,
+) -> List[bin_manager.Bin]:
+    """
+    Creates and assesses intermediate bins chunk by chunk and selects the best bins.
 
-        io.write_bin_info(all_bins, all_bin_compo_file, add_contigs=True)
+    Only a compact record of the bins complete enough to be selected is kept,
+    and contigs are recomputed at selection time.
 
-        with open(os.path.join(outdir, "index_to_contig.tsv"), "w") as flout:
-            flout.write("\n".join((f"{i}\t{c}" for i, c in index_to_contig.items())))
+    :param original_bins: Set of input bins with their metrics.
+    :param contig_info: Dictionary containing the contig feature matrices and the contig lengths.
+    :param contamination_weight: Weight for contamination assessment.
+    :param min_completeness: Minimum completeness threshold for bin selection.
+    :param threads: Number of threads to use.
+    :param quality_cache: Optional bin quality cache.
+    :param quality_models: Checkm2 models loaded with bin_quality.load_quality_models.
+    :param prescreen_bounds: Keyword arguments of bin_quality.iter_prescreened_bins
+        used to skip intermediate bins too small to be assessed.
+    :param quality_checkpoint: Optional quality checkpoint.
+    :param quality_workers: Optional quality workers started with bin_quality.start_quality_workers.
+    :return: Selected bins that meet the completeness threshold.
+    """
+    logging.info(
+        f"Filtering bins: only bins with completeness >= {min_completeness} are kept"
+    )
+    bin_records = [
+        bin_manager.make_bin_record(b)
+        for b in original_bins
+        if b.is_complete_enough(min_completeness)
+    ]
+
+    new_bins = bin_quality.iter_prescreened_bins(
+        bin_manager.iter_intermediate_bins(
+            original_bins, contig_info["contig_to_length"], threads
+        ),
+        contig_info,
+        **(prescreen_bounds or {}),
+    )
+    new_bin_count = 0
+    for chunk_bins in bin_quality.iter_bin_metrics_by_chunk(
+        new_bins,
+        contig_info,
+        contamination_weight,
+        threads,
+        quality_cache,
+        quality_models=quality_models,
+        quality_checkpoint=quality_checkpoint,
+        quality_workers=quality_workers,
+    ):
+        new_bin_count += len(chunk_bins)
+        bin_records += [
+            bin_manager.make_bin_record(b)
+            for b in chunk_bins
+            if b.is_complete_enough(min_completeness)
+        ]
+
+    logging.info(
+        f"{new_bin_count} new bins created and assessed from {len(original_bins)} input bins."
+    )
+    logging.info(f"{len(bin_records)} bins are complete enough to be selected.")
+
+    logging.info("Selecting best bins")
+    selected_bins = bin_manager.select_best_bin_records(
+        bin_records, {b.id: b for b in original_bins}
+    )
+
+    logging.info(f"Bin Selection: {len(selected_bins)} selected bins")
 
     return selected_bins
 
@@ -501,7 +941,13 @@ def main():
     original_bin_report_dir: Path = args.outdir / "input_bins_quality_reports"
 
     if args.resume:
-        io.check_resume_file(faa_file, diamond_result_file)
+        io.check_resume_file(
+            faa_file,
+            diamond_result_file,
+            diamond_shard_dir=(
+                out_tmp_dir / "diamond_shards" if args.diamond_shards > 1 else None
+            ),
+        )
         use_existing_protein_file = True
 
     original_bins, contigs_in_bins, contig_to_length = parse_input_files(
@@ -511,6 +957,9 @@ def main():
         fasta_extensions=set(args.fasta_extensions),
     )
 
+    # Use contig index instead of contig name to save memory
+    contig_to_index, index_to_contig = contig_manager.make_contig_index(contigs_in_bins)
+
     if args.proteins and not args.resume:
         logging.info(f"Using the provided protein sequences file: {args.proteins}")
         use_existing_protein_file = True
@@ -521,75 +970,193 @@ def main():
             filtered_faa_file=faa_file,
         )
 
-    contig_to_kegg_counter, contig_to_genes = manage_protein_alignement(
+    contig_ko_matrix, contig_cds_metadata = manage_protein_alignement(
         faa_file=faa_file,
         contigs_fasta=args.contigs,
         contig_to_length=contig_to_length,
         contigs_in_bins=contigs_in_bins,
+        contig_to_index=contig_to_index,
         diamond_result_file=diamond_result_file,
         checkm2_db=args.checkm2_db,
         threads=args.threads,
         use_existing_protein_file=use_existing_protein_file,
-        resume_diamond=args.resume,
+        resume_diamond=args.resume and diamond_result_file.exists(),
         low_mem=args.low_mem,
+        diamond_shards=args.diamond_shards,
+        diamond_jobs=args.diamond_jobs,
+        diamond_pipeline=args.diamond_pipeline,
+        ko_hit_cache_file=args.ko_hit_cache,
+        ko_hit_cache_size=args.ko_hit_cache_size,
+        prediction_window=args.prediction_window,
     )
 
-    # Use contig index instead of contig name to save memory
-    contig_to_index, index_to_contig = contig_manager.make_contig_index(contigs_in_bins)
-
-    contig_to_kegg_counter = contig_manager.apply_contig_index(
-        contig_to_index, contig_to_kegg_counter
-    )
-    contig_to_genes = contig_manager.apply_contig_index(
-        contig_to_index, contig_to_genes
-    )
     contig_to_length = contig_manager.apply_contig_index(
         contig_to_index, contig_to_length
     )
 
-    bin_manager.rename_bin_contigs(original_bins, contig_to_index)
-
-    # Extract cds metadata ##
-    logging.info("Compute cds metadata.")
-    contig_metadat = cds.get_contig_cds_metadata(contig_to_genes, args.threads)
+    bin_manager.rename_bin_contigs(
+        original_bins, contig_to_index, args.membership_engine
+    )
 
-    contig_metadat["contig_to_kegg_counter"] = contig_to_kegg_counter
+    logging.info("Build contig feature matrices.")
+    contig_metadat = bin_quality.get_contig_feature_matrices(
+        contig_cds_metadata, contig_ko_matrix
+    )
     contig_metadat["contig_to_length"] = contig_to_length
 
-    logging.info("Add size and assess quality of input bins")
-    bin_quality.add_bin_metrics(
-        original_bins, contig_metadat, args.contamination_weight, args.threads
-    )
+    quality_cache = None
+    if args.quality_cache:
+        logging.info(f"Using bin quality cache: {args.quality_cache}")
+        # The cache is shared between runs, so the assembly is identified by the content of its files.
+        assembly_fingerprint = cache_manager.get_assembly_fingerprint(
+            args.contigs, args.proteins, args.checkm2_db
+        )
+        quality_cache = cache_manager.init_quality_cache(
+            args.quality_cache, assembly_fingerprint, args.quality_cache_size
+        )
 
-    logging.info(
-        f"Writting original input bin metrics to directory: {original_bin_report_dir}"
+    prescreen_bounds = {
+        "min_cds_count": args.prescreen_min_cds,
+        "min_ko_count": args.prescreen_min_kos,
+    }
+
+    # Qualities are checkpointed chunk by chunk so that a resumed run does not assess them again.
+    checkpoint_signature = cache_manager.get_quality_checkpoint_signature(
+        cache_manager.get_assembly_stamp(args.contigs, args.proteins, args.checkm2_db),
+        original_bins,
+        {
+            "contamination_weight": args.contamination_weight,
+            "min_completeness": args.min_completeness,
+            "rounds": args.rounds,
+            "round_alternatives": args.round_alternatives,
+            "stream_bins": args.stream_bins,
+            **prescreen_bounds,
+        },
+    )
+    quality_checkpoint = cache_manager.init_quality_checkpoint(
+        out_tmp_dir / "bin_quality_checkpoint.tsv", checkpoint_signature, args.resume
     )
-    io.write_original_bin_metrics(original_bins, original_bin_report_dir)
 
-    logging.info("Create intermediate bins:")
-    new_bins = bin_manager.create_intermediate_bins(original_bins)
+    # With quality workers, bins are assessed by worker processes started once for the run,
+    # each loading its own CheckM2 models.
+    quality_models = None
+    quality_workers = None
+    if args.quality_workers > 0:
+        quality_workers = bin_quality.start_quality_workers(
+            contig_metadat["contig_metadata_matrix"],
+            contig_metadat["contig_ko_matrix"],
+            args.quality_workers,
+        )
+    else:
+        logging.info("Load CheckM2 models.")
+        quality_models = bin_quality.load_quality_models(args.threads)
+
+    try:
+        logging.info("Add size and assess quality of input bins")
+        bin_quality.add_bin_metrics(
+            original_bins,
+            contig_metadat,
+            args.contamination_weight,
+            args.threads,
+            quality_cache,
+            quality_models=quality_models,
+            quality_checkpoint=quality_checkpoint,
+            quality_workers=quality_workers,
+        )
 
-    logging.info(f"Assess quality for {len(new_bins)} intermediate bins.")
-    bin_quality.add_bin_metrics(
-        new_bins,
-        contig_metadat,
-        args.contamination_weight,
-        args.threads,
-    )
+        logging.info(
+            f"Writting original input bin metrics to directory: {original_bin_report_dir}"
+        )
+        io.write_original_bin_metrics(original_bins, original_bin_report_dir)
+
+        if args.stream_bins:
+            logging.info("Create and assess intermediate bins by chunk:")
+            selected_bins = stream_bins_and_select_them(
+                original_bins,
+                contig_metadat,
+                args.contamination_weight,
+                args.min_completeness,
+                args.threads,
+                quality_cache,
+                quality_models,
+                prescreen_bounds,
+                quality_checkpoint,
+                quality_workers,
+            )
 
-    logging.info("Dereplicating input bins and new bins")
-    all_bins = original_bins | new_bins
+        else:
+            logging.info("Create intermediate bins:")
+            new_bins = bin_manager.create_intermediate_bins(
+                original_bins, contig_to_length, args.threads
+            )
+            new_bins = set(
+                bin_quality.iter_prescreened_bins(
+                    new_bins, contig_metadat, **prescreen_bounds
+                )
+            )
 
-    selected_bins = select_bins_and_write_them(
-        all_bins=all_bins,
-        contigs_fasta=args.contigs,
-        final_bin_report=final_bin_report,
-        min_completeness=args.min_completeness,
-        index_to_contig=index_to_contig,
-        outdir=args.outdir,
-        temporary_dir=out_tmp_dir,
-        debug=args.debug,
-    )
+            logging.info(f"Assess quality for {len(new_bins)} intermediate bins.")
+            bin_quality.add_bin_metrics(
+                new_bins,
+                contig_metadat,
+                args.contamination_weight,
+                args.threads,
+                quality_cache,
+                quality_models=quality_models,
+                quality_checkpoint=quality_checkpoint,
+                quality_workers=quality_workers,
+            )
+
+            logging.info("Dereplicating input bins and new bins")
+            all_bins = original_bins | new_bins
+
+            if args.rounds > 1:
+                all_bins = run_refinement_rounds(
+                    all_bins,
+                    contig_metadat,
+                    args.contamination_weight,
+                    args.min_completeness,
+                    args.rounds,
+                    args.round_alternatives,
+                    args.threads,
+                    quality_cache,
+                    quality_models,
+                    prescreen_bounds,
+                    quality_checkpoint,
+                    quality_workers,
+                )
+    finally:
+        # Workers and their shared memory are released even when the assessment fails.
+        if quality_cache is not None:
+            quality_cache["connection"].close()
+        quality_checkpoint["file"].close()
+        if quality_workers is not None:
+            bin_quality.stop_quality_workers(quality_workers)
+
+    if args.stream_bins:
+        write_selected_bins(
+            selected_bins,
+            args.contigs,
+            final_bin_report,
+            index_to_contig,
+            args.outdir / "final_bins",
+            out_tmp_dir,
+        )
+
+    else:
+        selected_bins = select_bins_and_write_them(
+            all_bins=all_bins,
+            contigs_fasta=args.contigs,
+            final_bin_report=final_bin_report,
+            min_completeness=args.min_completeness,
+            index_to_contig=index_to_contig,
+            outdir=args.outdir,
+            temporary_dir=out_tmp_dir,
+            debug=args.debug,
+            selection_engine=args.selection_engine,
+            selection_time_limit=args.selection_time_limit,
+            threads=args.threads,
+        )
 
     log_selected_bin_info(selected_bins, hq_min_completeness, hq_max_conta)
 
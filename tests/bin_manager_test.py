@@ -3,13 +3,17 @@ Unit tests for binette.
 
 """
 
+import itertools
+
 import pytest
 
 from binette import bin_manager
 import networkx as nx
+import numpy as np
 
 import logging
 from pathlib import Path
+from unittest.mock import patch
 
 
 def test_get_all_possible_combinations():
@@ -254,6 +258,135 @@ def test_select_best_bins_with_equality():
     assert bin_manager.select_best_bins({b1, b2, b3}) == [b1, b3]
 
 
+@pytest.mark.parametrize("as_array", [False, True])
+def test_select_best_bins_same_as_pairwise_overlap_removal(as_array):
+    rng = np.random.default_rng(42)
+    bins = set()
+    for _ in range(200):
+        contigs = rng.choice(60, size=rng.integers(1, 6), replace=False)
+        b = bin_manager.Bin(
+            contigs=contigs.astype(np.int32) if as_array else set(contigs.tolist()),
+            origin="",
+            name="",
+        )
+        b.score = int(rng.integers(0, 10))
+        b.N50 = int(rng.integers(0, 3))
+        bins.add(b)
+
+    # Reference greedy selection, removing overlapping bins by pairwise comparison.
+    remaining_bins = set(bins)
+    expected_bins = []
+    for b in sorted(bins, key=lambda x: (x.score, x.N50, -x.id), reverse=True):
+        if b in remaining_bins:
+            remaining_bins -= {b2 for b2 in remaining_bins if b.overlaps_with(b2)}
+            expected_bins.append(b)
+
+    assert bin_manager.select_best_bins(bins) == expected_bins
+
+
+def make_scored_bins(contig_sets_and_scores):
+    bins = []
+    for contigs, score in contig_sets_and_scores:
+        b = bin_manager.Bin(contigs=contigs, origin="", name="")
+        b.score = score
+        b.N50 = 100
+        bins.append(b)
+    return bins
+
+
+def test_get_bin_overlap_components():
+    b1, b2, b3, b4 = make_scored_bins([({1, 2}, 0), ({2, 3}, 0), ({3}, 0), ({4}, 0)])
+
+    components = bin_manager.get_bin_overlap_components([b1, b2, b3, b4])
+
+    assert sorted(sorted(b.id for b in c) for c in components) == [
+        [b1.id, b2.id, b3.id],
+        [b4.id],
+    ]
+
+
+def test_select_best_bins_optimized_beats_greedy():
+    # b1 blocks b2 and b3 in greedy selection
+    b1, b2, b3, b4, b5 = make_scored_bins(
+        [({1, 2}, 10), ({1}, 8), ({2}, 8), ({3}, 5), ({3, 4}, -1)]
+    )
+    bins = {b1, b2, b3, b4, b5}
+
+    assert bin_manager.select_best_bins(bins) == [b1, b4]
+    assert bin_manager.select_best_bins_optimized(bins) == [b2, b3, b4]
+
+
+def test_select_best_bins_optimized_same_as_greedy_without_gain():
+    b1, b2, b3, b4 = make_scored_bins([({1, 2}, 20), ({1}, 8), ({2}, 8), ({3, 4}, -1)])
+    bins = {b1, b2, b3, b4}
+
+    assert bin_manager.select_best_bins_optimized(bins) == [b1, b4]
+
+
+def test_select_best_bins_optimized_with_local_search(monkeypatch):
+    monkeypatch.setattr(bin_manager, "EXACT_SELECTION_MAX_BIN_COUNT", 0)
+    b1, b2, b3 = make_scored_bins([({1, 2}, 10), ({1}, 8), ({2}, 8)])
+
+    assert bin_manager.select_best_bins_optimized({b1, b2, b3}, threads=2) == [
+        b2,
+        b3,
+    ]
+
+
+def test_get_bin_conflicts():
+    assert bin_manager.get_bin_conflicts([{1, 2}, {2, 3}, {3}, {4}]) == [
+        [1],
+        [0, 2],
+        [1],
+        [],
+    ]
+
+    # the deadline is reached before conflicts are listed
+    assert bin_manager.get_bin_conflicts([{1, 2}, {2, 3}], deadline=0) is None
+
+
+def test_select_component_bins_greedy_when_conflicts_are_not_listed_in_time():
+    weights = [10, 8, 8]
+    bin_contigs = [{1, 2}, {1}, {2}]
+
+    assert bin_manager.select_component_bins(weights, bin_contigs, 10) == (
+        {1, 2},
+        False,
+    )
+
+    with patch("binette.bin_manager.get_bin_conflicts", return_value=None):
+        assert bin_manager.select_component_bins(weights, bin_contigs, 10) == (
+            {0},
+            True,
+        )
+
+
+def test_select_max_weight_by_branch_and_bound_is_exact():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        item_count = 10
+        weights = sorted(rng.integers(-2, 10, size=item_count).tolist(), reverse=True)
+        conflicts = [set() for _ in range(item_count)]
+        for i, j in rng.integers(0, item_count, size=(15, 2)).tolist():
+            if i != j:
+                conflicts[i].add(j)
+                conflicts[j].add(i)
+        conflicts = [sorted(c) for c in conflicts]
+
+        best_weight = max(
+            sum(weights[i] for i in selection)
+            for size in range(item_count + 1)
+            for selection in itertools.combinations(range(item_count), size)
+            if all(j not in selection for i in selection for j in conflicts[i])
+        )
+
+        selection, timed_out = bin_manager.select_max_weight(weights, conflicts, 10)
+
+        assert not timed_out
+        assert all(j not in selection for i in selection for j in conflicts[i])
+        assert sum(weights[i] for i in selection) == best_weight
+
+
 # The function should create intersection bins when there are overlapping contigs between bins.
 def test_intersection_bins_created():
     set1 = {
@@ -301,14 +434,16 @@ def test_renames_contigs(example_bin_set1):
 
     contig_to_index = {"c1": 1, "c2": 2, "c3": 3, "c4": 4, "c5": 5}
 
+    fingerprints = [b.fingerprint for b in bin_set]
+
     # Act
     bin_manager.rename_bin_contigs(bin_set, contig_to_index)
 
     # Assert
     assert bin_set[0].contigs == {1, 2}
-    assert bin_set[0].hash == hash(str(sorted({1, 2})))
     assert bin_set[1].contigs == {3, 4}
-    assert bin_set[1].hash == hash(str(sorted({3, 4})))
+    # fingerprints are computed from contig names so renaming does not change them
+    assert [b.fingerprint for b in bin_set] == fingerprints
 
 
 def test_get_contigs_in_bins():
@@ -356,6 +491,24 @@ def test_from_bins_to_bin_graph():
     assert set(result_graph.nodes) == {binA, bin1, bin2}
 
 
+def test_from_bins_to_bin_graph_overlap_size():
+
+    bin1 = bin_manager.Bin(contigs={"1", "2", "3"}, origin="A", name="bin1")
+    bin2 = bin_manager.Bin(contigs={"2", "3", "4"}, origin="A", name="bin2")
+    bin3 = bin_manager.Bin(contigs={"3", "5"}, origin="B", name="bin3")
+
+    contig_to_length = {"1": 10, "2": 20, "3": 30, "4": 40, "5": 50}
+
+    result_graph = bin_manager.from_bins_to_bin_graph(
+        {bin1, bin2, bin3}, contig_to_length
+    )
+
+    assert result_graph.number_of_edges() == 3
+    assert result_graph.edges[bin1, bin2] == {"overlap_contigs": 2, "overlap_bp": 50}
+    assert result_graph.edges[bin1, bin3] == {"overlap_contigs": 1, "overlap_bp": 30}
+    assert result_graph.edges[bin2, bin3] == {"overlap_contigs": 1, "overlap_bp": 30}
+
+
 @pytest.fixture
 def simple_bin_graph():
 
@@ -372,35 +525,74 @@ def simple_bin_graph():
     return G
 
 
-def test_get_intersection_bins(simple_bin_graph):
-
-    intersec_bins = bin_manager.get_intersection_bins(simple_bin_graph)
-
-    assert len(intersec_bins) == 1
-    intersec_bin = intersec_bins.pop()
+def test_get_derived_bins(simple_bin_graph):
 
-    assert intersec_bin.contigs == {"1", "2"}
+    derived_bins = bin_manager.get_derived_bins(simple_bin_graph)
 
+    assert {frozenset(b.contigs): b.origin for b in derived_bins} == {
+        frozenset({"1", "2"}): {"intersec"},
+        frozenset({"3"}): {"diff"},
+        frozenset({"4"}): {"diff"},
+        frozenset({"1", "2", "3", "4"}): {"union"},
+    }
 
-def test_get_difference_bins(simple_bin_graph):
 
-    difference_bins = bin_manager.get_difference_bins(simple_bin_graph)
+def test_get_derived_bins_merges_origins_and_skips_excluded():
+    bin1 = bin_manager.Bin(contigs={"1", "2"}, origin="A", name="bin1")
+    bin2 = bin_manager.Bin(contigs={"2"}, origin="B", name="bin2")
+    for b in [bin1, bin2]:
+        b.completeness = 100
+        b.contamination = 0
 
-    expected_bin1 = bin_manager.Bin(contigs={"3"}, origin="D", name="1")
-    expected_bin2 = bin_manager.Bin(contigs={"4"}, origin="D", name="2")
+    G = nx.Graph()
+    G.add_edge(bin1, bin2)
 
-    assert len(difference_bins) == 2
-    assert difference_bins == {expected_bin1, expected_bin2}
+    # intersection and union are identical to the input bins
+    derived_bins = bin_manager.get_derived_bins(
+        G, excluded_fingerprints={bin1.fingerprint, bin2.fingerprint}
+    )
+    assert len(derived_bins) == 1
+    assert derived_bins.pop().contigs == {"1"}
+
+    # without exclusion, identical bins are created once with merged origins
+    derived_bins = bin_manager.get_derived_bins(G)
+    contigs_to_origin = {frozenset(b.contigs): b.origin for b in derived_bins}
+    assert contigs_to_origin == {
+        frozenset({"2"}): {"intersec"},
+        frozenset({"1"}): {"diff"},
+        frozenset({"1", "2"}): {"union"},
+    }
 
 
-def test_get_union_bins(simple_bin_graph):
+def test_get_derived_bins_parallel_same_as_serial():
+    contig_sets = [
+        {"1", "2", "3"},
+        {"3", "4"},
+        {"1", "3", "6"},
+        {"2", "4", "6"},
+        {"7", "8"},
+        {"8", "9"},
+        {"7", "9", "10"},
+    ]
+    bins = [
+        bin_manager.Bin(contigs=contigs, origin="A", name=f"bin{i}")
+        for i, contigs in enumerate(contig_sets)
+    ]
+    for b in bins:
+        b.completeness = 100
+        b.contamination = 0
 
-    u_bins = bin_manager.get_union_bins(simple_bin_graph)
+    G = bin_manager.from_bins_to_bin_graph(bins)
 
-    expected_bin1 = bin_manager.Bin(contigs={"1", "2", "3", "4"}, origin="U", name="1")
+    def derive(threads):
+        first_id = bin_manager.Bin.counter + 1
+        derived_bins = bin_manager.get_derived_bins(G, threads=threads, batch_size=1)
+        return {
+            (b.id - first_id, frozenset(b.contigs), frozenset(b.origin), b.name)
+            for b in derived_bins
+        }
 
-    assert len(u_bins) == 1
-    assert u_bins == {expected_bin1}
+    assert derive(threads=1) == derive(threads=3)
 
 
 def test_get_bins_from_contig2bin_table(tmp_path):
@@ -660,3 +852,239 @@ def test_get_contigs_in_bin_sets_with_duplicated_warning(example_bin_set1, caplo
     assert (
         duplicate_warning in caplog.text
     ), "The warning for duplicate contigs was not logged correctly."
+
+
+def test_rename_bin_contigs_array_engine():
+    bin_set = [
+        bin_manager.Bin(contigs={"c3", "c1"}, origin="A", name="bin1"),
+    ]
+    contig_to_index = {"c1": 1, "c2": 2, "c3": 3}
+
+    bin_manager.rename_bin_contigs(bin_set, contig_to_index, "array")
+
+    assert isinstance(bin_set[0].contigs, np.ndarray)
+    assert bin_set[0].contigs.tolist() == [1, 3]
+    assert bin_set[0].fingerprint == bin_manager.xor_contig_keys({"c1", "c3"})
+
+
+def test_rename_bin_contigs_unknown_engine():
+    bin_set = [bin_manager.Bin(contigs={"c1"}, origin="A", name="bin1")]
+
+    with pytest.raises(ValueError):
+        bin_manager.rename_bin_contigs(bin_set, {"c1": 1}, "bitmap")
+
+
+def test_array_engine_set_operations():
+    bin1 = bin_manager.Bin(contigs=np.array([5, 1, 6, 7, 8]), origin="A", name="bin1")
+    bin2 = bin_manager.Bin(contigs=np.array([3, 6, 7]), origin="B", name="bin2")
+    bin3 = bin_manager.Bin(contigs=np.array([1, 2, 3, 4, 7]), origin="B", name="bin3")
+
+    assert bin1.intersection(bin2, bin3).contigs.tolist() == [7]
+    assert bin1.difference(bin2, bin3).contigs.tolist() == [5, 8]
+    assert bin1.union(bin2).contigs.tolist() == [1, 3, 5, 6, 7, 8]
+    assert bin1.overlaps_with(bin2) == {6, 7}
+
+    assert bin1.intersection(bin2) == bin_manager.Bin({6, 7}, "", "")
+
+
+def test_create_intermediate_bins_same_result_with_array_engine():
+    contig_sets = [{"1", "2", "3"}, {"3", "4"}, {"5"}, {"1", "3", "6"}, {"2", "4", "6"}]
+    contig_to_index = {str(i): i for i in range(1, 7)}
+
+    def make_bins(engine):
+        bins = {
+            bin_manager.Bin(contigs=contigs, origin="A", name=f"bin{i}")
+            for i, contigs in enumerate(contig_sets)
+        }
+        bin_manager.rename_bin_contigs(bins, contig_to_index, engine)
+        for b in bins:
+            b.completeness = 100
+            b.contamination = 0
+        return bins
+
+    set_bins = bin_manager.create_intermediate_bins(make_bins("set"))
+    array_bins = bin_manager.create_intermediate_bins(make_bins("array"))
+
+    assert {frozenset(b.contigs) for b in set_bins} == {
+        frozenset(b.contigs.tolist()) for b in array_bins
+    }
+
+
+def test_get_contig_key_is_deterministic():
+    key = bin_manager.get_contig_key("contig_1")
+
+    assert key == bin_manager.get_contig_key("contig_1")
+    assert key != bin_manager.get_contig_key("contig_2")
+    assert 0 <= key < 2**128
+
+
+def test_make_contig_keys():
+    contig_to_index = {"c1": 0, "c2": 1}
+
+    contig_keys = bin_manager.make_contig_keys(contig_to_index)
+
+    assert contig_keys.shape == (2, 2)
+    for contig, index in contig_to_index.items():
+        assert bin_manager.xor_contig_keys([index], contig_keys) == (
+            bin_manager.get_contig_key(contig)
+        )
+
+
+def test_bin_fingerprint():
+    bin1 = bin_manager.Bin(contigs={"c1", "c2"}, origin="A", name="bin1")
+    bin2 = bin_manager.Bin(contigs={"c2", "c1"}, origin="B", name="bin2")
+    bin3 = bin_manager.Bin(contigs={"c1", "c3"}, origin="B", name="bin3")
+
+    assert bin1.fingerprint == bin2.fingerprint
+    assert bin1.fingerprint != bin3.fingerprint
+    assert bin1.fingerprint == bin_manager.get_contig_key(
+        "c1"
+    ) ^ bin_manager.get_contig_key("c2")
+    assert hash(bin1) == hash(bin2)
+
+
+@pytest.mark.parametrize("engine", bin_manager.MEMBERSHIP_ENGINES)
+def test_derived_bin_fingerprint(engine):
+    contig_to_index = {f"c{i}": i for i in range(10)}
+    bin1 = bin_manager.Bin(contigs={f"c{i}" for i in range(8)}, origin="A", name="1")
+    bin2 = bin_manager.Bin(contigs={"c6", "c7", "c8", "c9"}, origin="B", name="2")
+
+    bin_manager.rename_bin_contigs([bin1, bin2], contig_to_index, engine)
+
+    for derived_bin in [
+        bin1.intersection(bin2),
+        bin1.difference(bin2),
+        bin1.union(bin2),
+        bin2.difference(bin1),
+    ]:
+        names = {f"c{i}" for i in derived_bin.contigs}
+        assert derived_bin.fingerprint == bin_manager.xor_contig_keys(names)
+
+
+def test_iter_derived_bins_records_derivation():
+    contig_sets = [{"1", "2", "3"}, {"3", "4"}, {"1", "3", "6"}, {"2", "4", "6"}]
+    bins = [
+        bin_manager.Bin(contigs=contigs, origin="A", name=f"bin{i}")
+        for i, contigs in enumerate(contig_sets)
+    ]
+    for b in bins:
+        b.completeness = 100
+        b.contamination = 0
+
+    G = bin_manager.from_bins_to_bin_graph(bins)
+    id_to_bin = {b.id: b for b in bins}
+
+    derived_bins = list(bin_manager.iter_derived_bins(G, batch_size=1))
+
+    assert len(derived_bins) == len({b.fingerprint for b in derived_bins})
+    for b in derived_bins:
+        assert b.derivation[0] in b.origin
+        assert bin_manager.derive_contigs(b.derivation, id_to_bin) == b.contigs
+
+
+def test_select_best_bin_records_same_as_select_best_bins():
+    contig_sets = [
+        {"1", "2", "3"},
+        {"3", "4"},
+        {"1", "3", "6"},
+        {"2", "4", "6"},
+        {"5", "7"},
+    ]
+    original_bins = {
+        bin_manager.Bin(contigs=contigs, origin="A", name=f"bin{i}")
+        for i, contigs in enumerate(contig_sets)
+    }
+    for b in original_bins:
+        b.completeness = 50 + 10 * len(b.contigs)
+        b.contamination = 0
+
+    derived_bins = bin_manager.create_intermediate_bins(original_bins)
+
+    for b in original_bins | derived_bins:
+        b.add_quality(100 - 10 * len(b.contigs), len(b.contigs) % 2, 2)
+        b.add_N50(len(b.contigs))
+        b.add_length(10 * len(b.contigs))
+
+    records = [bin_manager.make_bin_record(b) for b in original_bins | derived_bins]
+    id_to_bin = {b.id: b for b in original_bins}
+
+    selected_from_records = bin_manager.select_best_bin_records(records, id_to_bin)
+    selected_bins = bin_manager.select_best_bins(original_bins | derived_bins)
+
+    assert [(b.id, b.contigs, b.score) for b in selected_from_records] == [
+        (b.id, b.contigs, b.score) for b in selected_bins
+    ]
+
+
+@pytest.mark.parametrize("membership_engine", bin_manager.MEMBERSHIP_ENGINES)
+def test_derivation_overlaps(membership_engine):
+    bin1 = bin_manager.Bin(contigs={"c1", "c2", "c3"}, origin="A", name="bin1")
+    bin2 = bin_manager.Bin(contigs={"c3", "c4"}, origin="A", name="bin2")
+    contig_to_index = {f"c{i}": i for i in range(1, 6)}
+    bin_manager.rename_bin_contigs([bin1, bin2], contig_to_index, membership_engine)
+    id_to_bin = {bin1.id: bin1, bin2.id: bin2}
+
+    for origin in bin_manager.SET_OPERATIONS:
+        derivation = (origin, (bin1.id, bin2.id))
+        derived_contigs = set(
+            bin_manager.iter_contigs(bin_manager.derive_contigs(derivation, id_to_bin))
+        )
+        for contig in range(1, 6):
+            assert bin_manager.derivation_overlaps(derivation, id_to_bin, {contig}) == (
+                contig in derived_contigs
+            )
+
+
+def test_select_best_bin_records_restores_selected_bins_only():
+    bin1 = bin_manager.Bin(contigs={1, 2, 3}, origin="A", name="bin1")
+    bin2 = bin_manager.Bin(contigs={3, 4}, origin="A", name="bin2")
+    for b in [bin1, bin2]:
+        b.add_quality(60, 0, 2)
+        b.add_N50(10)
+        b.add_length(10)
+    derived_bins = [bin1.intersection(bin2), bin1.difference(bin2)]
+    for origin, score, b in zip(["intersec", "diff"], [90, 80], derived_bins):
+        b.derivation = (origin, (bin1.id, bin2.id))
+        b.add_quality(score, 0, 2)
+        b.add_N50(10)
+        b.add_length(10)
+
+    records = [bin_manager.make_bin_record(b) for b in [bin1, bin2, *derived_bins]]
+
+    with patch(
+        "binette.bin_manager.derive_contigs", wraps=bin_manager.derive_contigs
+    ) as mock_derive_contigs:
+        selected_bins = bin_manager.select_best_bin_records(
+            records, {bin1.id: bin1, bin2.id: bin2}
+        )
+
+    # the intersection {3} and the difference {1, 2} are selected, bin1 and bin2 overlap them
+    assert [b.contigs for b in selected_bins] == [{3}, {1, 2}]
+    assert mock_derive_contigs.call_count == 2
+
+
+def test_select_round_input_bins():
+    best_bin = bin_manager.Bin(contigs={1, 2, 3}, origin="A", name="best")
+    alternative1 = bin_manager.Bin(contigs={1, 2}, origin="A", name="alt1")
+    alternative2 = bin_manager.Bin(contigs={3, 4}, origin="A", name="alt2")
+    alternative3 = bin_manager.Bin(contigs={2}, origin="A", name="alt3")
+    other_bin = bin_manager.Bin(contigs={5}, origin="A", name="other")
+
+    bins = {best_bin, alternative1, alternative2, alternative3, other_bin}
+    for score, b in zip(
+        [90, 80, 70, 60, 50],
+        [best_bin, alternative1, alternative2, alternative3, other_bin],
+    ):
+        b.score = score
+        b.N50 = 10
+
+    assert bin_manager.select_round_input_bins(bins, alternative_count=2) == {
+        best_bin,
+        alternative1,
+        alternative2,
+        other_bin,
+    }
+    assert bin_manager.select_round_input_bins(bins, alternative_count=0) == {
+        best_bin,
+        other_bin,
+    }
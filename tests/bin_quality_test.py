@@ -1,8 +1,12 @@
 from itertools import islice
-from binette import bin_quality
+from binette import bin_quality, cache_manager, cds, diamond
 
 from collections import Counter
+import multiprocessing
+import numpy as np
+import pytest
 import pandas as pd
+from scipy import sparse
 from unittest.mock import Mock, patch
 
 from unittest.mock import Mock, patch
@@ -86,28 +90,80 @@ class Bin:
         self.score = comp - weight * cont
 
 
-def test_get_bins_metadata_df():
-    # Mock input data
-    bins = [Bin(1, ["contig1", "contig3"]), Bin(2, ["contig2"])]
+def make_aa_composition(aa_counters):
+    return np.array(
+        [[counter.get(aa, 0) for aa in cds.AMINO_ACIDS] for counter in aa_counters]
+    )
 
-    contig_to_cds_count = {"contig1": 10, "contig2": 45, "contig3": 20, "contig4": 25}
-    contig_to_aa_counter = {
-        "contig1": Counter({"A": 5, "D": 10}),
-        "contig2": Counter({"G": 8, "V": 12, "T": 2}),
-        "contig3": Counter({"D": 8, "Y": 12}),
-    }
-    contig_to_aa_length = {
-        "contig1": 1000,
-        "contig2": 1500,
-        "contig3": 2000,
-        "contig4": 2500,
+
+def test_get_contig_metadata_matrix():
+    contig_cds_count = np.array([10, 45, 0])
+    contig_aa_composition = make_aa_composition(
+        [Counter({"A": 5, "D": 10}), Counter({"Y": 12}), Counter()]
+    )
+    contig_aa_length = np.array([1000, 1500, 0])
+
+    metadata_matrix = bin_quality.get_contig_metadata_matrix(
+        contig_cds_count, contig_aa_composition, contig_aa_length
+    )
+
+    # columns are the 20 amino acids, AALength and CDS
+    assert metadata_matrix.shape == (3, 22)
+    assert metadata_matrix[0].tolist() == [5, 0, 10] + [0] * 17 + [1000, 10]
+    assert metadata_matrix[1].tolist() == [0] * 19 + [12, 1500, 45]
+    assert metadata_matrix[2].tolist() == [0] * 22
+
+
+def test_get_contig_feature_matrices():
+    contig_cds_metadata = {
+        "contig_cds_count": np.array([10, 0]),
+        "contig_aa_composition": make_aa_composition([Counter({"A": 5}), Counter()]),
+        "contig_aa_length": np.array([1000, 0]),
     }
+    contig_ko_matrix = sparse.csr_matrix([[0, 2], [1, 0]])
 
-    # Call the function
-    result_df = bin_quality.get_bins_metadata_df(
-        bins, contig_to_cds_count, contig_to_aa_counter, contig_to_aa_length
+    contig_info = bin_quality.get_contig_feature_matrices(
+        contig_cds_metadata, contig_ko_matrix
     )
 
+    assert contig_info["contig_metadata_matrix"].shape == (2, 22)
+    assert contig_info["contig_metadata_matrix"][0].tolist() == [5] + [0] * 19 + [
+        1000,
+        10,
+    ]
+    assert contig_info["contig_ko_matrix"] is contig_ko_matrix
+    assert contig_info["contig_cds_count"].tolist() == [10, 0]
+
+
+def test_get_bin_contig_matrix():
+    bins = [Bin(1, [0, 2]), Bin(2, np.array([1], dtype=np.int32))]
+
+    bin_contig_matrix = bin_quality.get_bin_contig_matrix(bins, 3)
+
+    assert bin_contig_matrix.toarray().tolist() == [[1, 0, 1], [0, 1, 0]]
+
+
+def test_get_bins_metadata_df():
+    # Mock input data
+    bins = [Bin(1, [0, 2]), Bin(2, [1])]
+
+    contig_cds_count = np.array([10, 45, 20, 25])
+    contig_aa_composition = make_aa_composition(
+        [
+            Counter({"A": 5, "D": 10}),
+            Counter({"G": 8, "V": 12, "T": 2}),
+            Counter({"D": 8, "Y": 12}),
+            Counter(),
+        ]
+    )
+    contig_aa_length = np.array([1000, 1500, 2000, 2500])
+    contig_metadata_matrix = bin_quality.get_contig_metadata_matrix(
+        contig_cds_count, contig_aa_composition, contig_aa_length
+    )
+
+    # Call the function
+    result_df = bin_quality.get_bins_metadata_df(bins, contig_metadata_matrix)
+
     # Define expected values based on the provided input
     expected_columns = [
         "Name",
@@ -149,17 +205,28 @@ def test_get_bins_metadata_df():
 
 def test_get_diamond_feature_per_bin_df():
     # Mock input data
-    bins = [Bin(1, ["contig1", "contig2"]), Bin(2, ["contig3", "contig4"])]
-
-    contig_to_kegg_counter = {
-        "contig1": Counter({"K01810": 5, "K15916": 7}),
-        "contig2": Counter({"K01810": 10}),
-        "contig3": Counter({"K00918": 8}),
-    }
+    bins = [Bin(1, [0, 1]), Bin(2, [2, 3])]
+
+    ko_to_column = diamond.get_ko_to_column()
+    contig_ko_matrix = sparse.csr_matrix(
+        (
+            [5, 7, 10, 8],
+            (
+                [0, 0, 1, 2],
+                [
+                    ko_to_column["K01810"],
+                    ko_to_column["K15916"],
+                    ko_to_column["K01810"],
+                    ko_to_column["K00918"],
+                ],
+            ),
+        ),
+        shape=(4, len(ko_to_column)),
+    )
 
     # Call the function
     result_df, default_ko_count = bin_quality.get_diamond_feature_per_bin_df(
-        bins, contig_to_kegg_counter
+        bins, contig_ko_matrix
     )
 
     expected_index = [1, 2]
@@ -201,10 +268,8 @@ def test_add_bin_metrics(monkeypatch):
 
     contig_info = {
         # Add mocked contig information here as needed
-        "contig_to_kegg_counter": {},
-        "contig_to_cds_count": {},
-        "contig_to_aa_counter": {},
-        "contig_to_aa_length": {},
+        "contig_metadata_matrix": np.zeros((3, 22)),
+        "contig_ko_matrix": sparse.csr_matrix((3, 10)),
         "contig_to_length": {},
     }
 
@@ -212,6 +277,7 @@ def test_add_bin_metrics(monkeypatch):
     threads = 1
 
     monkeypatch.setattr(modelPostprocessing, "modelProcessor", mock_modelProcessor)
+    monkeypatch.setattr(modelProcessing, "modelProcessor", mock_modelProcessor)
 
     # Mock the functions called within add_bin_metrics
     with (
@@ -229,28 +295,28 @@ def test_add_bin_metrics(monkeypatch):
         )
         mock_assess_bins_quality_by_chunk.assert_called_once_with(
             bins,
-            contig_info["contig_to_kegg_counter"],
-            contig_info["contig_to_cds_count"],
-            contig_info["contig_to_aa_counter"],
-            contig_info["contig_to_aa_length"],
+            contig_info["contig_metadata_matrix"],
+            contig_info["contig_ko_matrix"],
             contamination_weight,
             "mock_modelProcessor",  # Mocked postProcessor object
+            threads=threads,
             chunk_size=1000,
+            modelProc="mock_modelProcessor",
+            on_chunk_assessed=None,
+            quality_workers=None,
         )
 
 
 def test_assess_bins_quality_by_chunk(monkeypatch):
     # Prepare input data for testing
     bins = [
-        Bin(1, ["contig1", "contig2"]),
-        Bin(2, ["contig3", "contig4"]),
-        Bin(3, ["contig3", "contig4"]),
+        Bin(1, [1, 2]),
+        Bin(2, [3, 4]),
+        Bin(3, [3, 4]),
     ]
 
-    contig_to_kegg_counter = {}
-    contig_to_cds_count = {}
-    contig_to_aa_counter = {}
-    contig_to_aa_length = {}
+    contig_metadata_matrix = np.zeros((5, 22))
+    contig_ko_matrix = sparse.csr_matrix((5, 10))
     contamination_weight = 0.5
 
     # Mocking postProcessor object
@@ -262,10 +328,8 @@ def test_assess_bins_quality_by_chunk(monkeypatch):
 
         assess_bins_quality_by_chunk(
             bins,
-            contig_to_kegg_counter,
-            contig_to_cds_count,
-            contig_to_aa_counter,
-            contig_to_aa_length,
+            contig_metadata_matrix,
+            contig_ko_matrix,
             contamination_weight,
             postProcessor=None,
             threads=1,
@@ -275,13 +339,12 @@ def test_assess_bins_quality_by_chunk(monkeypatch):
         # Chunk size > number of bin so only one chunk
         mock_assess_bins_quality.assert_called_once_with(
             bins=set(bins),
-            contig_to_kegg_counter=contig_to_kegg_counter,
-            contig_to_cds_count=contig_to_cds_count,
-            contig_to_aa_counter=contig_to_aa_counter,
-            contig_to_aa_length=contig_to_aa_length,
+            contig_metadata_matrix=contig_metadata_matrix,
+            contig_ko_matrix=contig_ko_matrix,
             contamination_weight=contamination_weight,
             postProcessor=None,
             threads=1,
+            modelProc=None,
         )
 
     # Mock the functions called within add_bin_metrics
@@ -289,10 +352,8 @@ def test_assess_bins_quality_by_chunk(monkeypatch):
 
         assess_bins_quality_by_chunk(
             bins,
-            contig_to_kegg_counter,
-            contig_to_cds_count,
-            contig_to_aa_counter,
-            contig_to_aa_length,
+            contig_metadata_matrix,
+            contig_ko_matrix,
             contamination_weight,
             postProcessor=None,
             threads=1,
@@ -311,21 +372,19 @@ from checkm2 import keggData, modelPostprocessing, modelProcessing
 
 def test_assess_bins_quality():
     # Prepare mock input data for testing
-    bins = [Bin(1, ["contig1", "contig2"]), Bin(2, ["contig3", "contig4"])]
+    bins = [Bin(1, [0, 1]), Bin(2, [2, 3])]
 
-    contig_to_kegg_counter = {}
-    contig_to_cds_count = {}
-    contig_to_aa_length = {}
-    contig_to_aa_counter = {}
+    contig_metadata_matrix = bin_quality.get_contig_metadata_matrix(
+        np.zeros(4), np.zeros((4, len(cds.AMINO_ACIDS))), np.zeros(4)
+    )
+    contig_ko_matrix = sparse.csr_matrix((4, len(diamond.get_ko_to_column())))
     contamination_weight = 0.5
 
     # Call the function being tested
     assess_bins_quality(
         bins,
-        contig_to_kegg_counter,
-        contig_to_cds_count,
-        contig_to_aa_counter,
-        contig_to_aa_length,
+        contig_metadata_matrix,
+        contig_ko_matrix,
         contamination_weight,
     )
 
@@ -338,3 +397,509 @@ def test_assess_bins_quality():
             bin_obj.score
             == bin_obj.completeness - bin_obj.contamination * contamination_weight
         )
+
+
+def test_add_bin_metrics_with_quality_cache(monkeypatch, tmp_path):
+    bins = [Bin(1, [0]), Bin(2, [1])]
+    bins[0].fingerprint = 1
+    bins[1].fingerprint = 2
+
+    contig_info = {
+        "contig_metadata_matrix": np.zeros((2, 22)),
+        "contig_ko_matrix": sparse.csr_matrix((2, 10)),
+        "contig_to_length": {0: 10, 1: 20},
+    }
+    quality_cache = cache_manager.init_quality_cache(
+        tmp_path / "cache.sqlite", "assembly", max_entries=10
+    )
+
+    cached_bin = Bin(3, [0])
+    cached_bin.fingerprint = 1
+    cached_bin.add_quality(90, 5, 1)
+    cache_manager.store_bin_qualities(quality_cache, [cached_bin])
+
+    monkeypatch.setattr(modelPostprocessing, "modelProcessor", mock_modelProcessor)
+    monkeypatch.setattr(modelProcessing, "modelProcessor", mock_modelProcessor)
+
+    def mock_assess(bins_to_assess, *args, **kwargs):
+        for bin_obj in bins_to_assess:
+            bin_obj.add_quality(50, 10, 2)
+
+    with patch(
+        "binette.bin_quality.assess_bins_quality_by_chunk", side_effect=mock_assess
+    ) as mock_assess_bins_quality_by_chunk:
+        add_bin_metrics(bins, contig_info, 2, 1, quality_cache)
+
+    # only the bin missing from the cache is assessed
+    assert mock_assess_bins_quality_by_chunk.call_args.args[0] == [bins[1]]
+    assert (bins[0].completeness, bins[0].contamination, bins[0].score) == (90, 5, 80)
+
+    # the newly assessed bin is now in the cache
+    assert cache_manager.get_cached_bin_qualities(quality_cache, [bins[1]]) == {
+        2: (50, 10)
+    }
+    quality_cache["connection"].close()
+
+
+def test_iter_bin_metrics_by_chunk(monkeypatch, tmp_path):
+    bins = [Bin(1, [0]), Bin(2, [1]), Bin(3, [0, 1])]
+    for i, bin_obj in enumerate(bins):
+        bin_obj.fingerprint = i + 1
+
+    contig_info = {
+        "contig_metadata_matrix": np.zeros((2, 22)),
+        "contig_ko_matrix": sparse.csr_matrix((2, 10)),
+        "contig_to_length": {0: 10, 1: 20},
+    }
+    quality_cache = cache_manager.init_quality_cache(
+        tmp_path / "cache.sqlite", "assembly", max_entries=10
+    )
+
+    cached_bin = Bin(4, [0])
+    cached_bin.fingerprint = 1
+    cached_bin.add_quality(90, 5, 1)
+    cache_manager.store_bin_qualities(quality_cache, [cached_bin])
+
+    monkeypatch.setattr(modelPostprocessing, "modelProcessor", mock_modelProcessor)
+    monkeypatch.setattr(modelProcessing, "modelProcessor", mock_modelProcessor)
+
+    def mock_assess(bins, *args, **kwargs):
+        for bin_obj in bins:
+            bin_obj.add_quality(50, 10, 2)
+
+    with patch(
+        "binette.bin_quality.assess_bins_quality", side_effect=mock_assess
+    ) as mock_assess_bins_quality:
+        chunk_iterator = bin_quality.iter_bin_metrics_by_chunk(
+            iter(bins), contig_info, 2, 1, quality_cache, chunk_size=2
+        )
+        chunk_bins = list(chunk_iterator)
+
+    assert chunk_bins == [tuple(bins[:2]), tuple(bins[2:])]
+    # the bin found in the cache is not assessed
+    assert [
+        call.kwargs["bins"] for call in mock_assess_bins_quality.call_args_list
+    ] == [
+        [bins[1]],
+        [bins[2]],
+    ]
+    assert (bins[0].completeness, bins[0].contamination, bins[0].score) == (90, 5, 80)
+    assert bins[2].length == 30
+    quality_cache["connection"].close()
+
+
+def test_iter_bin_metrics_by_chunk_with_checkpoint(monkeypatch, tmp_path):
+    bins = [Bin(1, [0]), Bin(2, [1]), Bin(3, [0, 1])]
+    for i, bin_obj in enumerate(bins):
+        bin_obj.fingerprint = i + 1
+
+    contig_info = {
+        "contig_metadata_matrix": np.zeros((2, 22)),
+        "contig_ko_matrix": sparse.csr_matrix((2, 10)),
+        "contig_to_length": {0: 10, 1: 20},
+    }
+    checkpoint_file = tmp_path / "checkpoint.tsv"
+    quality_checkpoint = cache_manager.init_quality_checkpoint(
+        checkpoint_file, "signature", resume=False
+    )
+    quality_cache = cache_manager.init_quality_cache(
+        tmp_path / "cache.sqlite", "assembly", max_entries=10
+    )
+
+    checkpointed_bin = Bin(4, [1])
+    checkpointed_bin.fingerprint = 2
+    checkpointed_bin.add_quality(90, 5, 1)
+    cache_manager.append_to_quality_checkpoint(quality_checkpoint, [checkpointed_bin])
+
+    monkeypatch.setattr(modelPostprocessing, "modelProcessor", mock_modelProcessor)
+    monkeypatch.setattr(modelProcessing, "modelProcessor", mock_modelProcessor)
+
+    def mock_assess(bins, *args, **kwargs):
+        for bin_obj in bins:
+            bin_obj.add_quality(50, 10, 2)
+
+    with patch(
+        "binette.bin_quality.assess_bins_quality", side_effect=mock_assess
+    ) as mock_assess_bins_quality:
+        list(
+            bin_quality.iter_bin_metrics_by_chunk(
+                iter(bins),
+                contig_info,
+                2,
+                1,
+                quality_cache,
+                chunk_size=2,
+                quality_checkpoint=quality_checkpoint,
+            )
+        )
+    quality_checkpoint["file"].close()
+
+    # the checkpointed bin is not assessed but is stored in the cache
+    assert [
+        call.kwargs["bins"] for call in mock_assess_bins_quality.call_args_list
+    ] == [[bins[0]], [bins[2]]]
+    assert (bins[1].completeness, bins[1].contamination) == (90, 5)
+    assert len(cache_manager.get_cached_bin_qualities(quality_cache, bins)) == 3
+    quality_cache["connection"].close()
+
+    # assessed bins are appended to the checkpoint
+    resumed_checkpoint = cache_manager.init_quality_checkpoint(
+        checkpoint_file, "signature", resume=True
+    )
+    resumed_checkpoint["file"].close()
+    assert len(resumed_checkpoint["bin_key_to_quality"]) == 3
+
+
+def test_add_bin_metrics_with_checkpoint(tmp_path):
+    bins = [Bin(1, [0]), Bin(2, [0, 1])]
+    for i, bin_obj in enumerate(bins):
+        bin_obj.fingerprint = i + 1
+    contig_info = {
+        "contig_metadata_matrix": np.zeros((2, 22)),
+        "contig_ko_matrix": sparse.csr_matrix((2, 10)),
+        "contig_to_length": {0: 10, 1: 20},
+    }
+    quality_models = {"model_processor": "model", "post_processor": "post"}
+    quality_checkpoint = cache_manager.init_quality_checkpoint(
+        tmp_path / "checkpoint.tsv", "signature", resume=False
+    )
+    bins[0].add_quality(90, 5, 2)
+    cache_manager.append_to_quality_checkpoint(quality_checkpoint, [bins[0]])
+    checkpointed_bin = Bin(3, [0])
+    checkpointed_bin.fingerprint = 1
+
+    def mock_assess_by_chunk(bins, *args, on_chunk_assessed, **kwargs):
+        for bin_obj in bins:
+            bin_obj.add_quality(50, 10, 2)
+        on_chunk_assessed(bins)
+
+    with patch(
+        "binette.bin_quality.assess_bins_quality_by_chunk",
+        side_effect=mock_assess_by_chunk,
+    ) as mock_assess_bins_quality_by_chunk:
+        add_bin_metrics(
+            [checkpointed_bin, bins[1]],
+            contig_info,
+            2,
+            quality_models=quality_models,
+            quality_checkpoint=quality_checkpoint,
+        )
+    quality_checkpoint["file"].close()
+
+    assert mock_assess_bins_quality_by_chunk.call_args.args[0] == [bins[1]]
+    assert (checkpointed_bin.completeness, checkpointed_bin.contamination) == (90, 5)
+    assert cache_manager.get_checkpointed_bin_qualities(
+        quality_checkpoint, [bins[1]]
+    ) == {bins[1].id: (50, 10)}
+
+
+def test_assess_bins_quality_by_chunk_calls_on_chunk_assessed():
+    bins = [Bin(1, [1, 2]), Bin(2, [3, 4]), Bin(3, [3, 4])]
+    assessed_chunks = []
+
+    with patch("binette.bin_quality.assess_bins_quality"):
+        assess_bins_quality_by_chunk(
+            bins,
+            np.zeros((5, 22)),
+            sparse.csr_matrix((5, 10)),
+            0.5,
+            threads=1,
+            chunk_size=2,
+            on_chunk_assessed=assessed_chunks.append,
+        )
+
+    assert assessed_chunks == [set(bins[:2]), {bins[2]}]
+
+
+def test_load_quality_models(monkeypatch):
+    monkeypatch.setattr(modelPostprocessing, "modelProcessor", mock_modelProcessor)
+    monkeypatch.setattr(modelProcessing, "modelProcessor", mock_modelProcessor)
+
+    assert bin_quality.load_quality_models(2) == {
+        "model_processor": "mock_modelProcessor",
+        "post_processor": "mock_modelProcessor",
+    }
+
+
+def test_add_bin_metrics_reuses_quality_models():
+    bins = [Bin(1, [0])]
+    contig_info = {
+        "contig_metadata_matrix": np.zeros((1, 22)),
+        "contig_ko_matrix": sparse.csr_matrix((1, 10)),
+        "contig_to_length": {0: 10},
+    }
+    quality_models = {"model_processor": "model", "post_processor": "post"}
+
+    with (
+        patch("binette.bin_quality.load_quality_models") as mock_load_quality_models,
+        patch(
+            "binette.bin_quality.assess_bins_quality_by_chunk"
+        ) as mock_assess_bins_quality_by_chunk,
+    ):
+        add_bin_metrics(bins, contig_info, 2, quality_models=quality_models)
+
+    mock_load_quality_models.assert_not_called()
+    assert mock_assess_bins_quality_by_chunk.call_args.args[4] == "post"
+    assert mock_assess_bins_quality_by_chunk.call_args.kwargs["modelProc"] == "model"
+
+
+def test_share_and_attach_array():
+    array = np.arange(12, dtype=np.int64).reshape(3, 4)
+
+    shm, spec = bin_quality.share_array(array)
+    attached_shm, attached_array = bin_quality.attach_array(spec)
+
+    assert spec[1:] == ((3, 4), array.dtype.str)
+    assert np.array_equal(attached_array, array)
+
+    del attached_array
+    attached_shm.close()
+    shm.close()
+    shm.unlink()
+
+
+class SynchronousPool:
+    """Runs the tasks of iter_chunks_assessed_in_workers in the test process."""
+
+    def apply_async(self, func, args):
+        result = Mock()
+        result.get.return_value = func(*args)
+        return result
+
+
+def test_iter_chunks_assessed_in_workers(monkeypatch):
+    bins = [Bin(1, [0]), Bin(2, [1]), Bin(3, [0, 1])]
+
+    def mock_assess(bins, *args, **kwargs):
+        # qualities computed in the worker are derived from the bin ids
+        for bin_obj in bins:
+            bin_obj.add_quality(bin_obj.id * 10, bin_obj.id, 0)
+
+    monkeypatch.setitem(
+        bin_quality._quality_worker_state,
+        "quality_models",
+        {"model_processor": "model", "post_processor": "post"},
+    )
+    monkeypatch.setitem(
+        bin_quality._quality_worker_state, "contig_metadata_matrix", np.zeros((2, 22))
+    )
+    monkeypatch.setitem(
+        bin_quality._quality_worker_state,
+        "contig_ko_matrix",
+        sparse.csr_matrix((2, 10)),
+    )
+
+    with patch("binette.bin_quality.assess_bins_quality", side_effect=mock_assess):
+        assessed_chunks = list(
+            bin_quality.iter_chunks_assessed_in_workers(
+                [("a", bins[:2]), ("b", []), ("c", bins[2:])],
+                {"pool": SynchronousPool(), "workers": 1},
+                contamination_weight=2,
+            )
+        )
+
+    assert assessed_chunks == [("a", bins[:2]), ("b", []), ("c", bins[2:])]
+    assert [(b.completeness, b.contamination, b.score) for b in bins] == [
+        (10, 1, 8),
+        (20, 2, 16),
+        (30, 3, 24),
+    ]
+
+
+def test_assess_bins_quality_by_chunk_in_workers():
+    bins = [Bin(1, [0]), Bin(2, [1]), Bin(3, [0, 1])]
+    quality_workers = {"pool": SynchronousPool(), "workers": 2}
+
+    def mock_iter_chunks_assessed_in_workers(tagged_chunks, *args, **kwargs):
+        yield from tagged_chunks
+
+    with (
+        patch(
+            "binette.bin_quality.iter_chunks_assessed_in_workers",
+            side_effect=mock_iter_chunks_assessed_in_workers,
+        ) as mock_iter_chunks,
+        patch("binette.bin_quality.assess_bins_quality") as mock_assess_bins_quality,
+    ):
+        assess_bins_quality_by_chunk(
+            bins,
+            np.zeros((2, 22)),
+            sparse.csr_matrix((2, 10)),
+            0.5,
+            threads=2,
+            chunk_size=2,
+            quality_workers=quality_workers,
+        )
+
+    mock_assess_bins_quality.assert_not_called()
+    assert mock_iter_chunks.call_args.args[1] is quality_workers
+
+
+def test_add_bin_metrics_with_quality_workers_does_not_load_models():
+    bins = [Bin(1, [0])]
+    contig_info = {
+        "contig_metadata_matrix": np.zeros((1, 22)),
+        "contig_ko_matrix": sparse.csr_matrix((1, 10)),
+        "contig_to_length": {0: 10},
+    }
+    quality_workers = {"pool": SynchronousPool(), "workers": 2}
+
+    with (
+        patch("binette.bin_quality.load_quality_models") as mock_load_quality_models,
+        patch(
+            "binette.bin_quality.assess_bins_quality_by_chunk"
+        ) as mock_assess_bins_quality_by_chunk,
+    ):
+        add_bin_metrics(
+            bins, contig_info, 2, threads=2, quality_workers=quality_workers
+        )
+
+    mock_load_quality_models.assert_not_called()
+    assert (
+        mock_assess_bins_quality_by_chunk.call_args.kwargs["quality_workers"]
+        is quality_workers
+    )
+
+
+class FakeModelProcessor:
+    """Model processor predicting qualities from the first metadata features."""
+
+    def run_prediction_general(self, vector_array):
+        return vector_array[:, 0], vector_array[:, 1]
+
+    def run_prediction_specific(self, vector_array, specific_model_vector_len):
+        return vector_array[:, 0], vector_array
+
+
+class FakePostProcessor:
+    """Post-processor keeping the predictions of the general model."""
+
+    def calculate_general_specific_ratio(
+        self, vector_array, scaled_features, general_comp, general_cont, specific_comp
+    ):
+        return general_comp, general_cont, None, None
+
+
+def load_fake_quality_models(threads):
+    # Defined at module level so that spawned quality workers can import it.
+    return {
+        "model_processor": FakeModelProcessor(),
+        "post_processor": FakePostProcessor(),
+    }
+
+
+def load_quality_models_failing_in_workers(threads):
+    if multiprocessing.parent_process() is not None:
+        # checkm2 exits when its models cannot be loaded
+        raise SystemExit(1)
+    return load_fake_quality_models(threads)
+
+
+def make_worker_contig_info():
+    aa_composition = np.arange(4 * len(cds.AMINO_ACIDS)).reshape(4, -1)
+    return {
+        "contig_metadata_matrix": bin_quality.get_contig_metadata_matrix(
+            np.array([1, 2, 3, 4]), aa_composition, aa_composition.sum(axis=1)
+        ),
+        "contig_ko_matrix": sparse.csr_matrix((4, len(diamond.get_ko_to_column()))),
+    }
+
+
+def test_quality_workers_assess_bins_in_spawned_processes():
+    contig_info = make_worker_contig_info()
+    bins = [Bin(1, [0]), Bin(2, [1, 2]), Bin(3, [0, 3]), Bin(4, [1, 2, 3])]
+    expected_bins = [Bin(b.id, b.contigs) for b in bins]
+
+    quality_models = load_fake_quality_models(1)
+    assess_bins_quality(
+        expected_bins,
+        contig_info["contig_metadata_matrix"],
+        contig_info["contig_ko_matrix"],
+        contamination_weight=2,
+        postProcessor=quality_models["post_processor"],
+        modelProc=quality_models["model_processor"],
+    )
+
+    quality_workers = bin_quality.start_quality_workers(
+        contig_info["contig_metadata_matrix"],
+        contig_info["contig_ko_matrix"],
+        workers=2,
+        model_loader=load_fake_quality_models,
+    )
+    try:
+        assess_bins_quality_by_chunk(
+            bins,
+            contig_info["contig_metadata_matrix"],
+            contig_info["contig_ko_matrix"],
+            contamination_weight=2,
+            chunk_size=1,
+            quality_workers=quality_workers,
+        )
+    finally:
+        bin_quality.stop_quality_workers(quality_workers)
+
+    assert [(b.completeness, b.contamination, b.score) for b in bins] == [
+        (b.completeness, b.contamination, b.score) for b in expected_bins
+    ]
+
+
+def test_quality_workers_raise_when_models_fail_to_load_in_workers():
+    contig_info = make_worker_contig_info()
+    bins = [Bin(1, [0]), Bin(2, [1, 2])]
+
+    quality_workers = bin_quality.start_quality_workers(
+        contig_info["contig_metadata_matrix"],
+        contig_info["contig_ko_matrix"],
+        workers=2,
+        model_loader=load_quality_models_failing_in_workers,
+    )
+    try:
+        with pytest.raises(RuntimeError, match="failed to load the CheckM2 models"):
+            assess_bins_quality_by_chunk(
+                bins,
+                contig_info["contig_metadata_matrix"],
+                contig_info["contig_ko_matrix"],
+                contamination_weight=2,
+                quality_workers=quality_workers,
+            )
+    finally:
+        bin_quality.stop_quality_workers(quality_workers)
+
+
+def test_start_quality_workers_loads_models_before_starting_workers():
+    with (
+        patch(
+            "binette.bin_quality.load_quality_models", side_effect=SystemExit(1)
+        ) as mock_load_quality_models,
+        patch("multiprocessing.get_context") as mock_get_context,
+    ):
+        with pytest.raises(SystemExit):
+            bin_quality.start_quality_workers(
+                np.zeros((2, 22)),
+                sparse.csr_matrix((2, 10)),
+                workers=2,
+                model_loader=bin_quality.load_quality_models,
+            )
+
+    mock_load_quality_models.assert_called_once_with(1)
+    mock_get_context.assert_not_called()
+
+
+def test_iter_prescreened_bins():
+    bins = [Bin(1, [0]), Bin(2, [1]), Bin(3, [0, 1]), Bin(4, [2])]
+    contig_info = {
+        "contig_cds_count": np.array([10, 5, 20]),
+        # contig 0 and 1 share their only KO
+        "contig_ko_matrix": sparse.csr_matrix([[1, 0, 0], [1, 0, 0], [0, 1, 1]]),
+    }
+
+    prescreened_bins = bin_quality.iter_prescreened_bins(
+        iter(bins), contig_info, min_cds_count=10, min_ko_count=2, chunk_size=3
+    )
+
+    assert list(prescreened_bins) == [bins[3]]
+
+
+def test_iter_prescreened_bins_disabled():
+    bins = [Bin(1, [0])]
+
+    assert list(bin_quality.iter_prescreened_bins(bins, {})) == bins
@@ -0,0 +1,263 @@
+import os
+from binette import cache_manager
+from binette.bin_manager import Bin
+
+import pytest
+
+
+@pytest.fixture
+def quality_cache(tmp_path):
+    cache = cache_manager.init_quality_cache(
+        tmp_path / "cache" / "quality.sqlite", "assembly1", max_entries=10
+    )
+    yield cache
+    cache["connection"].close()
+
+
+def make_scored_bin(contigs, completeness, contamination):
+    bin_obj = Bin(contigs, "test_origin", "bin")
+    bin_obj.add_quality(completeness, contamination, 2)
+    return bin_obj
+
+
+def test_get_assembly_fingerprint(tmp_path):
+    contigs_fasta = tmp_path / "contigs.fasta"
+    contigs_fasta.write_text(">contig1\nACGT\n")
+
+    fingerprint = cache_manager.get_assembly_fingerprint(contigs_fasta)
+
+    # same content gives the same fingerprint
+    assert fingerprint == cache_manager.get_assembly_fingerprint(contigs_fasta)
+
+    # proteins and checkm2 db change the fingerprint
+    proteins = tmp_path / "proteins.faa"
+    proteins.write_text(">contig1_1\nMCGT\n")
+    assert fingerprint != cache_manager.get_assembly_fingerprint(
+        contigs_fasta, proteins
+    )
+    assert fingerprint != cache_manager.get_assembly_fingerprint(
+        contigs_fasta, checkm2_db=tmp_path / "db.dmnd"
+    )
+
+    contigs_fasta.write_text(">contig1\nACGA\n")
+    assert fingerprint != cache_manager.get_assembly_fingerprint(contigs_fasta)
+
+
+def test_get_assembly_stamp(tmp_path):
+    contigs_fasta = tmp_path / "contigs.fasta"
+    contigs_fasta.write_text(">contig1\nACGT\n")
+    os.utime(contigs_fasta, ns=(1, 1))
+
+    stamp = cache_manager.get_assembly_stamp(contigs_fasta)
+    assert stamp == cache_manager.get_assembly_stamp(contigs_fasta)
+
+    proteins = tmp_path / "proteins.faa"
+    proteins.write_text(">contig1_1\nMCGT\n")
+    assert stamp != cache_manager.get_assembly_stamp(contigs_fasta, proteins)
+
+    # the stamp changes with the size or modification time of the files, not their content
+    contigs_fasta.write_text(">contig1\nACGA\n")
+    os.utime(contigs_fasta, ns=(1, 1))
+    assert stamp == cache_manager.get_assembly_stamp(contigs_fasta)
+
+    os.utime(contigs_fasta, ns=(2, 2))
+    assert stamp != cache_manager.get_assembly_stamp(contigs_fasta)
+
+
+def test_store_and_get_cached_bin_qualities(quality_cache):
+    bin1 = make_scored_bin({"contig1", "contig2"}, 90.5, 1.2)
+    bin2 = make_scored_bin({"contig3"}, 40, 10)
+
+    cache_manager.store_bin_qualities(quality_cache, [bin1, bin2])
+
+    # a new bin with the same contigs is retrieved, a bin with other contigs is not
+    same_as_bin1 = Bin({"contig2", "contig1"}, "other_origin", "other_bin")
+    unknown_bin = Bin({"contig1"}, "other_origin", "unknown_bin")
+
+    result = cache_manager.get_cached_bin_qualities(
+        quality_cache, [same_as_bin1, unknown_bin]
+    )
+
+    assert result == {same_as_bin1.id: (90.5, 1.2)}
+
+
+def test_cache_is_specific_to_assembly(quality_cache):
+    bin1 = make_scored_bin({"contig1"}, 90, 1)
+    cache_manager.store_bin_qualities(quality_cache, [bin1])
+
+    other_assembly_cache = dict(quality_cache, assembly_fingerprint="assembly2")
+
+    assert cache_manager.get_cached_bin_qualities(other_assembly_cache, [bin1]) == {}
+
+
+def test_store_bin_qualities_evicts_least_recently_used(quality_cache):
+    quality_cache["max_entries"] = 2
+
+    bin1 = make_scored_bin({"contig1"}, 90, 1)
+    bin2 = make_scored_bin({"contig2"}, 80, 2)
+    bin3 = make_scored_bin({"contig3"}, 70, 3)
+
+    cache_manager.store_bin_qualities(quality_cache, [bin1])
+    cache_manager.store_bin_qualities(quality_cache, [bin2])
+
+    # bin1 is used again so bin2 becomes the least recently used entry
+    cache_manager.get_cached_bin_qualities(quality_cache, [bin1])
+    cache_manager.store_bin_qualities(quality_cache, [bin3])
+
+    result = cache_manager.get_cached_bin_qualities(quality_cache, [bin1, bin2, bin3])
+
+    assert set(result) == {bin1.id, bin3.id}
+
+
+def test_store_bin_qualities_counts_entries_only_beyond_cache_size(quality_cache):
+    quality_cache["max_entries"] = 2
+
+    bin1 = make_scored_bin({"contig1"}, 90, 1)
+    bin2 = make_scored_bin({"contig2"}, 80, 2)
+
+    cache_manager.store_bin_qualities(quality_cache, [bin1, bin2])
+    assert quality_cache["entry_count_bound"] == 2
+
+    # bin1 is replaced: the bound exceeds the cache size but nothing is evicted
+    cache_manager.store_bin_qualities(quality_cache, [bin1])
+    assert quality_cache["entry_count_bound"] == 2
+
+    result = cache_manager.get_cached_bin_qualities(quality_cache, [bin1, bin2])
+    assert set(result) == {bin1.id, bin2.id}
+
+
+def test_init_quality_cache_counts_existing_entries(quality_cache, tmp_path):
+    cache_manager.store_bin_qualities(
+        quality_cache, [make_scored_bin({"contig1"}, 90, 1)]
+    )
+
+    reopened_cache = cache_manager.init_quality_cache(
+        tmp_path / "cache" / "quality.sqlite", "assembly1", max_entries=10
+    )
+
+    assert reopened_cache["entry_count_bound"] == 1
+    reopened_cache["connection"].close()
+
+
+@pytest.fixture
+def ko_hit_cache(tmp_path):
+    cache = cache_manager.init_ko_hit_cache(
+        tmp_path / "cache" / "ko_hit.sqlite", "context1", max_entries=10
+    )
+    yield cache
+    cache["connection"].close()
+
+
+def test_get_ko_hit_context(tmp_path):
+    checkm2_db = tmp_path / "db.dmnd"
+    checkm2_db.write_bytes(b"db")
+
+    context = cache_manager.get_ko_hit_context(checkm2_db.as_posix())
+
+    assert context == cache_manager.get_ko_hit_context(checkm2_db.as_posix())
+
+    checkm2_db.write_bytes(b"new db")
+    assert context != cache_manager.get_ko_hit_context(checkm2_db.as_posix())
+
+
+def test_get_protein_key():
+    assert cache_manager.get_protein_key("MKK") == cache_manager.get_protein_key("MKK")
+    assert cache_manager.get_protein_key("MKK") != cache_manager.get_protein_key("MKR")
+
+
+def test_store_and_get_cached_ko_hits(ko_hit_cache):
+    cache_manager.store_ko_hits(ko_hit_cache, {"key1": "prot~K00001", "key2": None})
+
+    result = cache_manager.get_cached_ko_hits(ko_hit_cache, ["key1", "key2", "key3"])
+
+    # proteins without hit are cached too
+    assert result == {"key1": "prot~K00001", "key2": None}
+
+    other_context_cache = dict(ko_hit_cache, ko_hit_context="context2")
+    assert cache_manager.get_cached_ko_hits(other_context_cache, ["key1"]) == {}
+
+
+def test_store_ko_hits_evicts_least_recently_used(ko_hit_cache):
+    ko_hit_cache["max_entries"] = 2
+
+    cache_manager.store_ko_hits(ko_hit_cache, {"key1": None, "key2": None})
+    cache_manager.store_ko_hits(ko_hit_cache, {"key3": "prot~K00001"})
+
+    result = cache_manager.get_cached_ko_hits(ko_hit_cache, ["key1", "key2", "key3"])
+
+    assert len(result) == 2
+    assert result["key3"] == "prot~K00001"
+
+
+def test_get_quality_checkpoint_signature():
+    bin1 = Bin({"contig1"}, "origin", "bin1")
+    bin2 = Bin({"contig2"}, "origin", "bin2")
+    signature = cache_manager.get_quality_checkpoint_signature(
+        "assembly1", [bin1, bin2], {"rounds": 1}
+    )
+
+    # input bin order does not matter
+    assert signature == cache_manager.get_quality_checkpoint_signature(
+        "assembly1", [bin2, bin1], {"rounds": 1}
+    )
+    # inputs and parameters change the signature
+    assert signature != cache_manager.get_quality_checkpoint_signature(
+        "assembly2", [bin1, bin2], {"rounds": 1}
+    )
+    assert signature != cache_manager.get_quality_checkpoint_signature(
+        "assembly1", [bin1], {"rounds": 1}
+    )
+    assert signature != cache_manager.get_quality_checkpoint_signature(
+        "assembly1", [bin1, bin2], {"rounds": 2}
+    )
+
+
+def test_quality_checkpoint_resume(tmp_path):
+    checkpoint_file = tmp_path / "checkpoint.tsv"
+    bin1 = make_scored_bin({"contig1"}, 90.5, 1.25)
+    bin2 = make_scored_bin({"contig2"}, 80, 2)
+
+    quality_checkpoint = cache_manager.init_quality_checkpoint(
+        checkpoint_file, "signature1", resume=False
+    )
+    cache_manager.append_to_quality_checkpoint(quality_checkpoint, [bin1, bin2])
+    quality_checkpoint["file"].close()
+
+    # a line interrupted by a crash is ignored
+    with open(checkpoint_file, "a") as fl:
+        fl.write("0123\t50")
+
+    quality_checkpoint = cache_manager.init_quality_checkpoint(
+        checkpoint_file, "signature1", resume=True
+    )
+    quality_checkpoint["file"].close()
+
+    same_as_bin1 = Bin({"contig1"}, "other_origin", "other_bin")
+    assert cache_manager.get_checkpointed_bin_qualities(
+        quality_checkpoint, [same_as_bin1, bin2]
+    ) == {same_as_bin1.id: (90.5, 1.25), bin2.id: (80, 2)}
+    assert not checkpoint_file.read_text().endswith("50")
+
+
+@pytest.mark.parametrize(
+    "signature, resume", [("signature2", True), ("signature1", False)]
+)
+def test_quality_checkpoint_invalidated(tmp_path, signature, resume):
+    checkpoint_file = tmp_path / "checkpoint.tsv"
+    bin1 = make_scored_bin({"contig1"}, 90, 1)
+
+    quality_checkpoint = cache_manager.init_quality_checkpoint(
+        checkpoint_file, "signature1", resume=False
+    )
+    cache_manager.append_to_quality_checkpoint(quality_checkpoint, [bin1])
+    quality_checkpoint["file"].close()
+
+    quality_checkpoint = cache_manager.init_quality_checkpoint(
+        checkpoint_file, signature, resume=resume
+    )
+    quality_checkpoint["file"].close()
+
+    assert (
+        cache_manager.get_checkpointed_bin_qualities(quality_checkpoint, [bin1]) == {}
+    )
+    assert len(checkpoint_file.read_text().splitlines()) == 1
@@ -1,8 +1,10 @@
 from binette import cds
+import multiprocessing.pool
+import numpy as np
 import pytest
 import pyrodigal
+import pyfastx
 
-from pathlib import Path
 from unittest.mock import mock_open, patch
 
 import gzip
@@ -44,44 +46,36 @@ def orf_finder():
 
 
 # Predict open reading frames with Pyrodigal using 1 thread.
-def test_predict_orf_with_1_thread(contig1, contig2):
+def test_predict_orf_with_1_thread(contig1, contig2, tmp_path):
 
     contigs_iterator = [contig1, contig2]
-    outfaa = "output.fasta"
+    outfaa = (tmp_path / "output.fasta").as_posix()
     threads = 1
 
-    result = cds.predict(contigs_iterator, outfaa, threads)
+    result = cds.predict(
+        contigs_iterator, outfaa, {"contig1": 0, "contig2": 1}, threads
+    )
 
     assert isinstance(result, dict)
-    assert len(result) == 2
-    assert "contig1" in result
-    assert "contig2" in result
-    assert isinstance(result["contig1"], list)
-    assert isinstance(result["contig2"], list)
-    assert len(result["contig1"]) == 1
-    assert len(result["contig2"]) == 1
-    assert isinstance(result["contig1"][0], str)
-    assert isinstance(result["contig2"][0], str)
+    assert result["contig_cds_count"].tolist() == [1, 1]
+    assert result["contig_aa_composition"].shape == (2, len(cds.AMINO_ACIDS))
+    assert (result["contig_aa_length"] > 0).all()
 
 
-def test_predict_orf_with_multiple_threads(contig1, contig2):
+def test_predict_orf_with_multiple_threads(contig1, contig2, tmp_path):
 
     contigs_iterator = [contig1, contig2]
-    outfaa = "output.fasta"
+    outfaa = (tmp_path / "output.fasta").as_posix()
     threads = 4
 
-    result = cds.predict(contigs_iterator, outfaa, threads)
+    result = cds.predict(
+        contigs_iterator, outfaa, {"contig1": 0, "contig2": 1}, threads
+    )
 
     assert isinstance(result, dict)
-    assert len(result) == 2
-    assert "contig1" in result
-    assert "contig2" in result
-    assert isinstance(result["contig1"], list)
-    assert isinstance(result["contig2"], list)
-    assert len(result["contig1"]) == 1
-    assert len(result["contig2"]) == 1
-    assert isinstance(result["contig1"][0], str)
-    assert isinstance(result["contig2"][0], str)
+    assert result["contig_cds_count"].tolist() == [1, 1]
+    assert result["contig_aa_composition"].shape == (2, len(cds.AMINO_ACIDS))
+    assert (result["contig_aa_length"] > 0).all()
 
 
 def test_predict_genes(contig1, orf_finder):
@@ -95,6 +89,128 @@ def test_predict_genes(contig1, orf_finder):
     assert result[0] == "contig1"
 
 
+def test_predict_writes_translated_genes(contig1, contig2, orf_finder, tmp_path):
+    outfaa = tmp_path / "predicted.faa.gz"
+
+    cds.predict(
+        [contig1, contig2],
+        outfaa.as_posix(),
+        {"contig1": 0, "contig2": 1},
+        threads=2,
+        window_size=1,
+    )
+
+    expected_proteins = [
+        (f"{name}_{i}", gene.translate())
+        for name, seq in [contig1, contig2]
+        for i, gene in enumerate(orf_finder.find_genes(seq), start=1)
+    ]
+    assert expected_proteins
+    assert [
+        (name, seq) for name, seq in pyfastx.Fastx(outfaa.as_posix())
+    ] == expected_proteins
+
+
+def test_predict_gives_proteins_of_the_faa(contig1, contig2, tmp_path):
+    outfaa = tmp_path / "predicted.faa.gz"
+    given_proteins = []
+
+    cds.predict(
+        [contig1, contig2],
+        outfaa.as_posix(),
+        {"contig1": 0, "contig2": 1},
+        threads=2,
+        min_task_length=1,
+        on_proteins=given_proteins.extend,
+    )
+
+    assert given_proteins
+    assert given_proteins == [
+        (name, seq) for name, seq in pyfastx.Fastx(outfaa.as_posix())
+    ]
+
+
+def test_iter_predicted_genes_keeps_order_and_bounds_window():
+    read_tasks = []
+
+    def tasks():
+        for i in range(10):
+            read_tasks.append(i)
+            yield [(f"contig{i}", i)]
+
+    def predict_task(task):
+        return [(name, seq * 10) for name, seq in task], 0.0
+
+    with multiprocessing.pool.ThreadPool(processes=3) as pool:
+        predicted_genes = cds.iter_predicted_genes(
+            pool, predict_task, tasks(), window_size=2
+        )
+
+        contig_and_genes, task_time = next(predicted_genes)
+        assert contig_and_genes == [("contig0", 0)]
+        assert task_time >= 0
+        # only the tasks of the window are read
+        assert read_tasks == [0, 1]
+        assert [contig_and_genes for contig_and_genes, _ in predicted_genes] == [
+            [(f"contig{i}", i * 10)] for i in range(1, 10)
+        ]
+
+
+def test_predict_proteins_of_task(contig1, contig2, orf_finder):
+    contig_to_index = {"contig1": 1, "contig2": 0}
+
+    (contig_count, protein_ids, proteins, cds_counts), task_time = (
+        cds.predict_proteins_of_task(
+            orf_finder.find_genes, contig_to_index, [contig1, contig2]
+        )
+    )
+
+    expected_proteins = [
+        (f"{name}_{i}", gene.translate())
+        for name, seq in [contig1, contig2]
+        for i, gene in enumerate(orf_finder.find_genes(seq), start=1)
+    ]
+    assert contig_count == 2
+    assert list(zip(protein_ids, proteins)) == expected_proteins
+    assert task_time >= 0
+
+    # the contig range of the task is counted at once
+    contig_cds_metadata = cds.make_contig_cds_metadata(2)
+    cds.add_cds_counts_to_contig_metadata(contig_cds_metadata, cds_counts)
+    assert contig_cds_metadata["contig_aa_length"].tolist() == [
+        sum(len(p) for (name, p) in expected_proteins if name.startswith("contig2")),
+        sum(len(p) for (name, p) in expected_proteins if name.startswith("contig1")),
+    ]
+
+
+def test_iter_prediction_tasks():
+    contigs = [("c1", "A" * 10), ("c2", "A" * 4), ("c3", "A" * 4), ("c4", "A" * 1)]
+
+    assert list(cds.iter_prediction_tasks(iter(contigs), min_task_length=8)) == [
+        [contigs[0]],
+        contigs[1:3],
+        contigs[3:],
+    ]
+
+
+def test_iter_contigs_longest_first():
+    class MockSequence:
+        def __init__(self, seq):
+            self.seq = seq
+
+    fasta = {
+        "c1": MockSequence("AA"),
+        "c2": MockSequence("AAAA"),
+        "c3": MockSequence("AA"),
+    }
+
+    assert list(cds.iter_contigs_longest_first(fasta, {"c1": 2, "c2": 4, "c3": 2})) == [
+        ("c2", "AAAA"),
+        ("c1", "AA"),
+        ("c3", "AA"),
+    ]
+
+
 # Extract the contig name from a CDS name.
 def test_extract_contig_name_from_cds_name():
     cds_name = "contig1_gene1"
@@ -105,21 +221,6 @@ def test_extract_contig_name_from_cds_name():
     assert result == "contig1"
 
 
-def test_write_faa(contig1, orf_finder):
-    name, seq = contig1
-    predicted_genes = orf_finder.find_genes(seq)
-    contig_name = "contig"
-    output_file = "tests/tmp_file.faa.gz"
-
-    cds.write_faa(output_file, [(contig_name, predicted_genes)])
-
-    # Check if the file was created and first seq starts
-    # with the contig name as expected
-    assert Path(output_file).exists()
-    with gzip.open(output_file, "rt") as f:
-        assert f.read().startswith(f">{contig_name}")
-
-
 def test_parse_faa_file(tmp_path):
     # Mock a FASTA file of protein sequences
     # at least one protein sequence to not triger the error
@@ -135,14 +236,31 @@ def test_parse_faa_file(tmp_path):
     faa_file.write_text(fasta_content)
 
     # Call the function
-    result = cds.parse_faa_file(faa_file)
+    result = cds.parse_faa_file(faa_file, {"contig1": 0, "contig2": 2, "contig3": 1})
 
-    # Check if the output matches the expected dictionary
-    expected_result = {
-        "contig1": ["MPPPAOSKNSKSS", "CCCCCCCCCCC"],
-        "contig2": ["TTTTTTTTTTTT"],
+    # Check if the output matches the metadata computed from the sequences
+    assert result["contig_cds_count"].tolist() == [2, 0, 1]
+    assert dict(zip(cds.AMINO_ACIDS, result["contig_aa_composition"][2])) == {
+        aa: 12 if aa == "T" else 0 for aa in cds.AMINO_ACIDS
     }
-    assert result == expected_result
+    # characters that are not amino acids count in the amino acid length only
+    assert result["contig_aa_composition"][0].sum() == 23
+    assert result["contig_aa_length"].tolist() == [24, 0, 12]
+
+    # sequences counted one by one give the same metadata
+    result_by_sequence = cds.parse_faa_file(
+        faa_file, {"contig1": 0, "contig2": 2, "contig3": 1}, batch_size=1
+    )
+    for key, array in result.items():
+        assert np.array_equal(result_by_sequence[key], array)
+
+
+def test_parse_faa_file_raises_error_for_unknown_contigs(tmp_path):
+    faa_file = tmp_path / "mock_file.faa"
+    faa_file.write_text(">contig1_gene1\nMPPPAOSKNSKSS\n>contig2_gene1\nMPPPAOS\n")
+
+    with pytest.raises(ValueError, match="1 contigs"):
+        cds.parse_faa_file(faa_file, {"contig1": 0})
 
 
 def test_parse_faa_file_raises_error_for_dna(tmp_path):
@@ -160,46 +278,7 @@ def test_parse_faa_file_raises_error_for_dna(tmp_path):
 
     # Check that ValueError is raised when DNA sequences are encountered
     with pytest.raises(ValueError):
-        cds.parse_faa_file(fna_file)
-
-
-def test_get_aa_composition():
-
-    genes = ["AAAA", "CCCC", "TTTT", "GGGG"]
-
-    result = cds.get_aa_composition(genes)
-
-    assert dict(result) == {"A": 4, "C": 4, "T": 4, "G": 4}
-
-
-def test_get_contig_cds_metadata_flat():
-
-    contig_to_genes = {"c1": ["AAAA", "GGGG", "CCCC"], "c2": ["TTTT", "CCCC"]}
-
-    contig_to_cds_count, contig_to_aa_counter, contig_to_aa_length = (
-        cds.get_contig_cds_metadata_flat(contig_to_genes)
-    )
-
-    assert contig_to_cds_count == {"c1": 3, "c2": 2}
-    assert contig_to_aa_counter == {
-        "c1": {"A": 4, "G": 4, "C": 4},
-        "c2": {"C": 4, "T": 4},
-    }
-    assert contig_to_aa_length == {"c1": 12, "c2": 8}
-
-
-def test_get_contig_cds_metadata():
-
-    contig_to_genes = {"c1": ["AAAA", "GGGG", "CCCC"], "c2": ["TTTT", "CCCC"]}
-
-    contig_metadata = cds.get_contig_cds_metadata(contig_to_genes, 1)
-
-    assert contig_metadata["contig_to_cds_count"] == {"c1": 3, "c2": 2}
-    assert contig_metadata["contig_to_aa_counter"] == {
-        "c1": {"A": 4, "G": 4, "C": 4},
-        "c2": {"C": 4, "T": 4},
-    }
-    assert contig_metadata["contig_to_aa_length"] == {"c1": 12, "c2": 8}
+        cds.parse_faa_file(fna_file, {"contig1": 0, "contig2": 1})
 
 
 # Test function
@@ -281,3 +360,22 @@ def test_filter_faa_file_no_matching_contigs(tmp_path):
 
     # Check the output file is empty
     assert filtered_faa.read_text() == ""
+
+
+def test_add_cds_counts_to_contig_metadata():
+    contig_cds_metadata = cds.make_contig_cds_metadata(3)
+    contig_cds_metadata["contig_cds_count"][2] = 1
+
+    cds.add_cds_counts_to_contig_metadata(
+        contig_cds_metadata,
+        cds.count_cds_of_batch([2, 0, 2], ["AAAA", "GGGG*", "CCCC"]),
+    )
+    # an empty batch has no count
+    cds.add_cds_counts_to_contig_metadata(contig_cds_metadata, None)
+
+    assert contig_cds_metadata["contig_cds_count"].tolist() == [1, 0, 3]
+    assert dict(
+        zip(cds.AMINO_ACIDS, contig_cds_metadata["contig_aa_composition"][2])
+    ) == {aa: 4 if aa in "AC" else 0 for aa in cds.AMINO_ACIDS}
+    # characters that are not amino acids count in the amino acid length only
+    assert contig_cds_metadata["contig_aa_length"].tolist() == [5, 0, 8]
@@ -1,3 +1,4 @@
+import gzip
 import re
 import subprocess
 import shutil
@@ -11,10 +12,7 @@ import sys
 import logging
 import pytest
 
-from binette import diamond
-
-import pandas as pd
-from collections import Counter
+from binette import cache_manager, diamond
 
 
 class CompletedProcess:
@@ -202,53 +200,234 @@ def test_run_diamond_tool_not_found(monkeypatch):
     mock_exit.assert_called_once_with(1)
 
 
-def test_get_contig_to_kegg_id():
+@pytest.fixture
+def faa_file(tmp_path):
+    faa_file = tmp_path / "proteins.faa.gz"
+    with gzip.open(faa_file, "wt") as fl:
+        fl.write(">c1_1\nMKKKKKKKKK\n>c1_2\nMKK\n>c2_1\nMKKKK\n>c2_2\nMKKKKKKK\n")
+    return faa_file
+
+
+def test_split_faa_file(faa_file, tmp_path):
+    shard_faa_files = [tmp_path / "shard_0.faa", tmp_path / "shard_1.faa"]
+
+    protein_counts = diamond.split_faa_file(faa_file, shard_faa_files)
+
+    # each protein goes to the shard with the shortest total length so far
+    assert protein_counts == [1, 3]
+    assert shard_faa_files[0].read_text() == ">c1_1\nMKKKKKKKKK\n"
+    assert (
+        shard_faa_files[1].read_text() == ">c1_2\nMKK\n>c2_1\nMKKKK\n>c2_2\nMKKKKKKK\n"
+    )
+
+
+def mock_diamond_run_on_shard(faa_file, output, db, log, threads, low_mem):
+    # write one hit per protein of the shard in a gzipped table, as diamond does
+    with open(faa_file) as faa_fl, gzip.open(output, "wt") as fl:
+        for line in faa_fl:
+            if line.startswith(">"):
+                fl.write(f"{line[1:].strip()}\tsubject~K12345\n")
+
+
+def test_run_sharded(faa_file, tmp_path):
+    output = tmp_path / "diamond_result.tsv.gz"
+    shard_dir = tmp_path / "diamond_shards"
+
+    with patch(
+        "binette.diamond.run", side_effect=mock_diamond_run_on_shard
+    ) as mock_run:
+        diamond.run_sharded(
+            faa_file, output, "db.dmnd", shard_dir, 3, jobs=2, threads=4
+        )
+
+    assert mock_run.call_count == 3
+    assert {call.args[4] for call in mock_run.call_args_list} == {2}
+    with gzip.open(output, "rt") as fl:
+        merged_proteins = sorted(line.split("\t")[0] for line in fl)
+    assert merged_proteins == ["c1_1", "c1_2", "c2_1", "c2_2"]
+
+    # finished shards are not run again
+    (shard_dir / "shard_1.done").unlink()
+    with patch(
+        "binette.diamond.run", side_effect=mock_diamond_run_on_shard
+    ) as mock_run:
+        diamond.run_sharded(
+            faa_file, output, "db.dmnd", shard_dir, 3, jobs=2, threads=4
+        )
+
+    mock_run.assert_called_once()
+    assert mock_run.call_args.args[0] == (shard_dir / "shard_1.faa").as_posix()
+
+    # shards are split again when the shard count changes
+    with patch(
+        "binette.diamond.run", side_effect=mock_diamond_run_on_shard
+    ) as mock_run:
+        diamond.run_sharded(faa_file, output, "db.dmnd", shard_dir, 2)
+
+    assert mock_run.call_count == 2
+    with gzip.open(output, "rt") as fl:
+        assert len(fl.readlines()) == 4
+
+
+def test_run_sharded_with_empty_shards(faa_file, tmp_path):
+    output = tmp_path / "diamond_result.tsv.gz"
+
+    with patch(
+        "binette.diamond.run", side_effect=mock_diamond_run_on_shard
+    ) as mock_run:
+        diamond.run_sharded(faa_file, output, "db.dmnd", tmp_path / "shards", 6)
+
+    # shards without protein are not run
+    assert mock_run.call_count == 4
+    with gzip.open(output, "rt") as fl:
+        assert len(fl.readlines()) == 4
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_pipelined_run(tmp_path, jobs):
+    output = tmp_path / "diamond_result.tsv.gz"
+    batch_dir = tmp_path / "diamond_batches"
+
+    with patch(
+        "binette.diamond.run", side_effect=mock_diamond_run_on_shard
+    ) as mock_run:
+        with diamond.pipelined_run(
+            output, "db.dmnd", batch_dir, jobs=jobs, min_batch_length=10
+        ) as align_proteins:
+            align_proteins([("c1_1", "MKKKKKKKKK"), ("c1_2", "MKK")])
+            align_proteins([("c2_1", "MKKKK")])
+            align_proteins([("c2_2", "MKKKKKKK")])
+            align_proteins([("c3_1", "MK")])
+
+    # batches are aligned once they reach the minimum length, and the rest at the end
+    assert [call.args[0] for call in mock_run.call_args_list] == [
+        (batch_dir / f"batch_{i}.faa").as_posix() for i in range(3)
+    ]
+    with gzip.open(output, "rt") as fl:
+        assert [line.split("\t")[0] for line in fl] == [
+            "c1_1",
+            "c1_2",
+            "c2_1",
+            "c2_2",
+            "c3_1",
+        ]
+    assert list(batch_dir.iterdir()) == []
+
+
+def test_pipelined_run_error(tmp_path):
+    output = tmp_path / "diamond_result.tsv.gz"
+
+    with patch("binette.diamond.run", side_effect=SystemExit(1)):
+        with pytest.raises(SystemExit):
+            with diamond.pipelined_run(
+                output, "db.dmnd", tmp_path / "diamond_batches", min_batch_length=1
+            ) as align_proteins:
+                align_proteins([("c1_1", "MKKKKKKKKK")])
+
+    assert list(tmp_path.iterdir()) == [tmp_path / "diamond_batches"]
+
+
+def test_run_with_ko_hit_cache(tmp_path):
+    faa_file = tmp_path / "proteins.faa.gz"
+    with gzip.open(faa_file, "wt") as fl:
+        fl.write(">c1_1\nMKKK\n>c1_2\nMRRR\n>c2_1\nMKKK\n>c2_2\nMEEE\n")
+    output = tmp_path / "diamond_result.tsv.gz"
+    aligned_sequences = []
+
+    def align(query_faa_file, query_result_file):
+        # proteins ending with E have no hit
+        with open(query_faa_file) as faa_fl, gzip.open(query_result_file, "wt") as fl:
+            for name, seq in zip(faa_fl, faa_fl):
+                aligned_sequences.append(seq.strip())
+                if not seq.strip().endswith("E"):
+                    fl.write(f"{name[1:].strip()}\t{seq.strip()}~K00001\t55.2\n")
+
+    ko_hit_cache = cache_manager.init_ko_hit_cache(
+        tmp_path / "ko_hit.sqlite", "context", max_entries=10
+    )
+    diamond.run_with_ko_hit_cache(faa_file, output, ko_hit_cache, align)
+
+    # identical sequences are aligned once
+    assert sorted(aligned_sequences) == ["MEEE", "MKKK", "MRRR"]
+    with gzip.open(output, "rt") as fl:
+        assert fl.read() == (
+            "c1_1\tMKKK~K00001\nc1_2\tMRRR~K00001\nc2_1\tMKKK~K00001\n"
+        )
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "diamond_result.tsv.gz",
+        "ko_hit.sqlite",
+        "proteins.faa.gz",
+    ]
+
+    # only proteins missing from the cache are aligned in the next run
+    with gzip.open(faa_file, "wt") as fl:
+        fl.write(">c1_1\nMKKK\n>c3_1\nMEEE\n>c3_2\nMWWW\n")
+    aligned_sequences.clear()
+
+    diamond.run_with_ko_hit_cache(faa_file, output, ko_hit_cache, align)
+    ko_hit_cache["connection"].close()
+
+    assert aligned_sequences == ["MWWW"]
+    with gzip.open(output, "rt") as fl:
+        assert fl.read() == "c1_1\tMKKK~K00001\nc3_2\tMWWW~K00001\n"
+
+
+class MockedKeggCalculator:
+    def return_default_values_from_category(self, category):
+        return {"K12345": 2, "K67890": 1, "K23456": 3}
+
+
+@pytest.fixture
+def diamond_result_file(tmp_path):
+    # Diamond result file with the query and subject IDs followed by other outfmt 6 columns
+    hits = [
+        ("contig1_protein1", "protein1_annotation~K12345"),
+        ("contig1_protein2", "protein2_annotation~K67890"),
+        ("contig2_protein1", "protein3_annotation~K23456"),
+        ("contig2_protein2", "protein4_annotation~K66666"),
+        ("contig_3_protein1", "protein5_annotation~K12345"),
+    ]
+    diamond_result_file = tmp_path / "diamond_result.tsv.gz"
+    with gzip.open(diamond_result_file, "wt") as fl:
+        for protein_id, annotation in hits:
+            fl.write(f"{protein_id}\t{annotation}\t55.2\t100\t0\t0\t1\t100\n")
+
+    return diamond_result_file.as_posix()
+
+
+@pytest.mark.parametrize("chunk_size", [1_000_000, 2, 1])
+def test_get_contig_to_kegg_id(diamond_result_file, chunk_size):
     # Mock input data
-    diamond_result_file = "dummy_diamond_results.txt"
-
-    # Mocked dataframe representing the data read from the Diamond result file
-    mocked_data = {
-        "ProteinID": [
-            "contig1_protein1",
-            "contig1_protein2",
-            "contig2_protein1",
-            "contig2_protein2",
-        ],
-        "annotation": [
-            "protein1_annotation~K12345",
-            "protein2_annotation~K67890",
-            "protein3_annotation~K23456",
-            "protein4_annotation~K66666",
-        ],
-    }
-    mocked_df = pd.DataFrame(mocked_data)
-
-    # Mocked return values for keggData.KeggCalculator() and KeggCalc.return_default_values_from_category()
-    class MockedKeggCalculator:
-        def return_default_values_from_category(self, category):
-            return {"K12345": 2, "K67890": 1, "K23456": 3}
-
-    mocked_kegg_calculator = MockedKeggCalculator()
+    contig_to_index = {"contig1": 0, "contig2": 1, "contig_3": 2, "contig4": 3}
 
     # Mocking relevant functions and classes used within the function
-    with (
-        patch("pandas.read_csv", return_value=mocked_df),
-        patch("checkm2.keggData.KeggCalculator", return_value=mocked_kegg_calculator),
-    ):
+    with patch("checkm2.keggData.KeggCalculator", return_value=MockedKeggCalculator()):
 
         # Call the function
-        result = diamond.get_contig_to_kegg_id(diamond_result_file)
+        result = diamond.get_contig_to_kegg_id(
+            diamond_result_file, contig_to_index, chunk_size=chunk_size
+        )
 
     # K66666 is not in return_default_values_from_category so it won't be kept in result kegg
-
-    # Define the expected output based on the mocked data
-    expected_result = {
-        "contig1": Counter({"K12345": 1, "K67890": 1}),
-        "contig2": Counter({"K23456": 1}),
-    }
+    # columns follow the order of the default KO list: K12345, K67890, K23456
+    expected_result = [
+        [1, 1, 0],
+        [0, 0, 1],
+        [1, 0, 0],
+        [0, 0, 0],
+    ]
 
     # Check if the function output matches the expected result
-    assert result == expected_result
+    assert result.shape == (4, 3)
+    assert result.toarray().tolist() == expected_result
 
 
-# Additional tests can be added to cover more edge cases and scenarios.
+@pytest.mark.parametrize("chunk_size", [1_000_000, 2])
+def test_get_contig_to_kegg_id_unknown_contig(diamond_result_file, chunk_size):
+    contig_to_index = {"contig1": 0, "contig2": 1}
+
+    with patch("checkm2.keggData.KeggCalculator", return_value=MockedKeggCalculator()):
+        with pytest.raises(ValueError, match="1 contigs found"):
+            diamond.get_contig_to_kegg_id(
+                diamond_result_file, contig_to_index, chunk_size=chunk_size
+            )
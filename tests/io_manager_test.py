@@ -281,32 +281,6 @@ def test_write_bins_fasta(tmp_path, bin1, bin2):
         assert bin2_file.read() == ">contig2\nTGCA\n>contig4\nCCCC\n"
 
 
-def test_check_contig_consistency_error():
-    # Mock input data
-    contigs_from_assembly = ["contig1", "contig2", "contig3"]
-    contigs_from_bins = ["contig2", "contig3", "contig4"]
-    assembly_file = "assembly.fasta"
-    elsewhere_file = "external.fasta"
-
-    with pytest.raises(AssertionError):
-        # Call the function
-        io_manager.check_contig_consistency(
-            contigs_from_assembly, contigs_from_bins, assembly_file, elsewhere_file
-        )
-
-
-def test_check_contig_consistency_no_error():
-    # Mock input data
-    contigs_from_assembly = ["contig1", "contig2", "contig3", "contig4"]
-    contigs_from_bins = ["contig1", "contig2", "contig3"]
-    assembly_file = "assembly.fasta"
-    elsewhere_file = "external.fasta"
-
-    io_manager.check_contig_consistency(
-        contigs_from_assembly, contigs_from_bins, assembly_file, elsewhere_file
-    )
-
-
 @pytest.fixture
 def temp_files(tmp_path):
     # Create temporary files for testing
@@ -345,6 +319,26 @@ def test_check_resume_file_missing_diamond(temp_files, caplog):
     assert "Diamond result file" in caplog.text
 
 
+def test_check_resume_file_diamond_shards(temp_files, tmp_path):
+    # Diamond can be resumed from its shards when its result file is missing
+    faa_file, _ = temp_files
+    diamond_shard_dir = tmp_path / "diamond_shards"
+
+    with pytest.raises(FileNotFoundError):
+        io_manager.check_resume_file(
+            Path(faa_file),
+            Path("nonexistent_diamond_result.txt"),
+            diamond_shard_dir=diamond_shard_dir,
+        )
+
+    diamond_shard_dir.mkdir()
+    io_manager.check_resume_file(
+        Path(faa_file),
+        Path("nonexistent_diamond_result.txt"),
+        diamond_shard_dir=diamond_shard_dir,
+    )
+
+
 @patch("binette.io_manager.write_bin_info")
 def test_write_original_bin_metrics(mock_write_bin_info, bin1, bin2, tmp_path):
     # Test that `write_original_bin_metrics` correctly writes bin metrics to files
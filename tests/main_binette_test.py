@@ -3,6 +3,8 @@ import logging
 from binette.main import (
     log_selected_bin_info,
     select_bins_and_write_them,
+    run_refinement_rounds,
+    stream_bins_and_select_them,
     manage_protein_alignement,
     parse_input_files,
     parse_arguments,
@@ -12,12 +14,19 @@ from binette.main import (
     is_valid_file,
 )
 from binette.bin_manager import Bin
-from binette import diamond, contig_manager, cds
+from binette import (
+    bin_manager,
+    bin_quality,
+    diamond,
+    contig_manager,
+    cds,
+    cache_manager,
+)
 import os
 import sys
 from unittest.mock import patch, MagicMock
 
-from collections import Counter
+from scipy import sparse
 from tests.bin_manager_test import create_temp_bin_directories, create_temp_bin_files
 from argparse import ArgumentParser
 from pathlib import Path
@@ -124,21 +133,20 @@ def test_manage_protein_alignement_resume(tmp_path):
 
     faa_file.write_text(faa_file_content)
 
-    contig_to_kegg_id = {
-        "contig1": Counter({"K12345": 1, "K67890": 1}),
-        "contig2": Counter({"K23456": 1}),
-    }
+    contig_to_index = {"contig1": 0, "contig2": 1, "contig3": 2}
+    contig_ko_matrix = sparse.csr_matrix([[1, 1, 0], [0, 0, 1], [0, 0, 0]])
 
-    with patch("binette.diamond.get_contig_to_kegg_id", return_value=contig_to_kegg_id):
+    with patch("binette.diamond.get_contig_to_kegg_id", return_value=contig_ko_matrix):
 
         # Call the function
 
         # Run the function with test data
-        contig_to_kegg_counter, contig_to_genes = manage_protein_alignement(
+        contig_ko_matrix, contig_cds_metadata = manage_protein_alignement(
             faa_file=Path(faa_file),
             contigs_fasta=Path("contigs_fasta"),
             contig_to_length=contig_to_length,
             contigs_in_bins=set(),
+            contig_to_index=contig_to_index,
             diamond_result_file=Path("diamond_result_file"),
             checkm2_db=None,
             threads=1,
@@ -148,9 +156,8 @@ def test_manage_protein_alignement_resume(tmp_path):
         )
 
     # Assertions to check the function output or file existence
-    assert isinstance(contig_to_genes, dict)
-    assert isinstance(contig_to_kegg_counter, dict)
-    assert len(contig_to_genes) == 3
+    assert sparse.issparse(contig_ko_matrix)
+    assert contig_cds_metadata["contig_cds_count"].tolist() == [1, 2, 1]
 
 
 def test_manage_protein_alignement_not_resume(tmpdir, tmp_path):
@@ -166,23 +173,22 @@ def test_manage_protein_alignement_not_resume(tmpdir, tmp_path):
     contigs_fasta = os.path.join(str(tmpdir), "contigs.fasta")
     diamond_result_file = os.path.join(str(tmpdir), "diamond_results.tsv")
 
-    contig_to_kegg_id = {
-        "contig1": Counter({"K12345": 1, "K67890": 1}),
-        "contig2": Counter({"K23456": 1}),
-    }
+    contig_to_index = {"contig1": 0, "contig2": 1, "contig3": 2}
+    contig_ko_matrix = sparse.csr_matrix([[1, 1, 0], [0, 0, 1], [0, 0, 0]])
 
     with (
-        patch("binette.diamond.get_contig_to_kegg_id", return_value=contig_to_kegg_id),
+        patch("binette.diamond.get_contig_to_kegg_id", return_value=contig_ko_matrix),
         patch("binette.diamond.run", return_value=None),
     ):
 
         # Call the function
 
-        contig_to_kegg_counter, contig_to_genes = manage_protein_alignement(
+        contig_ko_matrix, contig_cds_metadata = manage_protein_alignement(
             faa_file=Path(faa_file),
             contigs_fasta=Path(contigs_fasta),
             contig_to_length=contig_to_length,
             contigs_in_bins=set(),
+            contig_to_index=contig_to_index,
             diamond_result_file=Path(diamond_result_file),
             checkm2_db=None,
             threads=1,
@@ -192,9 +198,8 @@ def test_manage_protein_alignement_not_resume(tmpdir, tmp_path):
         )
 
     # Assertions to check the function output or file existence
-    assert isinstance(contig_to_genes, dict)
-    assert isinstance(contig_to_kegg_counter, dict)
-    assert len(contig_to_genes) == 3
+    assert sparse.issparse(contig_ko_matrix)
+    assert contig_cds_metadata["contig_cds_count"].tolist() == [1, 2, 1]
 
 
 def test_parse_input_files_with_contig2bin_tables(tmp_path):
@@ -326,6 +331,28 @@ def test_parse_arguments_optional_arguments(test_environment):
     assert args.outdir == Path("output")
 
 
+def test_parse_arguments_prescreen_disabled_by_default(test_environment):
+    folder1, folder2, contigs_file = test_environment
+    required_args = ["-d", str(folder1), str(folder2), "-c", str(contigs_file)]
+
+    args = parse_arguments(required_args)
+    assert args.prescreen_min_cds == 0
+    assert args.prescreen_min_kos == 0
+
+    with pytest.raises(SystemExit):
+        parse_arguments(required_args + ["--prescreen_min_kos", "-1"])
+
+
+def test_parse_arguments_quality_workers_disabled_by_default(test_environment):
+    folder1, folder2, contigs_file = test_environment
+    required_args = ["-d", str(folder1), str(folder2), "-c", str(contigs_file)]
+
+    assert parse_arguments(required_args + ["-t", "4"]).quality_workers == 0
+
+    with pytest.raises(SystemExit):
+        parse_arguments(required_args + ["--quality_workers", "-1"])
+
+
 def test_parse_arguments_invalid_arguments():
     # Test when invalid arguments are provided
     with pytest.raises(SystemExit):
@@ -333,6 +360,52 @@ def test_parse_arguments_invalid_arguments():
         parse_arguments(["-t", "4"])
 
 
+def test_parse_arguments_rounds_not_available_with_stream_bins(test_environment):
+    folder1, folder2, contigs_file = test_environment
+
+    args = parse_arguments(
+        ["-d", str(folder1), "-c", str(contigs_file), "--rounds", "3"]
+    )
+    assert args.rounds == 3
+
+    with pytest.raises(SystemExit):
+        parse_arguments(
+            [
+                "-d",
+                str(folder1),
+                "-c",
+                str(contigs_file),
+                "--rounds",
+                "3",
+                "--stream_bins",
+            ]
+        )
+
+
+def test_parse_arguments_optimized_selection_not_available_with_stream_bins(
+    test_environment,
+):
+    folder1, folder2, contigs_file = test_environment
+
+    args = parse_arguments(
+        ["-d", str(folder1), "-c", str(contigs_file), "--selection_engine", "optimized"]
+    )
+    assert args.selection_engine == "optimized"
+
+    with pytest.raises(SystemExit):
+        parse_arguments(
+            [
+                "-d",
+                str(folder1),
+                "-c",
+                str(contigs_file),
+                "--selection_engine",
+                "optimized",
+                "--stream_bins",
+            ]
+        )
+
+
 def test_parse_arguments_help():
     # Test the help message
     with pytest.raises(SystemExit) as pytest_wrapped_e:
@@ -357,8 +430,9 @@ def test_manage_protein_alignment_no_resume(tmp_path):
     # Set up the input parameters
     faa_file = Path("test.faa")
     contigs_fasta = Path("test.fasta")
-    contig_to_length = {"contig1": [1000]}
-    contigs_in_bins = {"bin1": ["contig1"]}
+    contig_to_length = {"contig1": 1000}
+    contigs_in_bins = {"contig1"}
+    contig_to_index = {"contig1": 0}
     diamond_result_file = Path("test_diamond_result.txt")
     checkm2_db = tmp_path / "checkm2_db"
     with open(checkm2_db, "w"):
@@ -369,7 +443,7 @@ def test_manage_protein_alignment_no_resume(tmp_path):
 
     # Mock the necessary functions
     with (
-        patch("pyfastx.Fastx") as mock_pyfastx_Fastx,
+        patch("binette.contig_manager.parse_fasta_file") as mock_parse_fasta_file,
         patch("binette.cds.predict") as mock_predict,
         patch("binette.diamond.get_checkm2_db") as mock_get_checkm2_db,
         patch("binette.diamond.run") as mock_diamond_run,
@@ -379,27 +453,35 @@ def test_manage_protein_alignment_no_resume(tmp_path):
     ):
 
         # Set the return value of the mocked functions
-        mock_pyfastx_Fastx.return_value = [("contig1", "ATCG")]
+        mock_parse_fasta_file.return_value = {"contig1": MagicMock(seq="ATCG")}
         mock_predict.return_value = {"contig1": ["gene1"]}
 
         # Call the function
-        contig_to_kegg_counter, contig_to_genes = manage_protein_alignement(
+        contig_ko_matrix, contig_cds_metadata = manage_protein_alignement(
             faa_file,
             contigs_fasta,
             contig_to_length,
             contigs_in_bins,
+            contig_to_index,
             diamond_result_file,
             checkm2_db,
             threads,
             resume,
             resume,
             low_mem,
+            prediction_window=3,
         )
 
         # Assertions to check if functions were called
-        mock_pyfastx_Fastx.assert_called_once()
+        mock_parse_fasta_file.assert_called_once_with(
+            contigs_fasta.as_posix(), index_file="test.fasta.fxi"
+        )
         mock_predict.assert_called_once()
-        mock_diamond_get_contig_to_kegg_id.assert_called_once()
+        assert list(mock_predict.call_args.args[0]) == [("contig1", "ATCG")]
+        assert mock_predict.call_args.kwargs["window_size"] == 3
+        mock_diamond_get_contig_to_kegg_id.assert_called_once_with(
+            diamond_result_file.as_posix(), contig_to_index
+        )
         mock_diamond_run.assert_called_once_with(
             faa_file.as_posix(),
             diamond_result_file.as_posix(),
@@ -410,6 +492,138 @@ def test_manage_protein_alignment_no_resume(tmp_path):
         )
 
 
+def test_manage_protein_alignment_diamond_shards(tmp_path):
+    faa_file = tmp_path / "test.faa"
+    diamond_result_file = tmp_path / "test_diamond_result.txt"
+    checkm2_db = tmp_path / "checkm2_db"
+    checkm2_db.touch()
+    contig_to_index = {"contig1": 0}
+
+    with (
+        patch("binette.cds.parse_faa_file") as mock_parse_faa_file,
+        patch("binette.diamond.run") as mock_diamond_run,
+        patch("binette.diamond.run_sharded") as mock_diamond_run_sharded,
+        patch("binette.diamond.get_contig_to_kegg_id"),
+    ):
+        manage_protein_alignement(
+            faa_file,
+            Path("test.fasta"),
+            {"contig1": 1000},
+            {"contig1"},
+            contig_to_index,
+            diamond_result_file,
+            checkm2_db,
+            threads=8,
+            use_existing_protein_file=True,
+            resume_diamond=False,
+            low_mem=False,
+            diamond_shards=4,
+            diamond_jobs=2,
+        )
+
+    mock_parse_faa_file.assert_called_once_with(faa_file.as_posix(), contig_to_index)
+    mock_diamond_run.assert_not_called()
+    mock_diamond_run_sharded.assert_called_once_with(
+        faa_file,
+        diamond_result_file,
+        checkm2_db.as_posix(),
+        tmp_path / "diamond_shards",
+        4,
+        jobs=2,
+        threads=8,
+        low_mem=False,
+    )
+
+
+def test_manage_protein_alignment_diamond_pipeline(tmp_path):
+    faa_file = tmp_path / "test.faa"
+    diamond_result_file = tmp_path / "test_diamond_result.txt"
+    checkm2_db = tmp_path / "checkm2_db"
+    checkm2_db.touch()
+
+    with (
+        patch("binette.contig_manager.parse_fasta_file") as mock_parse_fasta_file,
+        patch("binette.cds.predict") as mock_predict,
+        patch("binette.diamond.run") as mock_diamond_run,
+        patch("binette.diamond.pipelined_run") as mock_pipelined_run,
+        patch("binette.diamond.get_contig_to_kegg_id"),
+    ):
+        mock_parse_fasta_file.return_value = {"contig1": MagicMock(seq="ATCG")}
+
+        manage_protein_alignement(
+            faa_file,
+            Path("test.fasta"),
+            {"contig1": 1000},
+            {"contig1"},
+            {"contig1": 0},
+            diamond_result_file,
+            checkm2_db,
+            threads=8,
+            use_existing_protein_file=False,
+            resume_diamond=False,
+            low_mem=False,
+            diamond_jobs=2,
+            diamond_pipeline=True,
+        )
+
+    mock_diamond_run.assert_not_called()
+    mock_pipelined_run.assert_called_once_with(
+        diamond_result_file,
+        checkm2_db.as_posix(),
+        tmp_path / "diamond_batches",
+        jobs=2,
+        threads=8,
+        low_mem=False,
+    )
+    align_proteins = mock_pipelined_run.return_value.__enter__.return_value
+    assert mock_predict.call_args.kwargs["on_proteins"] is align_proteins
+
+
+def test_manage_protein_alignment_ko_hit_cache(tmp_path):
+    faa_file = tmp_path / "test.faa"
+    diamond_result_file = tmp_path / "test_diamond_result.txt"
+    checkm2_db = tmp_path / "checkm2_db"
+    checkm2_db.touch()
+    ko_hit_cache_file = tmp_path / "ko_hit_cache.sqlite"
+
+    with (
+        patch("binette.cds.parse_faa_file"),
+        patch("binette.diamond.run") as mock_diamond_run,
+        patch("binette.diamond.run_with_ko_hit_cache") as mock_run_with_ko_hit_cache,
+        patch("binette.diamond.get_contig_to_kegg_id"),
+    ):
+        manage_protein_alignement(
+            faa_file,
+            Path("test.fasta"),
+            {"contig1": 1000},
+            {"contig1"},
+            {"contig1": 0},
+            diamond_result_file,
+            checkm2_db,
+            threads=8,
+            use_existing_protein_file=True,
+            resume_diamond=False,
+            low_mem=False,
+            ko_hit_cache_file=ko_hit_cache_file,
+        )
+
+        mock_run_with_ko_hit_cache.assert_called_once()
+        faa, output, ko_hit_cache, align = mock_run_with_ko_hit_cache.call_args.args
+        assert (faa, output) == (faa_file, diamond_result_file)
+        assert ko_hit_cache_file.exists()
+
+        # diamond is run on the proteins missing from the cache
+        align(tmp_path / "misses.faa", tmp_path / "misses.tsv.gz")
+        mock_diamond_run.assert_called_once_with(
+            (tmp_path / "misses.faa").as_posix(),
+            (tmp_path / "misses.tsv.gz").as_posix(),
+            checkm2_db.as_posix(),
+            (tmp_path / "misses.log").as_posix(),
+            8,
+            low_mem=False,
+        )
+
+
 def test_main_resume_when_not_possible(monkeypatch, test_environment):
     # Define or mock the necessary inputs/arguments
     folder1, folder2, contigs_file = test_environment
@@ -432,7 +646,7 @@ def test_main_resume_when_not_possible(monkeypatch, test_environment):
         main()
 
 
-def test_main(monkeypatch, test_environment):
+def test_main(monkeypatch, test_environment, tmp_path):
     # Define or mock the necessary inputs/arguments
     folder1, folder2, contigs_file = test_environment
     # Mock sys.argv to use test_args
@@ -444,6 +658,8 @@ def test_main(monkeypatch, test_environment):
         str(contigs_file),
         # ... more arguments as required ...
         "--debug",
+        "--outdir",
+        str(tmp_path / "results"),
     ]
     monkeypatch.setattr(sys, "argv", ["your_script.py"] + test_args)
 
@@ -459,6 +675,7 @@ def test_main(monkeypatch, test_environment):
             "binette.bin_manager.create_intermediate_bins"
         ) as mock_create_intermediate_bins,
         patch("binette.bin_quality.add_bin_metrics") as mock_add_bin_metrics,
+        patch("binette.bin_quality.load_quality_models") as mock_load_quality_models,
         patch("binette.main.log_selected_bin_info") as mock_log_selected_bin_info,
         patch("binette.contig_manager.make_contig_index") as mock_make_contig_index,
         patch(
@@ -467,18 +684,30 @@ def test_main(monkeypatch, test_environment):
         patch(
             "binette.main.select_bins_and_write_them"
         ) as mock_select_bins_and_write_them,
+        patch(
+            "binette.cache_manager.get_assembly_fingerprint"
+        ) as mock_get_assembly_fingerprint,
     ):
 
         # Set return values for mocked functions if needed
-        mock_parse_input_files.return_value = (None, None, None)
+        original_bins = {
+            Bin(contigs={"contig1"}, origin="folder1", name="bin1"),
+            Bin(contigs={"contig1"}, origin="folder2", name="bin1"),
+        }
+        mock_parse_input_files.return_value = (
+            original_bins,
+            {"contig1"},
+            {"contig1": 4},
+        )
         mock_manage_protein_alignement.return_value = (
-            {"contig1": 1},
-            {"contig1": ["gene1"]},
+            sparse.csr_matrix((1, 1)),
+            cds.make_contig_cds_metadata(1),
         )
         mock_make_contig_index.return_value = ({}, {})
         mock_apply_contig_index.return_value = MagicMock()
         mock_rename_bin_contigs.return_value = MagicMock()
-        mock_create_intermediate_bins.return_value = MagicMock()
+        intermediate_bins = {Bin(contigs={"contig2"}, origin="union", name="1 | 2")}
+        mock_create_intermediate_bins.return_value = intermediate_bins
         mock_add_bin_metrics.return_value = MagicMock()
         mock_log_selected_bin_info.return_value = MagicMock()
 
@@ -494,9 +723,175 @@ def test_main(monkeypatch, test_environment):
         mock_select_bins_and_write_them.assert_called_once()
         mock_write_original_bin_metrics.assert_called_once()
 
-        assert mock_apply_contig_index.call_count == 3
+        mock_apply_contig_index.assert_called_once()
         assert mock_add_bin_metrics.call_count == 2
 
+        # the pre-screen is disabled by default: every intermediate bin is assessed
+        assert mock_add_bin_metrics.call_args.args[0] == intermediate_bins
+        assert mock_select_bins_and_write_them.call_args.kwargs["all_bins"] == (
+            original_bins | intermediate_bins
+        )
+
+        # models are loaded once and shared by both calls
+        mock_load_quality_models.assert_called_once()
+        assert mock_add_bin_metrics.call_args.kwargs["quality_models"] == (
+            mock_load_quality_models.return_value
+        )
+
+        # the quality cache is only used when a cache file is given
+        assert mock_add_bin_metrics.call_args.args[4] is None
+        # without quality cache, the assembly files are not hashed
+        mock_get_assembly_fingerprint.assert_not_called()
+        assert not list((tmp_path / "results/temporary_files").glob("*.sqlite"))
+
+        # both calls checkpoint their qualities in the temporary directory
+        checkpoints = [
+            call.kwargs["quality_checkpoint"]
+            for call in mock_add_bin_metrics.call_args_list
+        ]
+        assert checkpoints[0] is checkpoints[1]
+        assert checkpoints[0]["bin_key_to_quality"] == {}
+        assert checkpoints[0]["file"].closed
+        assert (
+            tmp_path / "results/temporary_files/bin_quality_checkpoint.tsv"
+        ).exists()
+
+
+def run_main_with_checkpointing_quality(monkeypatch, test_environment, args):
+    """
+    Run main with mocked steps. Assessed bins get a quality derived from their number of contigs,
+    which is appended to the quality checkpoint as add_bin_metrics does.
+
+    :return: The quality checkpoint given to each add_bin_metrics call, as loaded when the run started.
+    """
+    folder1, folder2, contigs_file = test_environment
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["binette", "-d", str(folder1), str(folder2), "-c", str(contigs_file)] + args,
+    )
+
+    loaded_checkpoints = []
+
+    def add_bin_metrics(bins, *args, quality_checkpoint, **kwargs):
+        loaded_checkpoints.append(dict(quality_checkpoint["bin_key_to_quality"]))
+        for b in bins:
+            b.add_quality(10 * len(b.contigs), 1, 2)
+        cache_manager.append_to_quality_checkpoint(quality_checkpoint, bins)
+
+    with (
+        patch("binette.main.parse_input_files") as mock_parse_input_files,
+        patch(
+            "binette.main.manage_protein_alignement"
+        ) as mock_manage_protein_alignement,
+        patch("binette.contig_manager.make_contig_index", return_value=({}, {})),
+        patch("binette.contig_manager.apply_contig_index"),
+        patch("binette.bin_manager.rename_bin_contigs"),
+        patch(
+            "binette.bin_manager.create_intermediate_bins",
+            return_value={Bin(contigs={"contig1", "contig2"}, origin="union", name="")},
+        ),
+        patch("binette.bin_quality.add_bin_metrics", side_effect=add_bin_metrics),
+        patch("binette.bin_quality.load_quality_models"),
+        patch("binette.io_manager.write_original_bin_metrics"),
+        patch("binette.main.select_bins_and_write_them"),
+        patch("binette.main.log_selected_bin_info"),
+    ):
+        mock_parse_input_files.return_value = (
+            {Bin(contigs={"contig1"}, origin="folder1", name="bin1")},
+            {"contig1"},
+            {"contig1": 4},
+        )
+        mock_manage_protein_alignement.return_value = (
+            sparse.csr_matrix((1, 1)),
+            cds.make_contig_cds_metadata(1),
+        )
+        main()
+
+    return loaded_checkpoints
+
+
+def test_main_resumes_from_quality_checkpoint(monkeypatch, test_environment, tmp_path):
+    outdir = tmp_path / "results"
+    args = ["--outdir", str(outdir)]
+
+    run_main_with_checkpointing_quality(monkeypatch, test_environment, args)
+
+    # the protein and diamond files of the interrupted run are required to resume
+    (outdir / "temporary_files/assembly_proteins.faa.gz").touch()
+    (outdir / "temporary_files/diamond_result.tsv.gz").touch()
+
+    loaded_checkpoints = run_main_with_checkpointing_quality(
+        monkeypatch, test_environment, args + ["--resume"]
+    )
+    input_bin_key = cache_manager.get_bin_key(
+        Bin(contigs={"contig1"}, origin="", name="")
+    )
+    assert loaded_checkpoints[0][input_bin_key] == (10, 1)
+    assert len(loaded_checkpoints[0]) == 2
+
+    # the checkpoint is discarded when a parameter changing the assessed bins differs
+    loaded_checkpoints = run_main_with_checkpointing_quality(
+        monkeypatch,
+        test_environment,
+        args + ["--resume", "--contamination_weight", "3"],
+    )
+    assert loaded_checkpoints[0] == {}
+
+    # the checkpoint is not loaded without --resume
+    loaded_checkpoints = run_main_with_checkpointing_quality(
+        monkeypatch, test_environment, args
+    )
+    assert loaded_checkpoints[0] == {}
+
+
+def test_main_stops_quality_workers_when_assessment_fails(
+    monkeypatch, test_environment, tmp_path
+):
+    folder1, folder2, contigs_file = test_environment
+    test_args = ["-d", str(folder1), str(folder2), "-c", str(contigs_file)]
+    test_args += ["--outdir", str(tmp_path / "results"), "--threads", "4"]
+
+    def run_main(args):
+        monkeypatch.setattr(sys, "argv", ["binette"] + test_args + args)
+        with (
+            patch("binette.main.parse_input_files") as mock_parse_input_files,
+            patch(
+                "binette.main.manage_protein_alignement"
+            ) as mock_manage_protein_alignement,
+            patch("binette.contig_manager.make_contig_index", return_value=({}, {})),
+            patch("binette.contig_manager.apply_contig_index"),
+            patch("binette.bin_manager.rename_bin_contigs"),
+            patch(
+                "binette.bin_quality.add_bin_metrics",
+                side_effect=RuntimeError("assessment failed"),
+            ),
+            patch("binette.bin_quality.load_quality_models"),
+            patch("binette.bin_quality.start_quality_workers") as mock_start_workers,
+            patch("binette.bin_quality.stop_quality_workers") as mock_stop_workers,
+        ):
+            mock_parse_input_files.return_value = (
+                {Bin(contigs={"contig1"}, origin="folder1", name="bin1")},
+                {"contig1"},
+                {"contig1": 4},
+            )
+            mock_manage_protein_alignement.return_value = (
+                sparse.csr_matrix((1, 1)),
+                cds.make_contig_cds_metadata(1),
+            )
+            with pytest.raises(RuntimeError, match="assessment failed"):
+                main()
+        return mock_start_workers, mock_stop_workers
+
+    # several threads do not start quality workers on their own
+    mock_start_workers, mock_stop_workers = run_main([])
+    mock_start_workers.assert_not_called()
+    mock_stop_workers.assert_not_called()
+
+    mock_start_workers, mock_stop_workers = run_main(["--quality_workers", "2"])
+    assert mock_start_workers.call_args.args[2] == 2
+    mock_stop_workers.assert_called_once_with(mock_start_workers.return_value)
+
 
 def test_is_valid_file_existing_file(tmp_path: Path):
     """Test is_valid_file with a file that exists."""
@@ -519,3 +914,131 @@ def test_is_valid_file_non_existing_file():
     # Expect the function to call parser.error, which will raise a SystemExit exception
     with pytest.raises(SystemExit):
         is_valid_file(parser, non_existing_file)
+
+
+def test_run_refinement_rounds():
+    contig_sets = [{1, 2, 3}, {3, 4}, {1, 3, 5}, {2, 4, 5}]
+    first_round_bins = {
+        Bin(contigs=contigs, origin="A", name=f"bin{i}")
+        for i, contigs in enumerate(contig_sets)
+    }
+    for b in first_round_bins:
+        b.add_quality(100 - 10 * len(b.contigs), 0, 2)
+        b.N50 = 10
+
+    def mock_add_bin_metrics(new_bins, *args, **kwargs):
+        for b in new_bins:
+            b.add_quality(100 - 10 * len(b.contigs), 0, 2)
+            b.N50 = 10
+
+    contig_info = {"contig_to_length": {i: 10 for i in range(1, 6)}}
+
+    with patch(
+        "binette.bin_quality.add_bin_metrics", side_effect=mock_add_bin_metrics
+    ) as mock_add_metrics:
+        all_bins = run_refinement_rounds(
+            first_round_bins,
+            contig_info,
+            contamination_weight=2,
+            min_completeness=40,
+            rounds=3,
+            round_alternatives=2,
+            threads=1,
+            quality_cache=None,
+        )
+
+    assert first_round_bins < all_bins
+    # bins of a round are never assessed again in a later round
+    assessed_bins = [
+        b for call in mock_add_metrics.call_args_list for b in call.args[0]
+    ]
+    assert len(assessed_bins) == len({b.fingerprint for b in assessed_bins})
+    assert not {b.fingerprint for b in assessed_bins} & {
+        b.fingerprint for b in first_round_bins
+    }
+
+
+def add_quality_from_fingerprint(
+    bins, contig_metadata_matrix, contig_ko_matrix, contamination_weight, **kwargs
+):
+    # distinct bins get distinct scores, so that the selection does not depend on bin ids
+    for b in bins:
+        b.add_quality(
+            50 + (b.fingerprint % 1000) / 20, len(b.contigs) % 3, contamination_weight
+        )
+    return bins
+
+
+@pytest.mark.parametrize("membership_engine", bin_manager.MEMBERSHIP_ENGINES)
+def test_stream_bins_and_select_them_same_as_default_selection(
+    membership_engine, tmp_path
+):
+    contig_sets = [
+        {"c1", "c2", "c3"},
+        {"c3", "c4"},
+        {"c1", "c3", "c6"},
+        {"c2", "c4", "c6"},
+        {"c5", "c7"},
+        {"c5", "c7", "c8"},
+    ]
+    contig_to_index = {f"c{i}": i for i in range(1, 9)}
+    contig_info = {
+        "contig_metadata_matrix": None,
+        "contig_ko_matrix": None,
+        "contig_to_length": {i: 100 * i for i in contig_to_index.values()},
+    }
+    quality_models = {"model_processor": None, "post_processor": None}
+
+    original_bins = {
+        Bin(contigs=contigs, origin="A", name=f"bin{i}")
+        for i, contigs in enumerate(contig_sets)
+    }
+    bin_manager.rename_bin_contigs(original_bins, contig_to_index, membership_engine)
+
+    with (
+        patch(
+            "binette.bin_quality.assess_bins_quality",
+            side_effect=add_quality_from_fingerprint,
+        ),
+        patch("binette.main.write_selected_bins"),
+    ):
+        bin_quality.add_bin_metrics(
+            original_bins, contig_info, 2, quality_models=quality_models
+        )
+
+        streamed_selection = stream_bins_and_select_them(
+            original_bins,
+            contig_info,
+            contamination_weight=2,
+            min_completeness=60,
+            threads=1,
+            quality_cache=None,
+            quality_models=quality_models,
+        )
+
+        new_bins = bin_manager.create_intermediate_bins(
+            original_bins, contig_info["contig_to_length"]
+        )
+        bin_quality.add_bin_metrics(
+            new_bins, contig_info, 2, quality_models=quality_models
+        )
+        default_selection = select_bins_and_write_them(
+            all_bins=original_bins | new_bins,
+            contigs_fasta=tmp_path / "contigs.fasta",
+            final_bin_report=tmp_path / "final_bins_quality_reports.tsv",
+            min_completeness=60,
+            index_to_contig={i: c for c, i in contig_to_index.items()},
+            outdir=tmp_path,
+            temporary_dir=tmp_path,
+            debug=False,
+        )
+
+    # the selection includes intermediate bins, whose contigs are recomputed in streaming mode
+    assert any(b.derivation is not None for b in streamed_selection)
+    assert [
+        (b.fingerprint, b.score, set(bin_manager.iter_contigs(b.contigs)))
+        for b in streamed_selection
+    ] == [
+        (b.fingerprint, b.score, set(bin_manager.iter_contigs(b.contigs)))
+        for b in default_selection
+    ]